@@ -0,0 +1,329 @@
+"""
+This module contains code for running searches and analyses without the GUI,
+e.g. on compute nodes or from cron. Analyses are described by a batch spec, a
+JSON file holding either a single analysis or a list of them, e.g.:
+
+    [{"analysis": "recip_blast",
+      "name": "fwd1", "rev_name": "rev1", "location": "/data/goat",
+      "q_type": "protein", "db_type": "protein",
+      "query_sets": ["my_queries"], "record_sets": ["genomes"],
+      "fwd_evalue": 0.001, "fwd_hits": 10}]
+
+Valid analyses are 'search', 'recip_blast', 'hmmer_blast', 'full_blast_hmmer'
+and 'racc'; see make_search and get_analysis_kwargs below for the keys each
+one uses.
+Queries and databases can be given by id ('queries', 'databases'), by set
+('query_sets', 'record_sets'), or both. Each analysis is run by the same
+pipeline as from the GUI (see searches.analysis_pipeline), so it has the same
+database side effects and can also be resumed from the GUI, and vice versa.
+"""
+
+import json, os, sys, threading, time
+
+from ZODB.POSException import ConflictError
+
+from bin.initialize_goat import configs
+
+from searches import search_obj, search_util, analysis_pipeline, job_table
+from searches import new_search_runner
+from results import result_writer
+from util import executor
+
+# Algorithm of the starting search for each analysis
+start_algorithms = {'recip_blast':'blast', 'hmmer_blast':'hmmer',
+        'full_blast_hmmer':'blast'}
+
+class BatchError(Exception):
+    """Raised for a spec that cannot be run"""
+    pass
+
+class BatchProgress:
+    """
+    Reports progress to a stream, one line per event; replaces the progress
+    window of the GUI. Task events come from the pipeline and job events from
+    the executor, which runs in its own thread.
+    """
+    def __init__(self, stream=sys.stdout):
+        self.stream = stream
+        self.name = None
+        self.num_todo = 0
+        self.num_finished = 0
+        self.to_delete = [] # search output not kept, see add_file_to_delete
+        self._lock = threading.Lock()
+
+    def write(self, message):
+        with self._lock:
+            self.stream.write('{} {}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S'),
+                message))
+            self.stream.flush()
+
+    def start(self, name, num_todo):
+        """Called before each analysis"""
+        self.name = name
+        self.num_todo = num_todo
+        self.num_finished = 0
+        self.write('Starting {} ({} steps)'.format(name, num_todo))
+
+    def task_listener(self, task):
+        """Called by the pipeline for each task event"""
+        if task.is_finished():
+            self.num_finished += 1
+            info = ': {}'.format(task.error) if task.error else ''
+            self.write('[{}/{}] {} {}{}'.format(self.num_finished,
+                self.num_todo, task.name, task.state, info))
+        else:
+            self.write('Running {}'.format(task.name))
+
+    def job_listener(self, job_event):
+        """Called by the executor, from its own thread, for each job event"""
+        if job_event.is_done():
+            self.write('{} {} after {:.1f}s'.format(job_event.name,
+                job_event.state, job_event.elapsed))
+
+    def increment_search_count(self):
+        """Called by search runners; progress is counted in tasks instead"""
+        pass
+
+    def add_file_to_delete(self, filepath):
+        """Called by search runners for output that is not kept"""
+        if not filepath in self.to_delete:
+            self.to_delete.append(filepath)
+
+    def delete_files(self):
+        """Removes output files once an analysis is done with them"""
+        for filepath in self.to_delete:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        self.to_delete = []
+
+def run_spec_file(spec_file, stream=sys.stdout):
+    """Runs all analyses in a batch spec file; returns True if all finished"""
+    with open(spec_file) as i:
+        specs = json.load(i)
+    if isinstance(specs, dict): # a single analysis
+        specs = [specs]
+    return run_specs(specs, stream)
+
+def run_specs(specs, stream=sys.stdout):
+    """
+    Runs each analysis in turn; one that cannot be run is reported, and the
+    others are still run. Returns True if all of them finished.
+    """
+    progress = BatchProgress(stream)
+    executor.get_executor().add_listener(progress.job_listener)
+    all_done = True
+    try:
+        for spec in specs:
+            try:
+                done = run_spec(spec, progress)
+            except(BatchError, KeyError, ValueError, ConflictError,
+                    result_writer.WriteError) as e:
+                progress.write('Could not run {}: {}'.format(
+                    spec.get('name', spec.get('analysis')), e))
+                done = False
+            all_done = all_done and done
+    finally:
+        executor.get_executor().remove_listener(progress.job_listener)
+    return all_done
+
+def run_spec(spec, progress):
+    """Runs a single analysis from its spec"""
+    analysis = spec.get('analysis')
+    if analysis == 'racc':
+        return run_racc(get_queries(spec), progress)
+    if analysis == 'search':
+        mode = 'new'
+        kwargs = {}
+        sobj = make_search(spec, spec.get('algorithm', 'blast'))
+    elif analysis in start_algorithms:
+        mode = analysis
+        kwargs = get_analysis_kwargs(spec)
+        sobj = make_search(spec, start_algorithms[analysis])
+    else:
+        raise BatchError("Unknown analysis {}".format(analysis))
+    configs['search_db'].add_entry(sobj.name, sobj)
+    return run_analysis(sobj, mode, progress, **kwargs)
+
+def run_analysis(start_sobj, mode, progress, rev_search_name=None,
+        keep_rev_output=None, kwargs=None):
+    """Builds and runs the pipeline for a stored search; commits when done"""
+    analysis = analysis_pipeline.AnalysisPipeline(start_sobj, mode,
+            rev_search_name=rev_search_name, keep_rev_output=keep_rev_output,
+            kwargs=kwargs, other_widget=progress,
+            listener=progress.task_listener)
+    progress.start('{} {}'.format(mode, start_sobj.name),
+            analysis.pipeline.count())
+    done = analysis.run()
+    progress.delete_files()
+    for qid,hmm_file in analysis.get_hmm_files().items():
+        progress.write('HMM for {}: {}'.format(qid, hmm_file))
+    progress.write('{} {} {}'.format(mode, start_sobj.name,
+        'finished' if done else 'did not finish; run again with --resume'))
+    return done
+
+def resume_all(stream=sys.stdout):
+    """Runs every analysis that did not finish, like the GUI's resume window"""
+    progress = BatchProgress(stream)
+    executor.get_executor().add_listener(progress.job_listener)
+    all_done = True
+    try:
+        for table in job_table.list_unfinished():
+            try:
+                start_sobj = configs['search_db'][table.name]
+            except(KeyError):
+                progress.write("Search {} no longer exists; cannot resume".format(
+                    table.name))
+                all_done = False
+                continue
+            params = table.params
+            try:
+                done = run_analysis(start_sobj, table.mode, progress,
+                        rev_search_name=params.get('rev_search_name'),
+                        keep_rev_output=params.get('keep_rev_output'),
+                        kwargs=params.get('kwargs', {}))
+            except(ConflictError, result_writer.WriteError) as e:
+                progress.write('Could not resume {}: {}'.format(table.name, e))
+                done = False
+            all_done = all_done and done
+    finally:
+        executor.get_executor().remove_listener(progress.job_listener)
+    return all_done
+
+#####################################
+# Code for reading batch specs      #
+#####################################
+
+def get_queries(spec):
+    """Returns query ids given by id and by query set, without duplicates"""
+    qdb = configs['query_db']
+    qsdb = configs['query_sets']
+    queries = list(spec.get('queries', []))
+    for set_name in spec.get('query_sets', []):
+        queries.extend(qsdb[set_name].list_entries())
+    queries = list(dict.fromkeys(queries)) # no duplicates, in order
+    for qid in queries:
+        qdb[qid] # raises a KeyError for a missing query
+    return queries
+
+def get_databases(spec):
+    """Returns record ids given by id and by record set, without duplicates"""
+    rdb = configs['record_db']
+    rsdb = configs['record_sets']
+    databases = list(spec.get('databases', []))
+    for set_name in spec.get('record_sets', []):
+        databases.extend(rsdb[set_name].list_entries())
+    databases = list(dict.fromkeys(databases))
+    for rid in databases:
+        rdb[rid]
+    return databases
+
+def make_search(spec, algorithm):
+    """Returns the starting search for an analysis, like the GUI forms"""
+    name = spec['name']
+    if name in configs['search_db'].list_entries():
+        raise BatchError("Search {} already exists".format(name))
+    queries = get_queries(spec)
+    databases = get_databases(spec)
+    if not queries or not databases:
+        raise BatchError("No queries or databases given")
+    return search_obj.Search( # be explicit for clarity here
+        name = name,
+        algorithm = algorithm,
+        q_type = spec.get('q_type', 'protein'),
+        db_type = spec.get('db_type', 'protein'),
+        queries = queries,
+        databases = databases,
+        keep_output = spec.get('keep_output', False),
+        output_location = spec['location'],
+        rev_record = spec.get('rev_record')) # for hmmer_blast
+
+def get_analysis_kwargs(spec):
+    """
+    Returns the arguments passed on to the pipeline, as set by the analysis
+    forms of the GUI; keys without a default must be given
+    """
+    kwargs = {'rev_search_name':spec['rev_name'],
+            'keep_rev_output':spec.get('rev_keep_output', False)}
+    if spec['analysis'] == 'full_blast_hmmer':
+        kwargs['kwargs'] = {
+                'fwd_name':spec.get('hmmer_name', 'hmmer'),
+                'rev_name':spec.get('hmmer_rev_name', 'rev2'),
+                'summ_name':spec.get('summary_name', 'fullsumm'),
+                'fwd_evalue':float(spec.get('fwd_evalue', 0.05)),
+                'rev_evalue':float(spec.get('rev_evalue', 0.05)),
+                'next_evalue':float(spec.get('next_evalue', 0.05)),
+                'fwd_hits':int(spec.get('fwd_hits', 10)),
+                'rev_hits':int(spec.get('rev_hits', 10)),
+                'fwd_ko':spec.get('hmmer_keep_output', False),
+                'rev_ko':spec.get('hmmer_rev_keep_output', False),
+                'hmmer_fwd_evalue':get_optional(spec, 'hmmer_fwd_evalue', float),
+                'hmmer_fwd_hits':get_optional(spec, 'hmmer_fwd_hits', int)}
+    else: # optional forward cutoffs, see gui.analyses.analysis_gui
+        kwargs['kwargs'] = {
+                'fwd_evalue':get_optional(spec, 'fwd_evalue', float),
+                'fwd_hits':get_optional(spec, 'fwd_hits', int)}
+    return kwargs
+
+def get_optional(spec, key, convert):
+    """Returns the converted value of an optional key, or None"""
+    value = spec.get(key)
+    return convert(value) if value is not None else None
+
+#####################################
+# Code for searching for raccs      #
+#####################################
+
+def run_racc(queries, progress):
+    """
+    Searches each query against its own record to find its raccs, as is done
+    when queries are added in the GUI; the search and its results are not kept
+    """
+    qdb = configs['query_db']
+    mqdb = configs['misc_queries']
+    udb = configs['result_db']
+    to_search = []
+    for qid in queries:
+        qobj = qdb[qid]
+        if qobj.search_type == 'seq':
+            if (qobj.racc_mode != 'no' and not qobj.search_ran):
+                to_search.append(qid)
+        elif qobj.search_type == 'hmm':
+            for assoc_qid in qobj.associated_queries:
+                if (mqdb[assoc_qid].racc_mode != 'no' and
+                        not mqdb[assoc_qid].search_ran):
+                    to_search.append(assoc_qid)
+    progress.start('racc', len(to_search))
+    if not to_search:
+        return True
+    sobj = search_obj.Search(
+            name='racc_' + str(int(time.time())),
+            algorithm='blast',
+            q_type=None,
+            db_type=None,
+            queries=to_search,
+            databases=None)
+    runner = new_search_runner.SearchRunner(sobj, mode='racc',
+            other_widget=progress)
+    runner.run()
+    runner.parse()
+    def remove_results(): # don't want to keep these in the db
+        for rid in sobj.results:
+            udb.remove_entry(rid)
+    def add_self_blasts(): # done again if it conflicts with another thread
+        for uid in sobj.list_results():
+            robj = udb[uid]
+            try:
+                qobj = qdb[robj.query]
+            except(KeyError):
+                qobj = mqdb[robj.query]
+            search_util.add_self_blast(qobj, robj.parsed_result)
+        remove_results()
+    try:
+        configs['goat_db'].transact(add_self_blasts)
+    except(Exception):
+        configs['goat_db'].transact(remove_results)
+        raise
+    finally:
+        progress.delete_files()
+    progress.write('racc finished for {} queries'.format(len(to_search)))
+    return True
@@ -65,3 +65,7 @@ def get_specific_dbs(db_obj):
     configs['result_db'] = dbs.ResultDB()
     configs['search_db'] = dbs.SearchDB()
     configs['summary_db'] = dbs.SummaryDB()
+    configs['search_cache'] = dbs.SearchCacheDB()
+    configs['summary_tables'] = dbs.SummaryTableDB()
+    configs['job_db'] = dbs.JobDB()
+    configs['distance_cache'] = dbs.DistanceCacheDB()
@@ -0,0 +1,117 @@
+"""
+This module contains persistent containers used in place of plain lists on
+persistent objects. Appending to a list attribute means marking the owning object
+as changed, so ZODB rewrites the whole list (and the object) on every commit,
+and checking membership means scanning the list.
+
+An OrderedTreeSet keeps the order in which keys were added in one BTree (keyed
+on an insertion counter) and looks keys up in another, so that adding a key
+only writes the BTree buckets it touches, and membership is a tree lookup.
+
+Objects stored before these containers existed still hold lists; migrate_root()
+converts these once, when the database is opened (see goat_db.GoatDB).
+"""
+
+from persistent import Persistent
+from BTrees.IOBTree import IOBTree
+from BTrees.OOBTree import OOBTree
+from BTrees.Length import Length
+
+class OrderedTreeSet(Persistent):
+    """
+    Set of keys that iterates in the order they were first added; adding a key
+    that is already present does nothing
+    """
+    def __init__(self, keys=()):
+        self._order = IOBTree() # insertion counter -> key
+        self._index = OOBTree() # key -> insertion counter
+        self._length = Length()
+        self._next = 0
+        for key in keys:
+            self.add(key)
+
+    def __len__(self):
+        return self._length()
+
+    def __iter__(self):
+        return iter(self._order.values())
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, list(self))
+
+    def add(self, key):
+        """Adds key at the end; returns False if it was already present"""
+        if key in self._index:
+            return False
+        self._order[self._next] = key
+        self._index[key] = self._next
+        self._next += 1
+        self._length.change(1)
+        return True
+
+    def append(self, key):
+        """Same as add; for code written against lists"""
+        self.add(key)
+
+    def remove(self, key):
+        """Removes key; raises ValueError if not present, like a list"""
+        try:
+            position = self._index.pop(key)
+        except(KeyError):
+            raise ValueError("{} not in set".format(key))
+        del self._order[position]
+        self._length.change(-1)
+
+# Attributes holding lists that are now OrderedTreeSets, for each class name
+_migrations = {
+    'Search' : ['results'],
+    'Result' : ['int_queries'],
+    'Summary' : ['query_list'],
+    'QuerySummary' : ['db_list'],
+    'ResultSummary' : ['positive_hit_list', 'tentative_hit_list',
+        'unlikely_hit_list'],
+    }
+
+def migrate_object(obj):
+    """
+    Replaces any list attributes of obj listed in _migrations; returns True
+    if anything was changed
+    """
+    changed = False
+    for name in _migrations.get(obj.__class__.__name__, []):
+        value = getattr(obj, name, None)
+        if isinstance(value, list):
+            setattr(obj, name, OrderedTreeSet(value))
+            changed = True
+    return changed
+
+def migrate_summary(summary):
+    """Migrates a summary and all nested summary objects"""
+    changed = migrate_object(summary)
+    for query_sum in summary.queries.values():
+        changed = migrate_object(query_sum) or changed
+        for result_sum in query_sum.dbs.values():
+            changed = migrate_object(result_sum) or changed
+    return changed
+
+def migrate_root(root, commit_every=1000):
+    """
+    Converts list attributes of all searches, results and summaries under the
+    database root; commits every commit_every changed objects, releasing
+    objects from memory in between, so that large databases can be migrated
+    """
+    manager = root._p_jar.transaction_manager # of the opening connection
+    num_changed = 0
+    for node,migrate in (('searches', migrate_object), ('results', migrate_object),
+            ('summaries', migrate_summary)):
+        for obj in root[node].values():
+            if migrate(obj):
+                num_changed += 1
+                if num_changed % commit_every == 0:
+                    manager.commit()
+                    root._p_jar.cacheMinimize()
+    manager.commit()
+    return num_changed
@@ -45,6 +45,10 @@ class DB:
         """Add or modify a search object"""
         self.db.put_entry(self.node, identity, obj)
 
+    def add_entries(self, entries):
+        """Add or modify many objects at once from a dict of identity/obj pairs"""
+        self.db.put_entries(self.node, entries)
+
     def remove_entry(self, identity):
         """Removes a database object"""
         self.db.remove_entry(self.node, identity)
@@ -98,3 +102,19 @@ class SearchDB(DB):
 class SummaryDB(DB):
     def __init__(self):
         DB.__init__(self, 'summaries')
+
+class SearchCacheDB(DB):
+    def __init__(self):
+        DB.__init__(self, 'search_cache')
+
+class SummaryTableDB(DB):
+    def __init__(self):
+        DB.__init__(self, 'summary_tables')
+
+class JobDB(DB):
+    def __init__(self):
+        DB.__init__(self, 'jobs')
+
+class DistanceCacheDB(DB):
+    def __init__(self):
+        DB.__init__(self, 'distance_cache')
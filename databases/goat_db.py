@@ -4,14 +4,31 @@ storing most of the information required for Goat. Each group of data within
 the database is encapsulated by a separate class, each with a reference to the
 corresponding root attribute. Further classes incorporate the objects themselves
 and the code necessary to perform manipulations on them.
+
+Each thread gets its own connection to the database, with its own transaction
+manager; ZODB gives each connection a consistent view of the last committed
+state, so threads do not block each other when reading or writing. Changes made
+in one thread are only seen by another once they are committed, and the other
+thread starts a new transaction (see sync()). Worker threads should commit and
+close their connection when done (see close_connection()). If two threads
+change the same object at once, the second commit fails with a ConflictError;
+the transaction of that thread is aborted and the error is raised again, so
+that the caller knows its changes were lost. Units of work that can simply be
+done again should be run through transact(), which retries them.
 """
 
-import os
-from threading import Lock
+import os, threading
 
+import transaction
 from ZODB import FileStorage, DB
+from ZODB.POSException import ConflictError
 from BTrees.OOBTree import OOBTree
 
+from databases import containers
+
+# Placeholder - should be through settings eventually
+pool_size = 16 # connections kept open for reuse before ZODB warns
+
 class GoatDB:
     """
     Handles connecting to the underlying ZODB database, commiting data
@@ -19,62 +36,143 @@ class GoatDB:
     """
     def __init__(self, filepath):
         """Connects to database file on instantiation"""
+        self._local = threading.local() # connection for each thread
+        self._lock = threading.Lock() # only guards the set of connections
+        self._connections = set()
         if os.path.exists(filepath):
             self.storage = FileStorage.FileStorage(filepath)
-            db = DB(self.storage)
-            connection = db.open()
-            self.root = connection.root()
-            try:
-                self.misc = self.root['misc_queries']
-            except:
-                self.root['misc_queries'] = OOBTree()
-            try:
-                self.squeries = self.root['search_queries']
-            except:
-                self.root['search_queries'] = OOBTree()
-            try:
-                self.qsets = self.root['query_sets']
-            except:
-                self.root['query_sets'] = OOBTree()
-            try:
-                self.rsets = self.root['record_sets']
-            except:
-                self.root['record_sets'] = OOBTree()
+            self.db = DB(self.storage, pool_size=pool_size)
+            root = self.root
+            for node in ('misc_queries', 'search_queries', 'query_sets',
+                    'record_sets', 'search_cache', 'summary_tables', 'jobs',
+                    'distance_cache'):
+                if not node in root:
+                    root[node] = OOBTree()
+            if root.get('version', 0) < 1: # lists from before containers
+                print('Migrating database to persistent containers')
+                containers.migrate_root(root)
+                root['version'] = 1
         else: # first time accessing
             self.storage = FileStorage.FileStorage(filepath)
-            db = DB(self.storage)
-            connection = db.open()
-            self.root = connection.root()
+            self.db = DB(self.storage, pool_size=pool_size)
+            root = self.root
             # create data structures
-            self.root['queries'] = OOBTree()
-            self.root['records'] = OOBTree()
-            self.root['results'] = OOBTree()
-            self.root['searches'] = OOBTree()
-            self.root['summaries'] = OOBTree()
-        self._lock = Lock()
+            for node in ('queries', 'records', 'results', 'searches',
+                    'summaries', 'search_cache', 'summary_tables', 'jobs',
+                    'distance_cache'):
+                root[node] = OOBTree()
+            root['version'] = 1
+        self._commit() # other threads only see committed nodes
+
+    def get_connection(self):
+        """Returns the connection of the calling thread, opening it if needed"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            manager = transaction.TransactionManager()
+            connection = self.db.open(transaction_manager=manager)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.add(connection)
+        return connection
+
+    @property
+    def root(self):
+        """Root of the database, as seen by the calling thread"""
+        return self.get_connection().root()
 
     def _commit(self):
+        """
+        Commits the changes of the calling thread; if they conflict with
+        changes committed by another thread, they are aborted and the
+        ConflictError is raised again
+        """
         #print('commiting changes')
-        import transaction
-        with self._lock:
-            transaction.commit()
+        manager = self.get_connection().transaction_manager
+        try:
+            manager.commit()
+        except(ConflictError) as e:
+            print('Could not commit changes: {}'.format(e))
+            manager.abort()
+            raise
+        return True
+
+    def sync(self):
+        """
+        Commits the changes of the calling thread, after which it sees all
+        changes committed by other threads; raises a ConflictError as
+        _commit() does
+        """
+        return self._commit()
+
+    def abort(self):
+        """Discards uncommitted changes of the calling thread"""
+        self.get_connection().transaction_manager.abort()
+
+    def transact(self, func, retries=3):
+        """
+        Calls func and commits, starting over up to retries times if the
+        commit conflicts with another thread; func should only make changes
+        to the database, as it may be called more than once. Returns what
+        func returns, or raises the last ConflictError; changes are aborted
+        if func raises any other error.
+        """
+        manager = self.get_connection().transaction_manager
+        for attempt in range(retries + 1):
+            try:
+                result = func()
+                manager.commit()
+                return result
+            except(ConflictError) as e:
+                manager.abort()
+                print('Conflict on attempt {}: {}'.format(attempt + 1, e))
+                if attempt == retries:
+                    raise
+            except(Exception):
+                manager.abort()
+                raise
+
+    def close_connection(self, commit=True):
+        """
+        Commits (or aborts) and closes the connection of the calling thread;
+        the connection is closed even if the commit raises a ConflictError
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            return
+        try:
+            if commit:
+                self._commit()
+            else:
+                connection.transaction_manager.abort()
+        finally:
+            self._local.connection = None
+            with self._lock:
+                self._connections.discard(connection)
+            connection.close()
 
     def close(self):
-        self.storage.close()
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for connection in connections:
+            try:
+                connection.transaction_manager.abort()
+                connection.close()
+            except(Exception):
+                pass # e.g. closed by a thread that is still finishing
+        self.db.close()
 
     def list_entries(self, node):
-        with self._lock:
-            return self.root[node].keys() # note: iterator!
+        return self.root[node].keys() # note: iterator!
 
     def fetch_entry(self, node, key):
-        with self._lock:
-            return self.root[node][key]
+        return self.root[node][key]
 
     def put_entry(self, node, key, entry):
-        with self._lock:
-            self.root[node][key] = entry
+        self.root[node][key] = entry
 
-    def remove_entry(self, node, key):
-        with self._lock:
-            del self.root[node][key]
+    def put_entries(self, node, entries):
+        self.root[node].update(entries) # one BTree update for all
 
+    def remove_entry(self, node, key):
+        del self.root[node][key]
@@ -1,15 +1,47 @@
 #!/usr/bin/env python3
 
-import os, sys
+import os, sys, argparse
 
 from bin import initialize_goat
-from gui import main_gui
 
 goat_dir = os.path.dirname(os.path.realpath(sys.argv[0]))
 
 def goat_gui():
+    from gui import main_gui # Tk is only needed for the GUI
     initialize_goat.initialize(goat_dir)
     main_gui.run()
 
+def goat_batch(spec_file=None, resume=False, log_file=None):
+    """
+    Runs analyses without the GUI; progress goes to log_file, if given, or
+    else to the terminal. Returns True if all analyses finished.
+    """
+    from bin import batch
+    initialize_goat.initialize(goat_dir)
+    stream = open(log_file, 'a') if log_file else sys.stdout
+    try:
+        done = True
+        if resume:
+            done = batch.resume_all(stream)
+        if spec_file:
+            done = batch.run_spec_file(spec_file, stream) and done
+    finally:
+        initialize_goat.configs['goat_db'].close()
+        if log_file:
+            stream.close()
+    return done
+
 if __name__ == '__main__':
-    goat_gui()
+    parser = argparse.ArgumentParser(description='Runs Goat; without options,'
+            ' starts the GUI')
+    parser.add_argument('--batch', metavar='SPEC', help='run the analyses in a'
+            ' JSON batch spec without the GUI (see bin/batch.py)')
+    parser.add_argument('--resume', action='store_true', help='run all'
+            ' analyses that did not finish, without the GUI')
+    parser.add_argument('--log', metavar='FILE', help='append progress of'
+            ' batch runs to FILE instead of the terminal')
+    args = parser.parse_args()
+    if args.batch or args.resume:
+        sys.exit(0 if goat_batch(args.batch, args.resume, args.log) else 1)
+    else:
+        goat_gui()
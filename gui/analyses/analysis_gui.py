@@ -10,7 +10,7 @@ from bin.initialize_goat import configs
 
 from gui.util import gui_util, input_form
 from gui.searches import search_gui, new_threaded_search
-from searches import search_obj
+from searches import search_obj, job_table
 
 #####################################################
 # Code for choosing the kind of analysis to perform #
@@ -56,6 +56,75 @@ class AnalysisPicker(Frame):
         """Close without doing anything"""
         self.parent.destroy()
 
+#####################################################
+# Code for resuming an analysis that did not finish #
+#####################################################
+
+class ResumeFrame(Frame):
+    """
+    Lists searches and analyses that did not finish, e.g. because Goat was
+    closed, and runs them again; only jobs that are not done are run
+    """
+    def __init__(self, parent=None):
+        Frame.__init__(self, parent)
+        self.parent = parent
+        self.sdb = configs['search_db']
+        self.tables = {}
+        for table in job_table.list_unfinished():
+            counts = table.count_jobs()
+            label = '{} ({}, {} of {} jobs done)'.format(table.name,
+                    table.mode, counts.get('done', 0), sum(counts.values()))
+            self.tables[label] = table
+        self.analysis = gui_util.ComboBoxFrame(self, list(self.tables.keys()),
+                'Please choose an analysis to resume')
+        self.pack(expand=YES, fill=BOTH)
+        self.toolbar = Frame(self)
+        self.toolbar.pack(side=BOTTOM, expand=YES, fill=X)
+
+        self.buttons = [('Resume', self.onRun, {'side':RIGHT}),
+                        ('Cancel', self.onCancel, {'side':RIGHT})]
+        for (label, action, where) in self.buttons:
+            Button(self.toolbar, text=label, command=action).pack(where)
+
+    def onRun(self):
+        """Starts the chosen analysis again with its original parameters"""
+        try:
+            table = self.tables[self.analysis.selected.get()]
+        except(KeyError): # nothing chosen
+            return
+        try:
+            start_sobj = self.sdb[table.name]
+        except(KeyError):
+            print("Search {} no longer exists; cannot resume".format(table.name))
+            return
+        params = table.params
+        window = Toplevel()
+        prog_frame = new_threaded_search.ProgressFrame(
+                start_sobj, table.mode, window, other_widget=self,
+                callback=self.resume_callback,
+                callback_args = [], # list of things to delete
+                rev_search_name=params.get('rev_search_name'),
+                keep_rev_output=params.get('keep_rev_output'),
+                **params.get('kwargs', {}))
+        prog_frame.run()
+        # Can destroy once run starts
+        self.onCancel()
+
+    def onCancel(self):
+        """Close without doing anything"""
+        self.parent.destroy()
+
+    def resume_callback(self, *to_delete):
+        """Commit changes in multiple databases"""
+        for filepath in to_delete:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        configs['threads'].remove_thread()
+        configs['search_queries'].commit()
+        configs['search_db'].commit()
+        configs['result_db'].commit()
+        configs['summary_db'].commit()
+
 ###############################################################
 # Code for setting up and running a reciprocal BLAST analysis #
 ###############################################################
@@ -79,6 +148,7 @@ class ReciprocalBLASTFrame(Frame):
         """Collect all relevant information and call reciprocal BLAST"""
         params = self.search.param_frame
         fwd_name,rev_name,location,fwd_qtype,fwd_dbtype,fwd_ko,rev_ko = params.get_current_values()
+        fwd_evalue,fwd_hits = params.get_cutoff_values()
         queries = self.search.query_frame.querybox
         dbs = self.search.db_frame.db_box
         fwd_sobj = search_obj.Search( # be explicit for clarity here
@@ -98,7 +168,8 @@ class ReciprocalBLASTFrame(Frame):
         prog_frame = new_threaded_search.ProgressFrame(
                 fwd_sobj, 'recip_blast', window, other_widget=self,
                 callback=self.recip_blast_callback,
-                rev_search_name=rev_name, keep_rev_output=rev_ko)
+                rev_search_name=rev_name, keep_rev_output=rev_ko,
+                fwd_evalue=fwd_evalue, fwd_hits=fwd_hits)
         prog_frame.run()
         # Can destroy once run starts
         self.onCancel()
@@ -142,6 +213,10 @@ class ReciprocalBLASTParams(Frame):
         self.db_type = gui_util.RadioBoxFrame(self,
                 [('Protein','protein'), ('Genomic','genomic')],
                 labeltext='Target data type')
+        # Optional; if given, reverse searches only run for forward hits that
+        # a summary with the same cutoffs would look at
+        self.cutoffs = input_form.DefaultValueForm(
+                [('Maximum forward evalue',''),('Max forward hits','')], self)
         self.fwd_ko = gui_util.CheckBoxFrame(
                 self, 'Keep forward search output files?')
         self.rev_ko = gui_util.CheckBoxFrame(
@@ -165,6 +240,10 @@ class ReciprocalBLASTParams(Frame):
                 self.fwd_ko.button_checked(),
                 self.rev_ko.button_checked())
 
+    def get_cutoff_values(self):
+        """Returns forward evalue and max hits; None if left blank"""
+        return get_forward_cutoffs(self.cutoffs)
+
 ##################################################################
 # Code for setting up and running a fwd HMMer/rev BLAST analysis #
 ##################################################################
@@ -189,6 +268,7 @@ class HMMerBLASTFrame(Frame):
         params = self.search.param_frame
         (fwd_name,rev_name,location,rev_record,\
             fwd_qtype,fwd_dbtype,fwd_ko,rev_ko) = params.get_current_values()
+        fwd_evalue,fwd_hits = params.get_cutoff_values()
         queries = self.search.query_frame.querybox
         dbs = self.search.db_frame.db_box
         fwd_sobj = search_obj.Search( # be explicit for clarity here
@@ -209,7 +289,8 @@ class HMMerBLASTFrame(Frame):
         prog_frame = new_threaded_search.ProgressFrame(
                 fwd_sobj, 'hmmer_blast', window, other_widget=self,
                 callback=self.hmmer_blast_callback,
-                rev_search_name=rev_name, keep_rev_output=rev_ko)
+                rev_search_name=rev_name, keep_rev_output=rev_ko,
+                fwd_evalue=fwd_evalue, fwd_hits=fwd_hits)
         prog_frame.run()
         # Can destroy once run starts
         self.onCancel()
@@ -257,6 +338,10 @@ class HMMerBLASTParams(Frame):
         self.db_type = gui_util.RadioBoxFrame(self,
                 [('Protein','protein'), ('Genomic','genomic')],
                 labeltext='Target data type')
+        # Optional; if given, reverse searches only run for forward hits that
+        # a summary with the same cutoffs would look at
+        self.cutoffs = input_form.DefaultValueForm(
+                [('Maximum forward evalue',''),('Max forward hits','')], self)
         self.fwd_ko = gui_util.CheckBoxFrame(
                 self, 'Keep forward search output files?')
         self.rev_ko = gui_util.CheckBoxFrame(
@@ -281,6 +366,17 @@ class HMMerBLASTParams(Frame):
                 self.fwd_ko.button_checked(),
                 self.rev_ko.button_checked())
 
+    def get_cutoff_values(self):
+        """Returns forward evalue and max hits; None if left blank"""
+        return get_forward_cutoffs(self.cutoffs)
+
+def get_forward_cutoffs(cutoffs):
+    """Returns optional forward cutoffs from a form; blank entries are None"""
+    evalue = cutoffs.get('Maximum forward evalue').strip()
+    max_hits = cutoffs.get('Max forward hits').strip()
+    return ((float(evalue) if evalue else None),
+            (int(max_hits) if max_hits else None))
+
 #############################################################
 # Code for setting up and running full BLAST/HMMer analysis #
 #############################################################
@@ -320,6 +416,9 @@ class FullBLASTHMMerFrame(Frame):
         int_args = {}
         for k,v in zip(keys,values):
             int_args[k] = v
+        hmmer_evalue,hmmer_hits = self.search.intermediate_frame.get_cutoff_values()
+        int_args['hmmer_fwd_evalue'] = hmmer_evalue
+        int_args['hmmer_fwd_hits'] = hmmer_hits
         fwd_sobj = search_obj.Search( # be explicit for clarity here
             name = fwd_name,
             algorithm = 'blast',
@@ -386,6 +485,9 @@ class IntBLASTHMMerParams(Frame):
                 [('Summary name','fullsumm'),('Minimum forward evalue','0.05'),
                 ('Minimum reverse evalue','0.05'),('Next hit evalue','0.05'),
                 ('Max forward hits','10'),('Max reverse hits','10')], self)
+        # Optional; as for the other analyses, but for the HMMer hits
+        self.hmmer_cutoffs = input_form.DefaultValueForm(
+                [('Maximum forward evalue',''),('Max forward hits','')], self)
         self.fwd_ko = gui_util.CheckBoxFrame(
                 self, 'Keep forward search output files?')
         self.rev_ko = gui_util.CheckBoxFrame(
@@ -404,3 +506,6 @@ class IntBLASTHMMerParams(Frame):
                 self.fwd_ko.button_checked(),
                 self.rev_ko.button_checked())
 
+    def get_cutoff_values(self):
+        """Returns HMMer forward evalue and max hits; None if left blank"""
+        return get_forward_cutoffs(self.hmmer_cutoffs)
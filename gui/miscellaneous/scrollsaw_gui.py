@@ -56,6 +56,15 @@ class SummScrollSawFrame(Frame):
         self.group = gui_util.RadioBoxFrame(self,
                 choices = [('Supergroup','supergroup'),('Strain','strain')],
                 labeltext='Group to Select Sequence For')
+        self.distance = gui_util.RadioBoxFrame(self,
+                choices = [('p-distance','p'),('Poisson','poisson'),
+                    ('LG (approximate)','lg'),('k-mer sketch (no alignment)','sketch'),
+                    ('RAxML for each pair','raxml')],
+                labeltext='Distances to Use')
+        self.rerank = gui_util.RadioBoxFrame(self,
+                choices = [('p-distance','p'),('Poisson','poisson'),
+                    ('LG (approximate)','lg'),('None','none')],
+                labeltext='Re-rank Sketch Candidates With')
         self.toolbar = Frame(self)
         self.toolbar.pack(side=BOTTOM, expand=YES, fill=X)
 
@@ -79,7 +88,10 @@ class SummScrollSawFrame(Frame):
                 summary_obj = self.mdb[self.summ_id.get()],
                 target_dir = self.params.get('Location'),
                 sort_group = self.group.get(),
-                num_seqs = self.params.get('Number of Seqs'))
+                num_seqs = self.params.get('Number of Seqs'),
+                distance = self.distance.get(),
+                rerank = (None if self.rerank.get() == 'none' else
+                    self.rerank.get()))
         ssaw.run()
         self.onCancel()
 
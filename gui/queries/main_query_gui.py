@@ -426,16 +426,7 @@ class QuerySubmission:
 
     def add_self_blast(self, qobj, blast_result):
         """Adds hits to qobj attribute before removal"""
-        #print('adding self blast')
-        lines = []
-        seen = set()
-        for hit in blast_result.descriptions:
-            #print(hit)
-            new_title = search_util.remove_blast_header(hit.title)
-            if not new_title in seen:
-                lines.append([new_title, hit.e])
-                seen.add(new_title)
-        qobj.add_all_accs(lines)
+        search_util.add_self_blast(qobj, blast_result)
 
 class QueryColumns(ttk.Panedwindow):
     def __init__(self, parent=None, p_text='Possible Queries', a_text='To be Added'):
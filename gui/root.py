@@ -73,6 +73,8 @@ class RootFrame(Frame):
                 command=self.result_search, underline=0)
         search_menu.add_command(label='run analysis',
                 command=self.analysis_popup, underline=0)
+        search_menu.add_command(label='resume analysis',
+                command=self.resume_popup, underline=1)
         top.add_cascade(label='Search', menu=search_menu, underline=0)
 
         results_menu = Menu(top, tearoff=False)
@@ -140,6 +142,11 @@ class RootFrame(Frame):
         window = Toplevel()
         analysis_gui.AnalysisPicker(window)
 
+    def resume_popup(self):
+        """Resume a search or analysis that did not finish"""
+        window = Toplevel()
+        analysis_gui.ResumeFrame(window)
+
     def result_viewer(self):
         """View information for results from previous searches"""
         window = Toplevel()
@@ -6,21 +6,15 @@ provide a better way to feed back the callback from a search to the main GUI
 regardless of whether or not threading is used.
 """
 
-import threading, queue, os
-import time
+import threading, queue
 
 from tkinter import *
-from tkinter import ttk
+from tkinter import ttk, messagebox
 
 from bin.initialize_goat import configs
 
-from searches import new_search_runner, search_obj
-from searches.hmmer import hmmer_build
-from results import intermediate
-from summaries import summary_obj, summarizer
-from util.sequences import seqs_from_summary
-from util.alignment import mafft
-from queries import query_file
+from searches import new_search_runner, analysis_pipeline
+from util import executor
 
 blast_path = '/usr/local/ncbi/blast/bin'
 hmmer_path = '/Users/cklinger/src/hmmer-3.1b1-macosx-intel/src'
@@ -41,10 +35,11 @@ class ProgressFrame(Frame):
         # Some attributes are only applicable for analyses
         self.rev_name = rev_search_name
         self.rev_ko = keep_rev_output
-        if kwargs:
-            self.kwargs = {}
-            for k,v in kwargs.items():
-                self.kwargs[k] = v # store for later access
+        self.kwargs = {}
+        for k,v in kwargs.items():
+            self.kwargs[k] = v # store for later access
+        self.count_tasks = False # progress counts pipeline tasks, not searches
+        self.task_info = None # last task event; see task_listener
         # Some search modes require access to dbs
         self.qdb = configs['query_db']
         self.udb = configs['result_db']
@@ -76,41 +71,65 @@ class ProgressFrame(Frame):
             self.num_finished, self.num_todo), anchor='center', justify='center')
         self.search_label.pack(side=BOTTOM, expand=YES)
 
+        # Last reported state of an external program run, from the executor
+        self.job_label = Label(self, text='', anchor='center', justify='center')
+        self.job_label.pack(side=BOTTOM, expand=YES)
+
     def run(self):
-        """start producer thread, consumer loop"""
+        """start producer thread; progress and completion arrive as Tk events"""
         if self.threaded:
             configs['threads'].add_thread()
-            # always create the queue
+            # always create the queues
             self.queue = queue.Queue()
+            self.job_events = queue.Queue()
+            # Worker thread and executor only generate events; handlers run in
+            # the Tk main loop, so there is no need to poll for updates
+            self.bind('<<SearchProgress>>', self.update_progress)
+            self.bind('<<SearchDone>>', self.thread_consumer)
+            self.bind('<<JobEvent>>', self.update_job_info)
+            executor.get_executor().add_listener(self.job_listener)
             if self.mode == 'racc':
-                threading.Thread(target=self._run_racc_blast).start()
-            elif self.mode == 'new':
-                threading.Thread(target=self._run_fwd_search).start()
-            elif self.mode == 'rev':
-                threading.Thread(target=self._run_rev_search).start()
-            elif self.mode == 'recip_blast':
-                threading.Thread(target=self._run_recip_blast).start()
-            elif self.mode == 'hmmer_blast':
-                threading.Thread(target=self._run_hmmer_blast).start()
-            elif self.mode == 'full_blast_hmmer':
-                threading.Thread(target=self._run_full_blast_hmmer).start()
-            # always start the thread consumer function
-            self.thread_consumer()
+                target = self._run_racc_blast
+            else: # searches and analyses; see searches.analysis_pipeline
+                target = self._run_pipeline
+            # the worker has its own connection, which only sees committed data
+            configs['goat_db']._commit()
+            threading.Thread(target=self._run_thread, args=(target,)).start()
+            self.update_progress()
         else:
             pass
 
-    def thread_consumer(self):
-        """Checks the queue regularly for new results"""
-        # Even if there are no results to grab, update status bar each time
+    def update_progress(self, event=None):
+        """Updates status bar; called for each <<SearchProgress>> event"""
+        self.p['maximum'] = self.num_todo
         self.p['value'] = self.num_finished
-        self.search_label['text'] = 'Performing search {} of {}'.format(
-            self.num_finished, self.num_todo)
+        if self.count_tasks:
+            if self.task_info:
+                self.search_info['text'] = self.task_info
+            self.search_label['text'] = 'Finished {} of {} steps'.format(
+                self.num_finished, self.num_todo)
+        else:
+            self.search_label['text'] = 'Performing search {} of {}'.format(
+                self.num_finished, self.num_todo)
+
+    def thread_consumer(self, event=None):
+        """Handles the <<SearchDone>> event once all searches are finished"""
+        self.update_progress()
         try:
             done = self.queue.get(block=False)
         except(queue.Empty): # nothing to grab
-            self.after(200, self.thread_consumer)
+            pass
         # when finished
         else:
+            executor.get_executor().remove_listener(self.job_listener)
+            configs['goat_db'].sync() # see the changes of the worker
+            if isinstance(done, Exception): # see _run_thread
+                configs['threads'].remove_thread() # callbacks are not called
+                self.parent.protocol('WM_DELETE_WINDOW', self.parent.destroy)
+                self.search_info['text'] = 'Search did not finish'
+                messagebox.showerror('Search Error',
+                        'Could not finish search: {}'.format(done), parent=self)
+                return
             if done:
                 if self.callback:
                     if self.callback_args:
@@ -122,10 +141,77 @@ class ProgressFrame(Frame):
     def increment_search_count(self):
         """Increments counter after each search finishes"""
         #print("incrementing counter")
-        if self.num_finished == self.num_todo:
+        if self.count_tasks:
+            pass # see task_listener
+        elif self.num_finished == self.num_todo:
             pass # don't increment past max
         else:
             self.num_finished += 1
+        if self.threaded:
+            self.event_generate('<<SearchProgress>>', when='tail')
+
+    def _run_thread(self, target):
+        """
+        Runs in the worker thread; the starting search is fetched again through
+        the worker's own connection, if it is stored in the database
+        """
+        error = None
+        try:
+            if self.start_sobj._p_jar is not None:
+                self.start_sobj = self.sdb[self.start_sobj.name]
+            target()
+        except(Exception) as e:
+            print("Could not run search: {}".format(e))
+            error = e
+        finally:
+            configs['goat_db'].close_connection(commit=False) # if not done already
+        if error is not None:
+            self.signal_failed(error)
+
+    def signal_done(self):
+        """Called from the worker thread once everything is finished"""
+        if self.threaded:
+            # commit the worker's changes before the main thread looks for
+            # them; a lost commit raises, and is reported by _run_thread
+            configs['goat_db'].close_connection()
+            self.queue.put('Done')
+            self.event_generate('<<SearchDone>>', when='tail')
+
+    def signal_failed(self, error):
+        """Called from the worker thread if it stopped with an error"""
+        if self.threaded:
+            self.queue.put(error)
+            self.event_generate('<<SearchDone>>', when='tail')
+
+    def job_listener(self, job_event):
+        """Called by the executor, from its own thread, for each job event"""
+        self.job_events.put(job_event)
+        self.event_generate('<<JobEvent>>', when='tail')
+
+    def update_job_info(self, event=None):
+        """Shows the most recent job event; called for each <<JobEvent>> event"""
+        job_event = None
+        while True:
+            try:
+                job_event = self.job_events.get(block=False)
+            except(queue.Empty):
+                break
+        if job_event:
+            if job_event.is_done():
+                self.job_label['text'] = '{} {} after {:.1f}s'.format(
+                    job_event.name, job_event.state, job_event.elapsed)
+            else:
+                self.job_label['text'] = 'Running {}'.format(job_event.name)
+
+    def task_listener(self, task):
+        """Called by the pipeline, from the worker thread, for each task event"""
+        if task.is_finished():
+            self.num_finished = min(self.num_finished + 1, self.num_todo)
+            self.task_info = 'Finished {}'.format(task.name)
+        else:
+            self.task_info = 'Running {}'.format(task.name)
+        if self.threaded:
+            self.event_generate('<<SearchProgress>>', when='tail')
 
     def add_file_to_delete(self, filepath):
         """Adds to callback_args, assumes it is a list"""
@@ -149,263 +235,19 @@ class ProgressFrame(Frame):
                 other_widget=self)
         runner.run()
         runner.parse()
-        if self.threaded:
-            self.queue.put('Done') # signal completion
-
-    def _run_fwd_search(self):
-        """Function called by the thread, runs each BLAST search"""
-        runner = new_search_runner.SearchRunner(self.start_sobj, mode='new',
-                other_widget=self)
-        runner.run()
-        runner.parse()
-        if self.threaded:
-            self.queue.put('Done')
+        self.signal_done() # signal completion
 
-    def _run_rev_search(self):
-        """Calls Search Runner for reverse searches"""
-        runner = new_search_runner.SearchRunner(self.start_sobj, mode='rev',
-                other_widget=self)
-        runner.run()
-        runner.parse()
-        if self.threaded:
-            self.queue.put('Done')
-
-    def _run_recip_blast(self):
-        """
-        Populates and runs a SearchRunner object for the forward BLAST, then obtains
-        queries and a new sobj for the reverse search. Refreshes label and counter,
-        then runs the SearchRunner object for the reverse BLAST. Commits all changes
-        at the end. - Can we update the db from a thread?
-        """
-        # Run the forward search, parse output
-        fwd_runner = new_search_runner.SearchRunner(self.start_sobj, mode='new',
-                other_widget=self)
-        fwd_runner.run()
-        fwd_runner.parse()
-        # Populate DBs with intermediate search queries
-        intermediate.Search2Queries(self.start_sobj).populate_search_queries()
-        # Get the relvant qids
-        rev_queries = []
-        for uid in self.start_sobj.list_results():
-            uobj = self.udb[uid]
-            for qid in uobj.list_queries():
-                rev_queries.append(qid)
-        rev_sobj = search_obj.Search(
-                name = self.rev_name,
-                algorithm = 'blast',
-                q_type = self.start_sobj.db_type,
-                db_type = self.start_sobj.q_type,
-                queries = rev_queries,
-                databases = [], # rev search
-                keep_output = self.rev_ko,
-                output_location = self.start_sobj.output_location)
-        self.sdb.add_entry(rev_sobj.name, rev_sobj)
-        # Reset label and counter
-        self.search_info['text'] = 'Performing reverse search using blast'
-        self.num_todo = self.determine_max_searches(rev_sobj, 'rev')
-        self.p['maximum'] = self.num_todo
-        self.num_finished = 1
-        fwd_runner = new_search_runner.SearchRunner(rev_sobj, mode='rev',
-                other_widget=self)
-        fwd_runner.run()
-        fwd_runner.parse()
-        if self.threaded:
-            self.queue.put('Done')
-
-    def _run_hmmer_blast(self):
+    def _run_pipeline(self):
         """
-        Populates and runs a SearchRunner object for the forward HMMer, then obtains
-        queries and a new sobj for the reverse search. Refreshes label and counter,
-        then runs the SearchRunner object for the reverse BLAST. Commits all changes
-        at the end. - Can we update the db from a thread?
+        Runs the search or analysis as a graph of tasks; each task counts as
+        one step of progress (see searches.analysis_pipeline)
         """
-        # Run the forward search, parse output
-        fwd_runner = new_search_runner.SearchRunner(self.start_sobj, mode='new',
-                other_widget=self)
-        fwd_runner.run()
-        fwd_runner.parse()
-        # Populate DBs with intermediate search queries
-        intermediate.Search2Queries(self.start_sobj).populate_search_queries()
-        # Get the relvant qids
-        rev_queries = []
-        for uid in self.start_sobj.list_results():
-            uobj = self.udb[uid]
-            for qid in uobj.list_queries():
-                rev_queries.append(qid)
-        rev_sobj = search_obj.Search(
-                name = self.rev_name,
-                algorithm = 'blast',
-                q_type = self.start_sobj.db_type,
-                db_type = self.start_sobj.q_type,
-                queries = rev_queries,
-                databases = [], # rev search
-                keep_output = self.rev_ko,
-                output_location = self.start_sobj.output_location)
-        self.sdb.add_entry(rev_sobj.name, rev_sobj)
-        # Reset label and counter
-        self.search_info['text'] = 'Performing reverse search using blast'
-        self.num_todo = self.determine_max_searches(rev_sobj, 'rev')
-        self.p['maximum'] = self.num_todo
-        self.num_finished = 1
-        rev_runner = new_search_runner.SearchRunner(rev_sobj, mode='rev',
-                other_widget=self)
-        rev_runner.run()
-        rev_runner.parse()
-        if self.threaded:
-            self.queue.put('Done')
-
-    def _run_full_blast_hmmer(self):
-        """
-        Populates and runs a SearchRunner object for the forward BLAST, runs a
-        subsequent reverse BLAST, summarizes based on user input and then uses
-        all "positive" hits to build a new MSA and subsequent HMM before running
-        another forward HMMer/reverse BLAST combo.
-        """
-        # Run the forward search, parse output
-        fwd_runner = new_search_runner.SearchRunner(self.start_sobj, mode='new',
-                other_widget=self)
-        fwd_runner.run()
-        fwd_runner.parse()
-        # Populate DBs with intermediate search queries
-        intermediate.Search2Queries(self.start_sobj).populate_search_queries()
-        # Get the relvant qids
-        rev_queries = []
-        for uid in self.start_sobj.list_results():
-            uobj = self.udb[uid]
-            for qid in uobj.list_queries():
-                rev_queries.append(qid)
-        rev_sobj = search_obj.Search(
-                name = self.rev_name,
-                algorithm = 'blast',
-                q_type = self.start_sobj.db_type,
-                db_type = self.start_sobj.q_type,
-                queries = rev_queries,
-                databases = [], # rev search
-                keep_output = self.rev_ko,
-                output_location = self.start_sobj.output_location)
-        self.sdb.add_entry(rev_sobj.name, rev_sobj)
-        # Reset label and counter
-        self.search_info['text'] = 'Performing reverse search using blast'
-        self.num_todo = self.determine_max_searches(rev_sobj, 'rev')
-        self.p['maximum'] = self.num_todo
-        self.num_finished = 1
-        # Run reverse search, parse output
-        rev_runner = new_search_runner.SearchRunner(rev_sobj, mode='rev',
-                other_widget=self)
-        rev_runner.run()
-        rev_runner.parse()
-        # Summarize fwd and rev search using cutoff criteria
-        int_summary = summary_obj.Summary(
-            fwd_search = self.start_sobj.name,
-            fwd_qtype = self.start_sobj.q_type,
-            fwd_dbtype = self.start_sobj.db_type,
-            fwd_algorithm = self.start_sobj.algorithm,
-            fwd_evalue_cutoff = self.kwargs['fwd_evalue'],
-            fwd_max_hits = self.kwargs['fwd_hits'],
-            rev_search = self.rev_name,
-            rev_qtype = self.start_sobj.db_type,
-            rev_dbtype = self.start_sobj.q_type,
-            rev_algorithm = 'blast',
-            rev_evalue_cutoff = self.kwargs['rev_evalue'],
-            rev_max_hits = self.kwargs['rev_hits'],
-            next_hit_evalue_cutoff = self.kwargs['next_evalue'])
-        int_summarizer = summarizer.SearchSummarizer(int_summary)
-        int_summarizer.summarize_two_results()
-        mdb = configs['summary_db']
-        mdb.add_entry(self.kwargs['summ_name'], int_summary)
-        # Get sequences from summarized results - positive only!
-        seq_writer = seqs_from_summary.SummarySeqWriter(
-                basename = self.start_sobj.name,
-                summary_obj = int_summary,
-                target_dir = self.start_sobj.output_location,
-                hit_type = 'positive',
-                mode = 'all',
-                add_query_to_file = True) # last one adds the query object seq as well
-        seq_writer.run()
-        time.sleep(1)
-        # Now create MSAs and HMMs for all files
-        msa_dict = {}
-        for qid,filename in seq_writer.file_dict.items():
-            msa_file = (filename.rsplit('.',1)[0]) + '.mfa'
-            msa_dict[qid] = msa_file
-            mafft.MAFFT(filename,msa_file).run('file')
-        time.sleep(2)
-        hmm_dict = {}
-        for qid,msafile in msa_dict.items():
-            hmm_file = (msafile.rsplit('.',1)[0]) + '.hmm'
-            hmm_dict[qid] = hmm_file
-            hmmer_build.HMMBuild(
-                    hmmbuild_path = hmmer_path,
-                    msa_filepath = msafile,
-                    hmm_out = hmm_file).run_from_file()
-        time.sleep(2)
-        # Create new intermediate queries for forward HMMer search and run
-        qdb = configs['query_db']
-        hmmer_queries = []
-        for qid,hmmfile in hmm_dict.items():
-            #print(qid)
-            #print(hmmfile)
-            #print()
-            name,hmm_obj = query_file.HMMFile(
-                    hmmfile,self.start_sobj.db_type).get_query()
-            hmm_obj.spec_qid = qid
-            qobj = qdb[qid]
-            hmm_obj.spec_record = qobj.record
-            hmm_obj.add_query(qid,qobj) # copy from qdb to misc_qdb
-            qdb[name] = hmm_obj # add to db
-            hmmer_queries.append(name) # add to queries to search
-        fwd_hmmer = search_obj.Search( # be explicit for clarity here
-            name = self.kwargs['fwd_name'],
-            algorithm = 'hmmer',
-            q_type = self.start_sobj.q_type, # queries come from original DB/query type
-            db_type = self.start_sobj.db_type, # target DB type is same as original db type
-            queries = hmmer_queries, # fresh batch of queries for new fwd search
-            databases = self.start_sobj.databases, # searching in all dbs again
-            keep_output = self.kwargs['fwd_ko'], # specified for new search
-            output_location = self.start_sobj.output_location)
-        self.sdb.add_entry(fwd_hmmer.name, fwd_hmmer)
-        # Reset label and counter again
-        self.search_info['text'] = 'Performing forward search using hmmer'
-        self.num_todo = self.determine_max_searches(fwd_hmmer, 'new')
-        self.p['maximum'] = self.num_todo
-        self.num_finished = 1
-        # Run the forward search, parse output
-        new_fwd_runner = new_search_runner.SearchRunner(fwd_hmmer, mode='new',
-                other_widget=self)
-        new_fwd_runner.run()
-        new_fwd_runner.parse()
-        # Again, get new queries from fwd hmmer search
-        #print()
-        #print("Getting rev2 search queries")
-        intermediate.Search2Queries(fwd_hmmer).populate_search_queries()
-        # Get the relvant qids
-        rev_blast_queries = []
-        for uid in fwd_hmmer.list_results():
-            uobj = self.udb[uid]
-            for qid in uobj.list_queries():
-                rev_blast_queries.append(qid)
-        #print(rev_blast_queries)
-        rev_blast_sobj = search_obj.Search(
-                name = self.kwargs['rev_name'],
-                algorithm = 'blast',
-                q_type = fwd_hmmer.db_type,
-                db_type = fwd_hmmer.q_type,
-                queries = rev_blast_queries,
-                databases = [], # rev search
-                keep_output = self.kwargs['rev_ko'],
-                output_location = self.start_sobj.output_location)
-        self.sdb.add_entry(rev_blast_sobj.name, rev_blast_sobj)
-        # Reset label and counter
-        #print("Performing rev2 blast search")
-        self.search_info['text'] = 'Performing reverse search using blast'
-        self.num_todo = self.determine_max_searches(rev_blast_sobj, 'rev')
-        self.p['maximum'] = self.num_todo
-        self.num_finished = 1
-        rev_runner = new_search_runner.SearchRunner(rev_blast_sobj, mode='rev',
-                other_widget=self)
-        rev_runner.run()
-        rev_runner.parse()
-        # Finally, signal completion for callback DB commits
-        if self.threaded:
-            self.queue.put('Done')
-
+        analysis = analysis_pipeline.AnalysisPipeline(self.start_sobj, self.mode,
+                rev_search_name=self.rev_name, keep_rev_output=self.rev_ko,
+                kwargs=self.kwargs, other_widget=self,
+                listener=self.task_listener)
+        self.count_tasks = True
+        self.num_todo = analysis.pipeline.count()
+        self.num_finished = 0
+        analysis.run()
+        self.signal_done()
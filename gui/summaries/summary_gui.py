@@ -4,7 +4,7 @@ User is asked to choose between one or two searches to summarize, and then
 depending on this choice to fill in different forms for relevant information.
 """
 
-import os
+import os, threading, queue
 from tkinter import *
 from tkinter import ttk, messagebox, filedialog
 
@@ -185,8 +185,53 @@ class TwoSearchFrame(Frame):
                 fwd_sobj.db_type, fwd_sobj.algorithm, fwd_evalue,
                 fwd_max_hits, rev_search, rev_sobj.q_type, rev_sobj.db_type,
                 rev_sobj.algorithm, rev_evalue, rev_max_hits, next_evalue)
-        summer = summarizer.SearchSummarizer(sum_obj)
-        summer.summarize_two_results()
+        # summarize in another thread so the window stays responsive; it has
+        # its own connection, which only sees committed data
+        configs['goat_db']._commit()
+        self.queue = queue.Queue()
+        self.status = Label(self.toolbar, text='Summarizing...')
+        self.status.pack(side=LEFT)
+        self.set_buttons(DISABLED)
+        self.parent.protocol('WM_DELETE_WINDOW', lambda: None) # until done
+        threading.Thread(target=self._summarize, args=(sum_obj,)).start()
+        self.summary_consumer(name)
+
+    def set_buttons(self, state):
+        """Enables or disables the toolbar buttons"""
+        for child in self.toolbar.winfo_children():
+            if isinstance(child, Button):
+                child.config(state=state)
+
+    def _summarize(self, sum_obj):
+        """
+        Function called by the thread; queue gets the summary when done, or
+        the error if it could not be made
+        """
+        result = sum_obj
+        try:
+            try:
+                summer = summarizer.SearchSummarizer(sum_obj)
+                summer.summarize_two_results()
+            finally:
+                configs['goat_db'].close_connection() # commits any new summary table
+        except(Exception) as e:
+            result = e
+        self.queue.put(result)
+
+    def summary_consumer(self, name):
+        """Checks the queue regularly for the finished summary"""
+        try:
+            sum_obj = self.queue.get(block=False)
+        except(queue.Empty):
+            self.after(200, lambda: self.summary_consumer(name))
+            return
+        if isinstance(sum_obj, Exception): # let the user try again or close
+            self.status.destroy()
+            self.set_buttons(NORMAL)
+            self.parent.protocol("WM_DELETE_WINDOW", self.onClose)
+            messagebox.showerror('Summary Error',
+                    'Could not summarize: {}'.format(sum_obj), parent=self)
+            return
         #print()
         #print()
         #print('\n' + str(sum_obj))
@@ -0,0 +1,134 @@
+"""
+This module contains code for caching pairwise distance matrices in Goat, so
+that ScrollSaw can be run again (e.g. with a different number of sequences or a
+different grouping) without aligning and computing distances again. Matrices
+are keyed on their content rather than on names or files: a hash of each
+sequence and the distance model. A set of sequences therefore matches however
+its sequences are split into files or ordered, while a changed sequence never
+matches an old entry.
+
+Matrices are saved as .npy files in a cache directory and memory-mapped when
+read, so only the rows and columns that are used are loaded; entries in the
+'distance_cache' node of the database point to them. Once the total size of
+the cache exceeds its limit, the least recently used entries are evicted.
+"""
+
+import os, time, hashlib
+
+import numpy as np
+from persistent import Persistent
+
+from bin.initialize_goat import configs
+
+# Placeholders - should be through settings eventually
+cache_dir = '/Users/cklinger/git/Goat/cache/distances'
+max_cache_size = 1024 ** 3 # bytes of cached matrices to keep before evicting
+
+def hash_sequence(seq):
+    """
+    Returns a hash of a sequence's residues; case, gaps and line breaks do not
+    change the hash
+    """
+    residues = ''.join(seq.split()).replace('-','').replace('.','').upper()
+    return hashlib.sha1(residues.encode('utf-8')).hexdigest()
+
+class DistanceEntry(Persistent):
+    """Points to a cached matrix; row i holds distances of sequence hashes[i]"""
+    def __init__(self, key, model, hashes, filepath, size):
+        self.key = key
+        self.model = model
+        self.hashes = tuple(hashes)
+        self.filepath = filepath
+        self.size = size
+        self.last_used = time.time()
+
+    def touch(self):
+        """Marks the entry as recently used"""
+        self.last_used = time.time()
+
+class DistanceCache:
+    """Interface to the cache node of the database and the cache directory"""
+    def __init__(self, cache_dir=cache_dir, max_size=max_cache_size):
+        self.ddb = configs['distance_cache']
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._total_size = None # computed on first use, then kept up to date
+
+    def get_key(self, model, hashes):
+        """Returns the key for a set of sequences; their order does not matter"""
+        parts = [str(model)] + sorted(hashes)
+        return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def get_entry(self, key):
+        """Returns the entry for key if its matrix is still cached, else None"""
+        try:
+            entry = self.ddb[key]
+        except(KeyError):
+            return None
+        if not os.path.exists(entry.filepath): # removed outside of Goat
+            self.ddb.remove_entry(key)
+            if self._total_size is not None:
+                self._total_size -= entry.size
+            return None
+        return entry
+
+    def fetch(self, model, hashes):
+        """
+        Returns the distances between the sequences with the given hashes, in
+        that order, or None if they are not cached
+        """
+        entry = self.get_entry(self.get_key(model, hashes))
+        if entry is None:
+            return None
+        try:
+            matrix = np.load(entry.filepath, mmap_mode='r')
+        except(OSError, ValueError) as e: # e.g. a partly written file
+            print('Could not read cached distances: {}'.format(e))
+            return None
+        index = {seq_hash:i for i,seq_hash in enumerate(entry.hashes)}
+        order = np.array([index[seq_hash] for seq_hash in hashes], dtype=np.intp)
+        entry.touch()
+        return np.asarray(matrix[np.ix_(order, order)], dtype=np.float64)
+
+    def store(self, model, hashes, matrix):
+        """Adds the matrix of distances between sequences with the given hashes"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        key = self.get_key(model, hashes)
+        filepath = os.path.join(self.cache_dir, key + '.npy')
+        total = self.get_total_size()
+        old_entry = self.get_entry(key)
+        if old_entry is not None: # about to be replaced
+            total -= old_entry.size
+        np.save(filepath, np.asarray(matrix, dtype=np.float32))
+        entry = DistanceEntry(key, model, hashes, filepath,
+                os.path.getsize(filepath))
+        self.ddb[key] = entry
+        self._total_size = total + entry.size
+        self.evict()
+
+    def get_total_size(self):
+        """Returns the size of all cached matrices"""
+        if self._total_size is None:
+            self._total_size = sum(self.ddb[key].size for key in
+                    self.ddb.list_entries())
+        return self._total_size
+
+    def evict(self):
+        """Removes least recently used entries until under the size limit"""
+        total = self.get_total_size()
+        if total <= self.max_size:
+            return
+        entries = [self.ddb[key] for key in self.ddb.list_entries()]
+        for entry in sorted(entries, key=lambda x: x.last_used):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(entry.filepath)
+            except(OSError):
+                pass # already gone
+            self.ddb.remove_entry(entry.key)
+            total -= entry.size
+        self._total_size = total
+
+    def commit(self):
+        self.ddb.commit()
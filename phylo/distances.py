@@ -0,0 +1,221 @@
+"""
+This module contains code to compute pairwise distances between aligned protein
+sequences in process with NumPy, rather than by running RAxML on each pair of
+files. All pairs in an alignment are handled at once:
+
+    p_distance() - proportion of differing sites, over sites where neither
+        sequence has a gap or an ambiguous residue
+
+    poisson_distance() - the p-distance corrected for multiple substitutions,
+        -ln(1 - p)
+
+    lg_distance() - an approximation of the maximum likelihood distance under
+        the LG model (Le and Gascuel, 2008); the likelihood of every pair is
+        evaluated on a grid of distances with one matrix product, and the best
+        grid point is refined by parabolic interpolation. Rate variation can
+        be included with a continuous gamma distribution of shape alpha.
+
+Sites are compared with one-hot matrix products, so the cost grows with the
+number of sequences squared times the alignment length, without any Python
+loop over pairs. Distances that cannot be estimated (no shared sites, or too
+many differences) are set to max_distance.
+"""
+
+import numpy as np
+
+# Placeholders - should be through settings eventually
+max_distance = 10.0 # substitutions per site
+gamma_alpha = None # shape of rate variation for LG distances; None for none
+chunk_size = 2**24 # largest number of counts held in memory at once
+
+amino_acids = 'ARNDCQEGHILKMFPSTWYV' # order of the LG matrix below
+
+# LG exchangeabilities (lower triangle, in amino_acids order) and frequencies
+lg_exchangeabilities = """
+0.425093
+0.276818 0.751878
+0.395144 0.123954 5.076149
+2.489084 0.534551 0.528768 0.062556
+0.969894 2.807908 1.695752 0.523386 0.084808
+1.038545 0.363970 0.541712 5.243870 0.003499 4.128591
+2.066040 0.390192 1.437645 0.844926 0.569265 0.267959 0.348847
+0.358858 2.426601 4.509238 0.927114 0.640543 4.813505 0.423881 0.311484
+0.149830 0.126991 0.191503 0.010690 0.320627 0.072854 0.044265 0.008705 0.108882
+0.395337 0.301848 0.068427 0.015076 0.594007 0.582457 0.069673 0.044261 0.366317 4.145067
+0.536518 6.326067 2.145078 0.282959 0.013266 3.234294 1.807177 0.296636 0.697264 0.159069 0.137500
+1.124035 0.484133 0.371004 0.025548 0.893680 1.672569 0.173735 0.139538 0.442472 4.273607 6.312358 0.656604
+0.253701 0.052722 0.089525 0.017416 1.105251 0.035855 0.018811 0.089586 0.682139 1.112727 2.592692 0.023918 1.798853
+1.177651 0.332533 0.161787 0.394456 0.075382 0.624294 0.419409 0.196961 0.508851 0.078281 0.249060 0.390322 0.099849 0.094464
+4.727182 0.858151 4.008358 1.240275 2.784478 1.223828 0.611973 1.739990 0.990012 0.064105 0.182287 0.748683 0.346960 0.361819 1.338132
+2.139501 0.578987 2.000679 0.425860 1.143480 1.080136 0.604545 0.129836 0.584262 1.033739 0.302936 1.136863 2.020366 0.165001 0.571468 6.472279
+0.180717 0.593607 0.045376 0.029890 0.670128 0.236199 0.077852 0.268491 0.597054 0.111660 0.619632 0.049906 0.696175 2.457121 0.095131 0.248862 0.140825
+0.218959 0.314440 0.612025 0.135107 1.165532 0.257336 0.120037 0.054679 5.306834 0.232523 0.299648 0.131932 0.481306 7.803902 0.089613 0.400547 0.245841 3.151815
+2.547870 0.170887 0.083688 0.037967 1.959291 0.210332 0.245034 0.076701 0.119013 10.649107 1.702745 0.185202 1.898718 0.654683 0.296501 0.098369 2.188158 0.189510 0.249313
+"""
+lg_frequencies = """
+0.079066 0.055941 0.041977 0.053052 0.012937 0.040767 0.071586 0.057337
+0.022355 0.062157 0.099081 0.064600 0.022951 0.042302 0.044040 0.061197
+0.053287 0.012066 0.034155 0.069147
+"""
+
+def read_fasta(lines):
+    """Returns the headers and sequences of FASTA lines, e.g. an alignment"""
+    headers = []
+    seqs = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if line.startswith('>'):
+            headers.append(line[1:])
+            seqs.append([])
+        elif line and seqs:
+            seqs[-1].append(line)
+    return headers, [''.join(seq) for seq in seqs]
+
+def encode(seqs):
+    """
+    Returns aligned sequences as an array of residue indices (see amino_acids);
+    gaps and ambiguous residues are -1
+    """
+    length = max(len(seq) for seq in seqs) if seqs else 0
+    lookup = np.full(256, -1, dtype=np.int8)
+    for i,residue in enumerate(amino_acids):
+        lookup[ord(residue)] = i
+        lookup[ord(residue.lower())] = i
+    codes = np.full((len(seqs), length), -1, dtype=np.int8)
+    for i,seq in enumerate(seqs):
+        raw = np.frombuffer(seq.encode('ascii', 'replace'), dtype=np.uint8)
+        codes[i,:len(raw)] = lookup[raw]
+    return codes
+
+def one_hot(codes):
+    """Returns an (n, sites, 20) array that is 1 where a site has a residue"""
+    return (codes[:,:,None] == np.arange(len(amino_acids))).astype(np.float32)
+
+def count_sites(codes):
+    """
+    Returns (same, compared): for each pair, the number of identical sites and
+    the number of sites where both sequences have a residue
+    """
+    states = one_hot(codes)
+    valid = states.sum(axis=2)
+    compared = valid @ valid.T
+    same = np.zeros_like(compared)
+    for i in range(states.shape[2]):
+        same += states[:,:,i] @ states[:,:,i].T
+    return same, compared
+
+def p_distance(codes):
+    """Returns the matrix of p-distances"""
+    same, compared = count_sites(codes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dist = (compared - same) / compared
+    return finish(dist)
+
+def poisson_distance(codes):
+    """Returns the matrix of Poisson-corrected distances"""
+    same, compared = count_sites(codes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dist = -np.log(same / compared)
+    return finish(dist)
+
+def lg_distance(codes, alpha=gamma_alpha, grid_size=200):
+    """
+    Returns the matrix of approximate ML distances under LG; the likelihood of
+    each pair is a dot product of its 20x20 substitution counts with the log
+    of the transition probabilities at each grid distance
+    """
+    n = codes.shape[0]
+    grid = np.concatenate([[0.0], np.geomspace(1e-4, max_distance, grid_size)])
+    log_probs = np.log(np.maximum(lg_transitions(grid, alpha), 1e-300))
+    log_probs = log_probs.reshape(len(grid), -1).T # (400, grid)
+    states = one_hot(codes)
+    dist = np.empty((n, n))
+    rows = max(1, chunk_size // max(1, n * 400))
+    for start in range(0, n, rows):
+        block = states[start:start + rows]
+        # counts[i, a, j, b] = sites where sequence i has a and j has b
+        counts = np.tensordot(block, states, axes=([1],[1]))
+        counts = counts.transpose(0,2,1,3).reshape(len(block) * n, -1)
+        likelihood = counts.astype(np.float64) @ log_probs
+        best = refine(grid, likelihood)
+        best[counts.sum(axis=1) == 0] = np.nan # nothing to compare
+        dist[start:start + len(block)] = best.reshape(len(block), n)
+    np.fill_diagonal(dist, 0.0)
+    return finish((dist + dist.T) / 2) # same up to rounding
+
+def refine(grid, likelihood):
+    """
+    Returns the distance of highest likelihood for each row, interpolating a
+    parabola through the best grid point and its neighbours (in log distance)
+    """
+    best = np.argmax(likelihood, axis=1)
+    dist = grid[best].copy()
+    inner = (best > 1) & (best < len(grid) - 1) # grid[0] is zero, not on the log scale
+    rows = np.nonzero(inner)[0]
+    if len(rows):
+        i = best[rows]
+        x0, x1, x2 = np.log(grid[i - 1]), np.log(grid[i]), np.log(grid[i + 1])
+        y0 = likelihood[rows, i - 1]
+        y1 = likelihood[rows, i]
+        y2 = likelihood[rows, i + 1]
+        denom = (x0 - x1) * (y1 - y2) - (x1 - x2) * (y0 - y1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shift = 0.5 * ((x0 - x1)**2 * (y1 - y2) - (x1 - x2)**2 * (y0 - y1)) / denom
+        x = np.where(np.isfinite(shift) & (denom != 0), x1 - shift, x1)
+        dist[rows] = np.exp(np.clip(x, x0, x2))
+    at_max = best == len(grid) - 1 # saturated; cannot be estimated
+    dist[at_max] = np.nan
+    return dist
+
+def lg_transitions(times, alpha=None):
+    """
+    Returns the LG transition probabilities for each time, as a (times, 20, 20)
+    array; rates are scaled so that times are substitutions per site
+    """
+    rates, freqs = get_lg_model()
+    sqrt_freqs = np.sqrt(freqs)
+    # symmetric form of the rate matrix, so that eigh can be used
+    symmetric = sqrt_freqs[:,None] * rates / sqrt_freqs[None,:]
+    values, vectors = np.linalg.eigh((symmetric + symmetric.T) / 2)
+    times = np.asarray(times, dtype=np.float64)[:,None] * values[None,:]
+    if alpha: # expected value of exp(rt) over gamma distributed rates r
+        factors = (1.0 - times / alpha) ** -alpha
+    else:
+        factors = np.exp(times)
+    probs = np.einsum('ik,tk,jk->tij', vectors, factors, vectors)
+    return probs / sqrt_freqs[None,:,None] * sqrt_freqs[None,None,:]
+
+_lg_model = None
+
+def get_lg_model():
+    """Returns the normalized LG rate matrix and frequencies"""
+    global _lg_model
+    if _lg_model is None:
+        values = [float(value) for value in lg_exchangeabilities.split()]
+        freqs = np.array([float(value) for value in lg_frequencies.split()])
+        freqs = freqs / freqs.sum()
+        exchange = np.zeros((20, 20))
+        exchange[np.tril_indices(20, -1)] = values
+        exchange = exchange + exchange.T
+        rates = exchange * freqs[None,:]
+        np.fill_diagonal(rates, -rates.sum(axis=1))
+        rates = rates / -(freqs * np.diag(rates)).sum() # one substitution per unit
+        _lg_model = (rates, freqs)
+    return _lg_model
+
+def finish(dist):
+    """Caps distances that could not be estimated at max_distance"""
+    dist = np.where(np.isfinite(dist), dist, max_distance)
+    dist = np.minimum(dist, max_distance)
+    np.fill_diagonal(dist, 0.0)
+    return dist
+
+# Distance functions by name, as used by ScrollSaw
+models = {'p':p_distance, 'poisson':poisson_distance, 'lg':lg_distance}
+
+def get_distances(headers_seqs, model='lg'):
+    """Returns the distance matrix of an alignment given as (headers, seqs)"""
+    headers, seqs = headers_seqs
+    return models[model](encode(seqs))
@@ -3,7 +3,9 @@ This module contains code for running RAxML in Goat. Initial implementation will
 very simple and allow only to run ScrollSaw.
 """
 
-import subprocess,os
+import os
+
+from util import executor
 
 # Go through settings eventually
 raxml_path = '/Users/cklinger/src/standard-RAxML-8.1.17/raxmlHPC-AVX'
@@ -17,10 +19,11 @@ class RAxML:
 
     def get_distances(self):
         """Run RAxML to produce distances"""
-        e_file = open(self.get_tmp_output(),'wb')
-        subprocess.run([raxml_path, '-f', 'x', '-p', '12345', '-s', self.infile,
+        job = executor.Job([raxml_path, '-f', 'x', '-p', '12345', '-s', self.infile,
             '-m', 'PROTGAMMALG', '-n', self.outfile, '-w', self.target_dir],
-            stdout=e_file, stderr=e_file) # does not write to terminal
+            name='raxml', stdout=self.get_tmp_output(),
+            stderr=executor.STDOUT) # does not write to terminal
+        return executor.get_executor().run(job)
 
     def get_tmp_output(self):
         """
@@ -0,0 +1,103 @@
+"""
+This module contains code to estimate distances between protein sequences
+without aligning them, using MinHash sketches of their k-mers (as in Mash;
+Ondov et al., 2016). Each sequence is reduced to the smallest value of each of
+num_hashes hash functions over its k-mers; the fraction of hash functions for
+which two sketches agree estimates the Jaccard index J of their k-mer sets,
+which is turned into a distance comparable to substitutions per site:
+
+    d = -1/k * ln(2J / (1 + J))
+
+All sequences are sketched at once and all pairs are compared with array
+operations, so this is fast enough to triage thousands of sequences before
+anything is aligned. Distances are rough, especially for divergent sequences;
+see util.sequences.scrollsaw for re-ranking the closest sequences with an
+alignment-based distance. Pairs sharing no sampled k-mers, or with a sequence
+shorter than k, are set to max_distance (see phylo.distances).
+"""
+
+import numpy as np
+
+from phylo import distances
+
+# Placeholders - should be through settings eventually
+kmer_size = 4
+num_hashes = 256 # more hashes give a better estimate of J, at linear cost
+seed = 42 # fixed, so that sketches (and cached distances) are reproducible
+
+prime = 2**31 - 1 # hash values are modulo this prime; larger than 20**kmer_size
+
+def get_model_name(k=kmer_size, n=num_hashes):
+    """Returns the name used to cache distances for these parameters"""
+    return 'sketch-k{}-n{}'.format(k, n)
+
+def get_kmers(seqs, k=kmer_size):
+    """
+    Returns each sequence's k-mers as integers in an (n, windows) array; k-mers
+    with a gap or an ambiguous residue, or past the end of a sequence, are -1
+    """
+    codes = distances.encode([seq.replace('-','') for seq in seqs])
+    n, length = codes.shape
+    width = max(0, length - k + 1)
+    kmers = np.zeros((n, width), dtype=np.int64)
+    valid = np.ones((n, width), dtype=bool)
+    for offset in range(k):
+        window = codes[:,offset:offset + width]
+        kmers = kmers * len(distances.amino_acids) + window
+        valid &= window >= 0
+    kmers[~valid] = -1
+    return kmers
+
+def get_hash_params(n=num_hashes):
+    """Returns the coefficients of the hash functions, (a*x + b) % prime"""
+    state = np.random.RandomState(seed)
+    a = state.randint(1, prime, size=n).astype(np.int64)
+    b = state.randint(0, prime, size=n).astype(np.int64)
+    return a, b
+
+def sketch(seqs, k=kmer_size, n=num_hashes):
+    """
+    Returns the MinHash sketch of each sequence, as an (n_seqs, n) array;
+    sequences without any k-mers have all values equal to prime
+    """
+    kmers = get_kmers(seqs, k)
+    a, b = get_hash_params(n)
+    sketches = np.full((len(seqs), n), prime, dtype=np.int64)
+    width = kmers.shape[1]
+    if width == 0:
+        return sketches
+    rows = max(1, distances.chunk_size // (width * n))
+    for start in range(0, len(seqs), rows):
+        block = kmers[start:start + rows]
+        hashes = (block[:,:,None] * a + b) % prime # (rows, windows, n)
+        hashes[block < 0] = prime # never the minimum of a sequence with k-mers
+        sketches[start:start + rows] = hashes.min(axis=1)
+    return sketches
+
+def jaccard(sketches):
+    """
+    Returns the estimated Jaccard index of each pair of sketches; NaN where a
+    sequence has no k-mers
+    """
+    n, size = sketches.shape
+    shared = np.empty((n, n))
+    rows = max(1, distances.chunk_size // max(1, n * size))
+    for start in range(0, n, rows):
+        block = sketches[start:start + rows]
+        shared[start:start + rows] = (block[:,None,:] == sketches[None,:,:]).mean(axis=2)
+    empty = (sketches == prime).all(axis=1)
+    shared[empty,:] = np.nan
+    shared[:,empty] = np.nan
+    return shared
+
+def sketch_distance(seqs, k=kmer_size, n=num_hashes):
+    """Returns the matrix of Mash distances between unaligned sequences"""
+    j = jaccard(sketch(seqs, k, n))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dist = -np.log(2 * j / (1 + j)) / k
+    return distances.finish(dist)
+
+def get_distances(headers_seqs, k=kmer_size, n=num_hashes):
+    """Returns the distance matrix of unaligned sequences given as (headers, seqs)"""
+    headers, seqs = headers_seqs
+    return sketch_distance(seqs, k, n)
@@ -0,0 +1,122 @@
+"""
+This module contains code for random access to sequences in FASTA files. Rather
+than parsing an entire file each time a few sequences are needed, the file is
+scanned once to record the byte offset and length of every entry, keyed both by
+sequence ID and by normalized description; entries are then read directly from
+a memory-mapped copy of the file and parsed individually.
+
+Indexes for record files are stored on the FastaFile object itself and rebuilt
+whenever the size or modification time of the underlying file changes. Indexes
+can also be built for any other file without being stored.
+"""
+
+import io, os, mmap
+
+from persistent import Persistent
+from BTrees.OOBTree import OOBTree
+from Bio import SeqIO
+
+def normalize_description(description):
+    """
+    Returns the form of a description used for lookups; surrounding whitespace
+    is removed and tabs are replaced the same way BLAST does in its output
+    """
+    return str(description).strip().replace('\t','   ')
+
+class FastaIndex(Persistent):
+    """
+    Offsets of all entries in a FASTA file. Only the first entry is kept for a
+    repeated ID or description, which is also the one a linear scan finds first.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.size = None
+        self.mtime = None
+        self.num_entries = 0
+        self.by_id = OOBTree() # id -> (offset, length)
+        self.by_description = OOBTree() # normalized description -> (offset, length)
+
+    def is_current(self):
+        """True if the file has not changed since the index was built"""
+        try:
+            stat = os.stat(self.filepath)
+        except(OSError):
+            return False
+        return (stat.st_size == self.size and stat.st_mtime_ns == self.mtime)
+
+    def build(self):
+        """Scans the file once for the position of each entry"""
+        stat = os.stat(self.filepath)
+        self.by_id.clear()
+        self.by_description.clear()
+        self.num_entries = 0
+        offset = 0
+        start = None
+        header = None
+        with open(self.filepath,'rb') as f:
+            for line in f:
+                if line.startswith(b'>'):
+                    if header is not None:
+                        self.add_entry(header, start, (offset - start))
+                    header = line
+                    start = offset
+                offset += len(line)
+        if header is not None:
+            self.add_entry(header, start, (offset - start))
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime_ns
+
+    def add_entry(self, header, offset, length):
+        """Adds a single entry from its raw header line"""
+        description = header[1:].decode('utf-8').rstrip()
+        seq_id = description.split(None,1)[0] if description else ''
+        if not seq_id in self.by_id:
+            self.by_id[seq_id] = (offset, length)
+        key = normalize_description(description)
+        if not key in self.by_description:
+            self.by_description[key] = (offset, length)
+        self.num_entries += 1
+
+    def get_records(self, descriptions=(), ids=()):
+        """
+        Returns a list of SeqRecords for all entries matching the given
+        descriptions or IDs, in the order they appear in the file
+        """
+        positions = set()
+        for description in descriptions:
+            try:
+                positions.add(self.by_description[normalize_description(description)])
+            except(KeyError):
+                pass # not in file
+        for seq_id in ids:
+            try:
+                positions.add(self.by_id[str(seq_id)])
+            except(KeyError):
+                pass
+        return self.read_records(sorted(positions))
+
+    def get_record(self, description=None, seq_id=None):
+        """Returns a single SeqRecord, or None if not in file"""
+        if description is not None:
+            records = self.get_records(descriptions=[description])
+        else:
+            records = self.get_records(ids=[seq_id])
+        return records[0] if records else None
+
+    def read_records(self, positions):
+        """Parses the entries at each (offset, length) from the mapped file"""
+        records = []
+        if not positions:
+            return records
+        with open(self.filepath,'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                for offset,length in positions:
+                    text = m[offset:(offset + length)].decode('utf-8')
+                    records.extend(SeqIO.parse(io.StringIO(text), 'fasta'))
+        return records
+
+def get_file_index(filepath):
+    """Builds an index for a file that is not part of a record"""
+    index = FastaIndex(filepath)
+    index.build()
+    return index
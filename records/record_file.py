@@ -81,3 +81,23 @@ class FastaFile(File):
         File.__init__(self, name, filepath, filetype, size, num_entries,
                 num_lines, num_bases)
         self.separator = '>'
+        self.index = None # offsets of entries; see records.fasta_index
+
+    def update_file(self):
+        """Also re-indexes the file"""
+        File.update_file(self)
+        self.get_index()
+
+    def get_index(self):
+        """
+        Returns an index of the file for random access to its sequences; the
+        index is built on first use and again whenever the file changes
+        """
+        from records import fasta_index
+        index = getattr(self, 'index', None) # files added before indexing have none
+        if index is None or index.filepath != self.filepath:
+            index = fasta_index.FastaIndex(self.filepath)
+            self.index = index
+        if not index.is_current():
+            index.build()
+        return index
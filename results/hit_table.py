@@ -0,0 +1,117 @@
+"""
+This module contains code for storing parsed search output compactly. Instead of
+keeping the full parsed record (every HSP and alignment string for BLAST, or an
+object per row for HMMer) on each result, only the columns that later steps
+actually read are kept: hit titles, E-values, scores and the rank of each hit.
+
+Titles are stored as a single string and numeric columns as packed arrays, so
+that each table pickles to a handful of objects. A HitTable is its own
+persistent object and is only loaded from the database once it is accessed;
+columns are then unpacked once and kept for as long as the object is in memory.
+
+For compatibility with code written against parsed records, the table also has
+a descriptions attribute holding one lightweight hit per row with the same
+title and e attributes.
+"""
+
+import sys
+from array import array
+
+from persistent import Persistent
+
+class TableHit:
+    """A single row of a hit table"""
+    __slots__ = ['title', 'e', 'score', 'rank']
+
+    def __init__(self, title, e, score, rank):
+        self.title = title
+        self.e = e
+        self.score = score
+        self.rank = rank # position in the original output, from 0
+
+class HitTable(Persistent):
+    """
+    Column-oriented store of the hits for one result, in the order they were
+    reported by the search program
+    """
+    def __init__(self, titles=(), evalues=(), scores=(), ranks=None):
+        titles = list(titles)
+        for title in titles:
+            if '\n' in title:
+                raise ValueError("Hit titles cannot span lines: {}".format(title))
+        self.num_hits = len(titles)
+        self._titles = '\n'.join(titles)
+        self._evalues = array('d', evalues).tobytes()
+        self._scores = array('d', scores).tobytes()
+        if ranks is None:
+            ranks = range(self.num_hits)
+        self._ranks = array('L', ranks).tobytes()
+
+    def __len__(self):
+        return self.num_hits
+
+    def __iter__(self):
+        return iter(self.descriptions)
+
+    def get_titles(self):
+        """Returns a list of titles; each title is interned"""
+        try:
+            return self._v_titles
+        except(AttributeError): # not yet unpacked since loading
+            if self.num_hits:
+                self._v_titles = [sys.intern(title) for title in
+                        self._titles.split('\n')]
+            else:
+                self._v_titles = []
+            return self._v_titles
+
+    def get_evalues(self):
+        """Returns the E-value column as an array"""
+        return self._get_column('_evalues', 'd')
+
+    def get_scores(self):
+        """Returns the score column as an array"""
+        return self._get_column('_scores', 'd')
+
+    def get_ranks(self):
+        """Returns the rank column as an array"""
+        return self._get_column('_ranks', 'L')
+
+    def _get_column(self, name, typecode):
+        """Unpacks a column once for each time the object is loaded"""
+        cache_name = '_v' + name
+        try:
+            return getattr(self, cache_name)
+        except(AttributeError):
+            column = array(typecode)
+            column.frombytes(getattr(self, name))
+            setattr(self, cache_name, column)
+            return column
+
+    @property
+    def descriptions(self):
+        """
+        One TableHit per row; the same objects are returned each time while
+        the table is in memory, like the descriptions of a parsed record
+        """
+        try:
+            return self._v_descriptions
+        except(AttributeError):
+            self._v_descriptions = [TableHit(title, e, score, rank) for
+                    title,e,score,rank in zip(self.get_titles(),
+                        self.get_evalues(), self.get_scores(), self.get_ranks())]
+            return self._v_descriptions
+
+def from_descriptions(descriptions):
+    """
+    Builds a table from the descriptions of a parsed BLAST (XML or tabular) or
+    HMMer record; all of these have title, e and score attributes
+    """
+    titles = []
+    evalues = []
+    scores = []
+    for desc in descriptions:
+        titles.append(str(desc.title))
+        evalues.append(float(desc.e))
+        scores.append(float(desc.score))
+    return HitTable(titles, evalues, scores)
@@ -3,18 +3,21 @@ This module contains helper functions/classes for dealing with intermediate sear
 results, including creating new or reverse searches from them.
 """
 
-import re
-from Bio import SeqIO
-
 from bin.initialize_goat import configs
 
 from searches import search_util
 from queries import query_objects
+from records import fasta_index
 
 class Search2Queries:
-    def __init__(self, search_obj, mode='reverse'):
+    def __init__(self, search_obj, mode='reverse', evalue=None, max_hits=None,
+            results=None):
         self.sobj = search_obj
         self.mode = mode
+        self.results = results # only these result ids, if given
+        # forward cutoffs of the summary, if known; see Result2Queries.get_hits
+        self.evalue = evalue
+        self.max_hits = max_hits
         # get dbs from global variables
         self.sqdb = configs['search_queries']
         self.udb = configs['result_db']
@@ -23,51 +26,111 @@ class Search2Queries:
 
     def get_result_objs(self):
         """Goes through and fetches the robj for each rid"""
-        for rid in self.sobj.list_results():
+        rids = self.results if self.results is not None else self.sobj.list_results()
+        for rid in rids:
             #print(rid)
             robj = self.udb[rid]
             yield robj
 
     def populate_search_queries(self):
-        """Populates queries for each result"""
+        """
+        Populates queries for each result. Results are grouped by target
+        database so that the hits for all results against one database are
+        read together, and all new queries for a database are added to the
+        search queries db at once.
+        """
+        groups = {} # (database, db_type) -> results, in original order
         for robj in self.get_result_objs():
-            r2q = Result2Queries(self.sobj, robj, self.mode)
-            r2q.add_queries() # adds queries to search queries db
+            groups.setdefault((robj.database, robj.db_type), []).append(
+                    Result2Queries(self.sobj, robj, self.mode, self.evalue,
+                        self.max_hits))
+        for r2q_list in groups.values():
+            self.add_database_queries(r2q_list)
+        cutoffs = (self.evalue, self.max_hits)
+        if self.sobj.rev_query_cutoffs != cutoffs: # for later summaries
+            self.sobj.rev_query_cutoffs = cutoffs
+
+    def add_database_queries(self, r2q_list):
+        """Adds queries for all results against the same database"""
+        titles = {} # r2q -> normalized hit descriptions
+        for r2q in r2q_list:
+            titles[r2q] = set(fasta_index.normalize_description(title) for
+                    title in r2q.get_desired_titles())
+        all_titles = set().union(*titles.values())
+        # single read of all needed entries; records are in file order
+        records = r2q_list[0].get_record_index().get_records(
+                descriptions=all_titles)
+        lookup = {} # normalized description -> (position in file, record)
+        for i,record in enumerate(records):
+            lookup[fasta_index.normalize_description(record.description)] = (i, record)
+        entries = {}
+        for r2q in r2q_list:
+            found = sorted(lookup[title] for title in titles[r2q] if
+                    title in lookup)
+            r2q.add_queries([record for i,record in found], entries)
+        self.sqdb.add_entries(entries) # adds the qobjs to the int database
 
 class Result2Queries:
-    def __init__(self, search_obj, result_obj, mode='reverse'):
+    def __init__(self, search_obj, result_obj, mode='reverse', evalue=None,
+            max_hits=None):
         self.sobj = search_obj
         self.uobj = result_obj
         self.mode = mode
+        self.evalue = evalue
+        self.max_hits = max_hits
         # dbs are global
         self.qdb = configs['query_db']
         self.rdb = configs['record_db']
         self.sqdb = configs['search_queries']
 
-    def get_titles(self):
+    def get_hits(self):
+        """
+        Returns the hits to make queries from; when forward cutoffs are given,
+        only hits that SearchSummarizer.add_reverse_hits would go on to look at:
+        those before max_hits, and below evalue up to the first hit above it
+        """
+        hits = []
+        for hit_index,hit in enumerate(self.uobj.parsed_result.descriptions):
+            if self.max_hits and hit_index == self.max_hits:
+                break
+            if self.evalue is not None:
+                if hit.e > self.evalue:
+                    break # no hit after this one is looked at either
+                elif not hit.e < self.evalue:
+                    continue # equal to the cutoff, skipped by summarizer
+            hits.append(hit)
+        return hits
+
+    def get_desired_titles(self):
         """Return a list of hit names"""
         desired_seqs = []
-        seq_records = []
         if self.sobj.algorithm == 'blast':
             desired_seqs.extend([search_util.remove_blast_header(hit.title)
-                for hit in self.uobj.parsed_result.descriptions])
+                for hit in self.get_hits()])
         elif self.sobj.algorithm == 'hmmer':
             #desired_seqs.extend([(hit.target_name + ' ' + hit.desc) # should recapitulate description
             #    for hit in self.uobj.parsed_result.descriptions])
-            desired_seqs.extend([hit.title for hit in self.uobj.parsed_result.descriptions])
+            desired_seqs.extend([hit.title for hit in self.get_hits()])
         #tterfile = open('/Users/cklinger/tthermophila.txt','w')
         #for seq in desired_seqs:
             #print(seq)
             #print()
             #tterfile.write(str(seq) + '\n')
             #tterfile.write('\n') #print()
-        for record in SeqIO.parse(self.get_record_file(), "fasta"):
-            #print(str(record.description).strip())
-            #tterfile.write(str(record.description) + '\n')
-            if (record.description in desired_seqs or\
-                re.sub('\t','   ',record.description) in desired_seqs): # BLAST turns tabs into three spaces
-                seq_records.append(record)
-        return seq_records
+        return desired_seqs
+
+    def get_titles(self):
+        """Return a list of records for all hits"""
+        # lookup is by normalized description, since BLAST turns tabs into three spaces
+        return self.get_record_index().get_records(
+            descriptions=self.get_desired_titles())
+
+    def get_record_index(self):
+        """Return the index of the db record file; see records.fasta_index"""
+        robj = self.rdb[self.uobj.database] # fetch record object
+        for v in robj.files.values():
+            if v.filetype == self.uobj.db_type:
+                return v.get_index()
 
     def get_record_file(self):
         """Return the full handle to the db record file"""
@@ -76,10 +139,13 @@ class Result2Queries:
             if v.filetype == self.uobj.db_type:
                 return v.filepath
 
-    def add_queries(self):
+    def add_queries(self, records=None, entries=None):
         """
         Adds new query objects; these are present both as a list of qids in
-        the result_obj and as query objects in the search_queries DB
+        the result_obj and as query objects in the search_queries DB. If
+        records are given, they are used instead of looking up hits; if
+        entries is given, query objects are added to it for the caller to
+        write to the search_queries DB instead.
         """
         o_qid = None # original query
         tdb = None # target db
@@ -93,7 +159,9 @@ class Result2Queries:
                     o_qid = self.uobj.spec_qid
                 if self.uobj.spec_record:
                     tdb = self.uobj.spec_record
-        for record in self.get_titles():
+        if records is None:
+            records = self.get_titles()
+        for record in records:
             qobj = query_objects.SeqQuery(
                     identity=record.id,
                     name=record.name,
@@ -103,4 +171,7 @@ class Result2Queries:
                     target_db=tdb,
                     original_query=o_qid)
             self.uobj.add_int_query(record.id)
-            self.sqdb.add_entry(record.id, qobj) # adds the qobj to the int database
+            if entries is None:
+                self.sqdb.add_entry(record.id, qobj) # adds the qobj to the int database
+            else:
+                entries[record.id] = qobj
@@ -0,0 +1,171 @@
+"""
+This module contains a write-behind writer for result objects. Rather than each
+search adding its result to the database from the search thread, and everything
+being committed at once when an analysis finishes, completed results are put on
+a queue and stored by a dedicated thread with its own database connection.
+
+The writer commits in bounded batches, taking savepoints within each batch so
+that new objects can be released from memory, and minimizes the connection's
+cache after each commit; finished results are thus durable as they complete and
+memory use stays flat however many searches are run. A handler (e.g. a parser)
+can be given to process each result in the writer thread before it is stored.
+If a commit conflicts with another thread, the whole batch, handlers included,
+is processed and stored again; handlers must therefore allow being run more
+than once for the same result.
+One writer can be shared by several searches; flush() returns a Future that is
+done once every result queued so far is committed, or that raises a WriteError
+if any of them could not be.
+"""
+
+import time, queue, threading
+from concurrent.futures import Future
+
+from ZODB.POSException import ConflictError
+
+from bin.initialize_goat import configs
+
+# Placeholders - should be through settings eventually
+batch_size = 200 # results per commit
+savepoint_size = 25 # results between savepoints within a batch
+commit_interval = 30 # seconds before a partial batch is committed anyway
+commit_retries = 3 # times a batch that conflicts with another thread is written again
+
+class WriteError(Exception):
+    """Raised from flush() when results could not be committed"""
+    pass
+
+class ResultWriter:
+    """
+    Stores result objects from a queue in a background thread; call start()
+    before putting results, and close() to wait until all are committed
+    """
+    def __init__(self, handler=None, batch_size=batch_size,
+            savepoint_size=savepoint_size, commit_interval=commit_interval):
+        self.handler = handler # called with each result before it is stored
+        self.batch_size = max(1, int(batch_size))
+        self.savepoint_size = max(1, int(savepoint_size))
+        self.commit_interval = commit_interval
+        self.queue = queue.Queue()
+        self.num_written = 0
+        self._batch = [] # (result, handler) stored but not yet committed
+        self._replay = False # whether the batch must be written again to commit
+        self._last_commit = None
+        self._error = None # reported by the next flush()
+        self._thread = None
+
+    def start(self):
+        """Starts the writer thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def put(self, robj, handler=None):
+        """Queues a result object to be stored; handler replaces the default"""
+        self.queue.put((robj, handler))
+
+    def flush(self):
+        """
+        Returns a Future that is done once all results put so far have been
+        committed; other threads see them after their next transaction. If
+        any results since the last flush could not be committed, the Future
+        raises a WriteError instead.
+        """
+        future = Future()
+        if self._thread is None: # nothing can be waiting
+            future.set_result(self.num_written)
+        else:
+            self.queue.put(future)
+        return future
+
+    def close(self):
+        """Waits until every queued result is committed; stops the thread"""
+        if self._thread is not None:
+            self.queue.put(None) # signals the end
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """Writer thread; uses its own database connection"""
+        self.udb = configs['result_db']
+        self._last_commit = time.time()
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=self.commit_interval)
+                except(queue.Empty): # idle; don't keep finished work waiting
+                    self.commit_batch()
+                    continue
+                if item is None:
+                    break
+                if isinstance(item, Future): # see flush()
+                    self.commit_batch()
+                    if self._error is not None:
+                        item.set_exception(self._error)
+                        self._error = None
+                    else:
+                        item.set_result(self.num_written)
+                    continue
+                self.write(*item)
+                if (len(self._batch) >= self.batch_size or
+                        time.time() - self._last_commit >= self.commit_interval):
+                    self.commit_batch()
+                elif len(self._batch) % self.savepoint_size == 0:
+                    self.savepoint()
+            self.commit_batch()
+        finally:
+            configs['goat_db'].close_connection(commit=False) # nothing left to commit
+
+    def write(self, robj, handler=None):
+        """Processes a single result and adds it to the result db"""
+        self._batch.append((robj, handler))
+        try:
+            self._write(robj, handler)
+        except(ConflictError): # e.g. could not read; written again on commit
+            self._replay = True
+
+    def _write(self, robj, handler=None):
+        """Runs the handler for a result and stores it; may be run again"""
+        handler = handler if handler else self.handler
+        if handler:
+            try:
+                handler(robj)
+            except(ConflictError):
+                raise
+            except(Exception) as e:
+                print("Could not process result {}: {}".format(robj.name, e))
+        self.udb[robj.name] = robj
+
+    def _write_batch(self):
+        """
+        Called by goat_db.transact() when committing; after the changes of the
+        batch were aborted, every result is processed and stored again
+        """
+        if self._replay:
+            for i,(robj,handler) in enumerate(self._batch, 1):
+                self._write(robj, handler)
+                if i % self.savepoint_size == 0:
+                    self.savepoint()
+        self._replay = True # if this attempt conflicts too
+
+    def savepoint(self):
+        """Moves changes in the current batch out of memory"""
+        connection = configs['goat_db'].get_connection()
+        connection.transaction_manager.savepoint(optimistic=True)
+        connection.cacheGC()
+
+    def commit_batch(self):
+        """Commits all results stored since the last commit"""
+        goat_db = configs['goat_db']
+        if self._batch:
+            try:
+                goat_db.transact(self._write_batch, commit_retries)
+            except(ConflictError): # the batch is lost; searches must be run again
+                message = "Could not store {} results".format(len(self._batch))
+                print(message)
+                self._error = WriteError(message)
+            else:
+                self.num_written += len(self._batch)
+            self._batch = []
+            self._replay = False
+            goat_db.get_connection().cacheMinimize()
+        self._last_commit = time.time()
@@ -0,0 +1,450 @@
+"""
+This module contains the searches and analyses that Goat runs from a starting
+search, expressed as graphs of tasks (see util.pipeline) rather than as fixed
+phases. The forward search is run once for all queries, so that it can still be
+batched; after that, every query has its own chain of tasks: getting reverse
+queries, the reverse search, summarizing, aligning the positive hits with
+MAFFT, hmmbuild, and the final reverse BLAST. One query's alignment can thus be
+built while another's reverse search is still running, and a slow query only
+holds up its own chain. The forward HMMer search is the exception: the HMMs of
+up to hmm_batch_size queries are searched together, so that each database is
+scanned once per batch rather than once per HMM (see SearchRunner.group_jobs).
+
+All tasks run on one thread, which owns the database connection; searches and
+other external programs run concurrently on the shared executor, and all search
+results are stored by a single writer (see results.result_writer). Each task is
+recorded as a job (see searches.job_table), so that an interrupted analysis can
+be resumed by running it again.
+"""
+
+import os, inspect
+
+from bin.initialize_goat import configs
+
+from searches import new_search_runner, search_obj, job_table
+from searches.hmmer import hmmer_build
+from results import intermediate, result_writer
+from summaries import summary_obj, summarizer
+from util.sequences import seqs_from_summary
+from util.alignment import mafft
+from queries import query_file
+from util import pipeline, executor
+
+# Placeholders - should be through settings eventually
+hmmer_path = '/Users/cklinger/src/hmmer-3.1b1-macosx-intel/src'
+track_jobs = True # record jobs so that analyses can be resumed; see searches.job_table
+max_build_threads = 8 # most threads for a single MAFFT or hmmbuild run
+hmm_batch_size = 25 # HMMs run together in each forward HMMer search
+
+# Modes that run a reverse search after the forward search
+analysis_modes = ('recip_blast', 'hmmer_blast', 'full_blast_hmmer')
+
+class AnalysisPipeline:
+    """
+    Builds and runs the task graph for a search or analysis; start_sobj must
+    be stored in the search db. other_widget gets the same calls as from a
+    SearchRunner (increment_search_count, add_file_to_delete), and listener,
+    if given, is called with each task as its state changes.
+    """
+    def __init__(self, start_sobj, mode, rev_search_name=None,
+            keep_rev_output=None, kwargs=None, other_widget=None, listener=None,
+            track_jobs=track_jobs):
+        self.start_name = start_sobj.name
+        self.mode = mode
+        self.rev_name = rev_search_name
+        self.rev_ko = keep_rev_output
+        self.kwargs = dict(kwargs) if kwargs else {}
+        self.other = other_widget
+        self.track_jobs = track_jobs
+        self.tracker = None # see run()
+        self.pipeline = pipeline.Pipeline(listener)
+        self.writer = result_writer.ResultWriter() # shared by all searches
+        self._reverse_tasks = {} # (search name, reverse qid) -> task running it
+        # dbs are global
+        self.qdb = configs['query_db']
+        self.udb = configs['result_db']
+        self.sdb = configs['search_db']
+        self.mdb = configs['summary_db']
+        self.build()
+
+    def get_params(self):
+        """Returns the arguments needed to start this analysis again"""
+        return {'rev_search_name':self.rev_name, 'keep_rev_output':self.rev_ko,
+                'kwargs':dict(self.kwargs)}
+
+    def run(self):
+        """
+        Runs all tasks on the calling thread; returns True if every task
+        finished, in which case the analysis is recorded as finished
+        """
+        if self.track_jobs:
+            self.tracker = job_table.get_tracker(self.start_name, self.mode,
+                    self.get_params())
+        self.writer.start()
+        try:
+            done = self.pipeline.run()
+        finally:
+            self.writer.close()
+        if done and self.tracker:
+            self.tracker.set_finished()
+        configs['goat_db'].sync()
+        return done
+
+    def build(self):
+        """Adds the tasks for the mode"""
+        if self.mode == 'new':
+            self.add_search(self.start_name, 'new')
+        elif self.mode == 'rev':
+            self.add_search(self.start_name, 'rev')
+        elif self.mode in analysis_modes:
+            self.add_analysis()
+        else:
+            raise ValueError("No pipeline for mode {}".format(self.mode))
+
+    def add_task(self, name, func, deps=(), kind='stage', check=None):
+        """
+        Adds a task that is recorded as a job under its name; func returns a
+        dict of outputs, or is a generator that does. A job finished by an
+        earlier run is not run again, if check (given the job's outputs)
+        agrees that its outputs still exist.
+        """
+        def run():
+            if self.tracker and self.tracker.is_done(name, check):
+                return self.tracker.get_outputs(name)
+            if self.tracker:
+                self.tracker.start(name, kind)
+            try:
+                outputs = func()
+                if inspect.isgenerator(outputs):
+                    outputs = yield from outputs
+                outputs = outputs if outputs else {}
+                if self.tracker: # a lost commit fails the task
+                    self.tracker.finish(name, outputs)
+            except(Exception) as e:
+                if self.tracker:
+                    self.tracker.fail(name, e)
+                raise
+            return outputs
+        return self.pipeline.add(name, run, deps)
+
+    def get_outputs(self, name):
+        """Returns the outputs of a finished task"""
+        return self.pipeline.tasks[name].result
+
+    def get_runner(self, sobj, mode):
+        """Returns a runner for a search that uses the shared writer"""
+        return new_search_runner.SearchRunner(sobj, mode=mode,
+                other_widget=self.other, tracker=self.tracker, writer=self.writer)
+
+    def get_query_results(self, sobj, qid):
+        """
+        Returns the ids of the results of one query in a search; results of
+        other queries may still be waiting to be stored
+        """
+        return [uid for uid in (new_search_runner.get_result_id(sobj.name, qid, db)
+            for db in sobj.databases) if uid in sobj.results]
+
+    def search_exists(self, outputs):
+        """Checks that the search recorded by a task is still stored"""
+        self.sdb[outputs['search']]
+        return True
+
+##################################
+# Tasks shared by all pipelines  #
+##################################
+
+    def add_search(self, name, mode, deps=()):
+        """Adds a task that runs all queries of a stored search"""
+        def search():
+            runner = self.get_runner(self.sdb[name], mode)
+            yield from runner.iter_run()
+            yield from runner.iter_parse()
+            return {'search':name}
+        return self.add_task('search:' + name, search, deps, 'search',
+                check=self.search_exists)
+
+    def add_search_objects(self):
+        """
+        Adds a task that creates the searches (and summary) that later tasks
+        add queries and results to, so that each query's tasks only add to them
+        """
+        start_sobj = self.sdb[self.start_name]
+        def create():
+            names = [self.add_search_obj(self.rev_name, 'blast', start_sobj.db_type,
+                start_sobj.q_type, [], self.rev_ko)]
+            if self.mode == 'full_blast_hmmer':
+                names.append(self.add_search_obj(self.kwargs['fwd_name'], 'hmmer',
+                    start_sobj.q_type, start_sobj.db_type, start_sobj.databases,
+                    self.kwargs['fwd_ko']))
+                names.append(self.add_search_obj(self.kwargs['rev_name'], 'blast',
+                    start_sobj.db_type, start_sobj.q_type, [],
+                    self.kwargs['rev_ko']))
+                self.add_summary_obj(start_sobj)
+            return {'searches':names}
+        def check(outputs):
+            for name in outputs['searches']:
+                self.sdb[name]
+            if self.mode == 'full_blast_hmmer':
+                self.mdb[self.kwargs['summ_name']]
+            return True
+        return self.add_task('searches:' + self.start_name, create, check=check)
+
+    def add_search_obj(self, name, algorithm, q_type, db_type, databases,
+            keep_output):
+        """Stores a new search without queries; returns its name"""
+        sobj = search_obj.Search( # be explicit for clarity here
+            name = name,
+            algorithm = algorithm,
+            q_type = q_type,
+            db_type = db_type,
+            queries = [], # added by the tasks for each query
+            databases = list(databases), # empty for rev search
+            keep_output = keep_output,
+            output_location = self.sdb[self.start_name].output_location)
+        self.sdb.add_entry(sobj.name, sobj)
+        return sobj.name
+
+    def add_summary_obj(self, start_sobj):
+        """
+        Stores the summary of the forward and reverse BLAST; query summaries
+        are added up front, so that they keep the order of the queries
+        """
+        int_summary = summary_obj.Summary(
+            fwd_search = start_sobj.name,
+            fwd_qtype = start_sobj.q_type,
+            fwd_dbtype = start_sobj.db_type,
+            fwd_algorithm = start_sobj.algorithm,
+            fwd_evalue_cutoff = self.kwargs['fwd_evalue'],
+            fwd_max_hits = self.kwargs['fwd_hits'],
+            rev_search = self.rev_name,
+            rev_qtype = start_sobj.db_type,
+            rev_dbtype = start_sobj.q_type,
+            rev_algorithm = 'blast',
+            rev_evalue_cutoff = self.kwargs['rev_evalue'],
+            rev_max_hits = self.kwargs['rev_hits'],
+            next_hit_evalue_cutoff = self.kwargs['next_evalue'])
+        for qid in start_sobj.queries:
+            int_summary.add_query_summary(qid, summary_obj.QuerySummary(qid, None))
+        self.mdb.add_entry(self.kwargs['summ_name'], int_summary)
+
+    def add_reverse_queries(self, fwd_name, qid, deps, query_task=None,
+            evalue=None, max_hits=None):
+        """
+        Adds a task that populates the search queries db with the hits of qid
+        in the forward search, or of the query made by query_task, if given;
+        outputs the reverse queries. Forward cutoffs, if given, limit these to
+        hits that a summary with the same cutoffs can look at.
+        """
+        def reverse_queries():
+            fwd_qid = qid
+            if query_task is not None:
+                fwd_qid = self.get_outputs(query_task.name)['query']
+                if not fwd_qid: # no query was made
+                    return {'queries':[]}
+            fwd_sobj = self.sdb[fwd_name]
+            results = self.get_query_results(fwd_sobj, fwd_qid)
+            intermediate.Search2Queries(fwd_sobj, evalue=evalue,
+                    max_hits=max_hits, results=results).populate_search_queries()
+            # Get the relvant qids
+            rev_queries = []
+            for uid in results:
+                uobj = self.udb[uid]
+                for rev_qid in uobj.list_queries():
+                    rev_queries.append(rev_qid)
+            return {'queries':rev_queries}
+        return self.add_task('reverse_queries:{}:{}'.format(fwd_name, qid),
+                reverse_queries, deps)
+
+    def add_reverse_search(self, rev_name, qid, queries_task):
+        """
+        Adds a task that runs the reverse search for the queries found by
+        queries_task. Hits shared with another query are searched only once:
+        whichever task gets to them first runs them, and others wait for it.
+        """
+        name = 'search:{}:{}'.format(rev_name, qid)
+        def search():
+            rev_queries = list(dict.fromkeys( # no duplicates, in order
+                self.get_outputs(queries_task.name)['queries']))
+            rev_sobj = self.sdb[rev_name]
+            present = set(rev_sobj.queries)
+            new_queries = [rev_qid for rev_qid in rev_queries if not
+                    rev_qid in present]
+            if new_queries:
+                rev_sobj.queries = rev_sobj.queries + new_queries
+            to_run = []
+            others = []
+            for rev_qid in rev_queries:
+                task = self._reverse_tasks.setdefault((rev_name, rev_qid),
+                        self.pipeline.tasks[name])
+                if task.name == name:
+                    to_run.append(rev_qid)
+                elif not task in others:
+                    others.append(task)
+            runner = self.get_runner(rev_sobj, 'rev')
+            yield from runner.iter_run(to_run)
+            yield from runner.iter_parse()
+            for task in others:
+                if not task.is_finished():
+                    yield task.future
+                if task.state != 'done':
+                    raise RuntimeError("{} did not finish".format(task.name))
+            return {'search':rev_name, 'queries':rev_queries}
+        return self.add_task(name, search, [queries_task.name], 'search')
+
+###############################################
+# Tasks for reciprocal and full BLAST/HMMer   #
+###############################################
+
+    def add_analysis(self):
+        """
+        Adds the forward search, then the chain of tasks for each query; for
+        full_blast_hmmer, the chain goes on to build an HMM from the positive
+        hits and run a forward HMMer/reverse BLAST with it
+        """
+        setup = self.add_search_objects()
+        fwd = self.add_search(self.start_name, 'new')
+        hmm_queries = []
+        for qid in self.sdb[self.start_name].queries:
+            # for full_blast_hmmer, the cutoffs of the intermediate summary
+            rev_queries = self.add_reverse_queries(self.start_name, qid,
+                    [setup.name, fwd.name], evalue=self.kwargs.get('fwd_evalue'),
+                    max_hits=self.kwargs.get('fwd_hits'))
+            rev = self.add_reverse_search(self.rev_name, qid, rev_queries)
+            if self.mode == 'full_blast_hmmer':
+                hmm_queries.append((qid, self.add_hmm_query(qid, rev)))
+        for i in range(0, len(hmm_queries), hmm_batch_size):
+            batch = hmm_queries[i:i + hmm_batch_size]
+            fwd_hmmer = self.add_hmmer_search(i // hmm_batch_size,
+                    [hmm_query for qid,hmm_query in batch], [setup.name])
+            for qid,hmm_query in batch:
+                # optional; the HMMer search is summarized later, if at all
+                rev_queries = self.add_reverse_queries(self.kwargs['fwd_name'],
+                        qid, [fwd_hmmer.name, hmm_query.name],
+                        query_task=hmm_query,
+                        evalue=self.kwargs.get('hmmer_fwd_evalue'),
+                        max_hits=self.kwargs.get('hmmer_fwd_hits'))
+                self.add_reverse_search(self.kwargs['rev_name'], qid,
+                        rev_queries)
+
+    def add_hmm_query(self, qid, rev):
+        """
+        Adds the tasks after the reverse BLAST for a single query, up to the
+        query for the forward HMMer search; returns the last of them
+        """
+        summ_name = self.kwargs['summ_name']
+        fwd_name = self.kwargs['fwd_name']
+        # Summarize fwd and rev search using cutoff criteria
+        def summarize():
+            int_summarizer = summarizer.SearchSummarizer(self.mdb[summ_name])
+            int_summarizer.summarize_queries([qid])
+            return {'summary':summ_name}
+        summ = self.add_task('summary:{}:{}'.format(summ_name, qid), summarize,
+                [rev.name])
+        # Align the positive hits, streamed into MAFFT from memory, and then
+        # create the HMM, if there are any positive hits
+        def align():
+            seq_writer = seqs_from_summary.SummarySeqWriter(
+                    basename = self.start_name,
+                    summary_obj = self.mdb[summ_name],
+                    target_dir = self.sdb[self.start_name].output_location,
+                    hit_type = 'positive',
+                    mode = 'all',
+                    add_query_to_file = True, # adds the query object seq as well
+                    queries = [qid])
+            seq_writer.collect_ids()
+            lines = seq_writer.get_fasta_lines(qid)
+            if not lines:
+                return {'file':None}
+            msa_file = (seq_writer.get_output_file([qid, 'all', 'positive'])
+                    .rsplit('.',1)[0]) + '.mfa'
+            future = mafft.MAFFT(None, msa_file, threads=self.get_build_threads(),
+                    sequences=lines).submit()
+            yield future
+            self.check_job(future.result(), msa_file)
+            return {'file':msa_file}
+        msa = self.add_task('mafft:' + qid, align, [summ.name], 'mafft',
+                check=self.file_exists)
+        def build():
+            msafile = self.get_outputs(msa.name)['file']
+            if not msafile:
+                return {'file':None}
+            hmm_file = (msafile.rsplit('.',1)[0]) + '.hmm'
+            future = hmmer_build.HMMBuild(
+                    hmmbuild_path = hmmer_path,
+                    msa_filepath = msafile,
+                    hmm_out = hmm_file,
+                    cpu = self.get_build_threads()).submit()
+            yield future
+            self.check_job(future.result(), msafile)
+            return {'file':hmm_file}
+        hmm = self.add_task('hmmbuild:' + qid, build, [msa.name], 'hmmbuild',
+                check=self.file_exists)
+        # Create new intermediate query for forward HMMer search
+        def add_query():
+            hmmfile = self.get_outputs(hmm.name)['file']
+            if not hmmfile:
+                return {'query':None}
+            fwd_hmmer = self.sdb[fwd_name]
+            name,hmm_obj = query_file.HMMFile(
+                    hmmfile,fwd_hmmer.db_type).get_query()
+            hmm_obj.spec_qid = qid
+            qobj = self.qdb[qid]
+            hmm_obj.spec_record = qobj.record
+            hmm_obj.add_query(qid,qobj) # copy from qdb to misc_qdb
+            self.qdb[name] = hmm_obj # add to db
+            if not name in fwd_hmmer.queries:
+                fwd_hmmer.queries = fwd_hmmer.queries + [name]
+            return {'query':name}
+        return self.add_task('hmm_query:' + qid, add_query, [hmm.name])
+
+    def add_hmmer_search(self, batch_num, query_tasks, deps=()):
+        """
+        Adds a task that runs the forward HMMer search for the queries made by
+        query_tasks, all at once. It waits for each of them rather than
+        depending on them, so that a query whose HMM could not be made does not
+        stop the search for the others.
+        """
+        fwd_name = self.kwargs['fwd_name']
+        def hmmer_search():
+            names = []
+            for task in query_tasks:
+                if not task.is_finished():
+                    yield task.future
+                if task.state == 'done' and task.result['query']:
+                    names.append(task.result['query'])
+            runner = self.get_runner(self.sdb[fwd_name], 'new')
+            yield from runner.iter_run(names)
+            yield from runner.iter_parse()
+            return {'search':fwd_name, 'queries':names}
+        return self.add_task('search:{}:{}'.format(fwd_name, batch_num),
+                hmmer_search, deps, 'search')
+
+    def get_build_threads(self):
+        """
+        Threads for a MAFFT or hmmbuild run, from the executor's core budget;
+        while many queries are aligned at once, each run gets a single thread
+        """
+        return executor.get_executor().get_cores(max_build_threads)
+
+    def get_hmm_files(self):
+        """
+        Returns a dict of qid -> HMM file for the queries whose HMM has been
+        built so far, including by earlier runs of a resumed analysis
+        """
+        hmm_files = {}
+        for name in self.pipeline.order:
+            task = self.pipeline.tasks[name]
+            if name.startswith('hmmbuild:') and task.state == 'done':
+                if task.result.get('file'):
+                    hmm_files[name.split(':',1)[1]] = task.result['file']
+        return hmm_files
+
+    def check_job(self, job, filename):
+        """Raises an error if an external program did not finish properly"""
+        if not job.succeeded():
+            raise RuntimeError("Could not run {} for {}".format(job.name,
+                filename))
+
+    def file_exists(self, outputs):
+        """Checks that the file recorded by a task, if any, still exists"""
+        return not outputs['file'] or os.path.exists(outputs['file'])
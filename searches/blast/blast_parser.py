@@ -0,0 +1,187 @@
+"""
+This module contains code for dealing with raw BLAST output files. Parsing of
+single-query XML output is still done with BioPython, but batched searches send
+many queries to one BLAST process and the combined output needs to be split
+back into one file per query so that each result object keeps its own output.
+
+Tabular output (-outfmt 6 or 7) is written with a fixed set of columns and is
+parsed here directly; hits are streamed from the file as lightweight objects
+with the same title and e attributes as BioPython descriptions, and a parsed
+record keeps them on .descriptions in analogy to the BLAST record class.
+"""
+
+# Columns requested for tabular output; stitle is last since it may have spaces
+tabular_columns = ['qseqid', 'sseqid', 'evalue', 'bitscore', 'stitle']
+
+def get_outfmt(outfmt):
+    """Returns the -outfmt argument for BLAST; tabular formats add columns"""
+    if is_tabular(outfmt):
+        return ' '.join([str(outfmt)] + tabular_columns)
+    return str(outfmt)
+
+def is_tabular(outfmt):
+    """True for tabular output formats"""
+    return str(outfmt) in ('6','7')
+
+def get_batch_id(index):
+    """
+    Returns the query id given to the query at index in a batched -outfmt 6
+    search, whose rows are assigned back to each query by id; definition
+    lines can have the same first word, or one BLAST reports differently
+    """
+    return 'goat_query_{}'.format(index)
+
+class BLASTParser:
+    """
+    Superclass for BLAST output parsers that defines one method:
+
+    split() - writes the output for each query to its own file; must be
+    defined by subclasses
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    def split(self, outpaths, query_ids=None):
+        """Must be overridden in subclass"""
+        raise NotImplementedError
+
+class XMLParser(BLASTParser):
+    """Subclass for BLAST XML (-outfmt 5) output"""
+    def read(self):
+        """
+        Reads the file into a header, a list of <Iteration> blocks (one for each
+        query, in the order the queries were given) and a footer, each as a list
+        of lines
+        """
+        header = []
+        iterations = []
+        footer = []
+        current = None
+        with open(self.filepath) as f:
+            for line in f:
+                tag = line.strip()
+                if current is not None: # inside an iteration
+                    current.append(line)
+                    if tag == '</Iteration>':
+                        iterations.append(current)
+                        current = None
+                elif tag == '<Iteration>':
+                    current = [line]
+                elif iterations or tag.startswith('</BlastOutput_iterations>'):
+                    footer.append(line)
+                else:
+                    header.append(line)
+        return (header, iterations, footer)
+
+    def split(self, outpaths, query_ids=None):
+        """
+        Writes a complete single-query XML file for each query; outpaths must be
+        in the same order as the queries given to BLAST, so query_ids is not
+        needed. Returns the outpaths that were actually written; raises a
+        ValueError if there is not one iteration for each query.
+        """
+        header,iterations,footer = self.read()
+        if len(iterations) != len(outpaths):
+            raise ValueError("{} has {} iterations for {} queries".format(
+                self.filepath, len(iterations), len(outpaths)))
+        written = []
+        for outpath,iteration in zip(outpaths, iterations):
+            with open(outpath,'w') as o:
+                o.writelines(header)
+                o.writelines(iteration)
+                o.writelines(footer)
+            written.append(outpath)
+        return written
+
+class TabularHit:
+    """
+    A single hit from tabular output; title is the full subject definition line,
+    as for descriptions parsed from XML once the BLAST header is removed
+    """
+    __slots__ = ['query_id', 'hit_id', 'title', 'e', 'score']
+
+    def __init__(self, query_id, hit_id, title, e, score):
+        self.query_id = query_id
+        self.hit_id = hit_id
+        self.title = title
+        self.e = e
+        self.score = score
+
+class TabularRecord:
+    """Holds all hits for a single query, in the order reported by BLAST"""
+    def __init__(self, query_id=None):
+        self.query_id = query_id
+        self.descriptions = []
+
+    def add_description(self, desc):
+        """Simple convenience function"""
+        self.descriptions.append(desc)
+
+class TabularParser(BLASTParser):
+    """Subclass for BLAST tabular (-outfmt 6 or 7) output"""
+    def iter_hits(self):
+        """
+        Yields one hit for each subject in the file; BLAST writes one row for
+        each HSP, best first, so only the first row for each subject is kept
+        """
+        last = None
+        with open(self.filepath) as f:
+            for line in f:
+                if line.startswith('#') or not line.strip():
+                    last = None # new query block in -outfmt 7
+                    continue
+                qseqid,sseqid,evalue,bitscore,stitle = line.rstrip('\n').split('\t',4)
+                if (qseqid, sseqid) == last:
+                    continue # further HSPs of the same subject
+                last = (qseqid, sseqid)
+                yield TabularHit(qseqid, sseqid, stitle, float(evalue),
+                        float(bitscore))
+
+    def parse(self):
+        """Returns a record with all hits in the file"""
+        record = TabularRecord()
+        for hit in self.iter_hits():
+            if record.query_id is None:
+                record.query_id = hit.query_id
+            record.add_description(hit)
+        return record
+
+    def split(self, outpaths, query_ids=None):
+        """
+        Writes the rows for each query to its own file; outpaths must be in the
+        same order as the queries given to BLAST. Blocks in -outfmt 7 output are
+        assigned in order, and there must be one for each query; -outfmt 6 has
+        no blocks, so rows are instead assigned by query_ids (the query id that
+        BLAST reports, see get_batch_id). Returns the outpaths that were
+        actually written.
+        """
+        blocks = []
+        rows = {}
+        current = None
+        with open(self.filepath) as f:
+            for line in f:
+                if (line.startswith('# BLAST') and # first line of every -outfmt 7 block
+                        not line.startswith('# BLAST processed')): # last line of file
+                    current = []
+                    blocks.append(current)
+                if current is not None:
+                    current.append(line)
+                else:
+                    rows.setdefault(line.split('\t',1)[0], []).append(line)
+        if not blocks:
+            if query_ids is None:
+                raise ValueError("Query ids are needed to split {}".format(
+                    self.filepath))
+            if len(set(query_ids)) != len(query_ids):
+                raise ValueError("Query ids to split {} are not unique".format(
+                    self.filepath))
+            blocks = [rows.get(query_id, []) for query_id in query_ids]
+        elif len(blocks) != len(outpaths):
+            raise ValueError("{} has {} blocks for {} queries".format(
+                self.filepath, len(blocks), len(outpaths)))
+        written = []
+        for outpath,block in zip(outpaths, blocks):
+            with open(outpath,'w') as o:
+                o.writelines(block)
+            written.append(outpath)
+        return written
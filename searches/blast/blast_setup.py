@@ -5,7 +5,14 @@ subclass of the BLAST superclass, which defines methods and attributes
 common to all such searches.
 """
 
-import os, subprocess
+import os
+from threading import Lock
+
+from util import executor
+from searches.blast import blast_parser
+
+# Guards building BLAST databases when several searches share a target
+_db_lock = Lock()
 
 class BLAST():
     """
@@ -20,15 +27,43 @@ class BLAST():
         'culling_limit', 'best_hit_overhang', 'best_hit_score_edge',
         'dbsize', 'searchhsp', 'import_search_strategy', 'export_search_strategy',
         'parse_deflines', 'num_threads', 'remote', 'outfmt']
+    evalue = 0.0005 # reporting threshold used for all searches
 
-    def __init__(self, blast_path, query, db, out, outfmt=5, **kwargs):
+    def __init__(self, blast_path, query, db, out, outfmt=5, num_threads=4, **kwargs):
         self.blast_path = blast_path
         self.query = query
         self.db = db
         self.out = out
-        self.outfmt = outfmt
+        self.outfmt = outfmt # 5 for XML; 6 or 7 for tabular, see blast_parser
+        self.num_threads = num_threads # cores given to this search by the runner
         self.kwargs = kwargs
 
+    def get_queries(self):
+        """Returns a list of queries; self.query may be one query or a list"""
+        if isinstance(self.query, (list, tuple)):
+            return list(self.query)
+        return [self.query]
+
+    def get_query_ids(self):
+        """Convenience function for messages"""
+        return ', '.join(str(query.identity) for query in self.get_queries())
+
+    def get_stdin_input(self):
+        """
+        Writes all queries as (multi-)FASTA; BLAST reports each query as its own
+        <Iteration> in the same order as they are written here. For batched
+        -outfmt 6 searches, each query is given its id from get_batch_id.
+        """
+        lines = []
+        queries = self.get_queries()
+        for i,query in enumerate(queries):
+            # description and sequence recapitulates the original FASTA format
+            description = str(query.description)
+            if len(queries) > 1 and str(self.outfmt) == '6':
+                description = blast_parser.get_batch_id(i) + ' ' + description
+            lines.append('>' + description + '\n' + str(query.sequence) + '\n')
+        return ''.join(lines)
+
     def get_uniq_out(self, sep):
         """Gets a unique output file name"""
         db_name = os.path.basename(self.db)
@@ -43,44 +78,44 @@ class BLAST():
         # note, query location here needs to be changed once a scheme is in place
         # to hold separate query files for each
         args.extend(['-query', self.query.location, '-db', self.db, '-out', self.out,
-            '-outfmt', str(self.outfmt)], '-evalue', str(0.0005))
+            '-outfmt', blast_parser.get_outfmt(self.outfmt), '-evalue', str(self.evalue)])
         if self.kwargs:
             for k,v in self.kwargs:
                 if str(k) in valid_options: # will the program understand it?
                     args.append('-' + str(k))
                     args.append(str(v))
-        try:
-            subprocess.run(args)
-        except(Exception):
+        job = executor.get_executor().run(executor.Job(args, name=blast_type))
+        if not job.succeeded():
             print("Could not run BLAST for {} in {}".format(
                 self.query.identity, self.db))
 
-    def run_from_stdin(self, blast_type, valid_options=valid_options, sep='_'):
-        """Runs BLAST using obj as stdin"""
+    def get_stdin_job(self, blast_type, valid_options=valid_options, sep='_'):
+        """Returns an executor job that runs BLAST using obj as stdin"""
         #if not os.path.exists(self.out):
         args = []
         # first argument should always be the type of BLAST
         args.append(os.path.join(self.blast_path, blast_type))
         #out = self.get_uniq_out(sep='_')
-        num_procs = 4
-        args.extend(['-db', self.db, '-out', self.out, '-outfmt', str(self.outfmt),
-            '-num_threads', str(num_procs), '-evalue', str(0.0005)])
+        args.extend(['-db', self.db, '-out', self.out,
+            '-outfmt', blast_parser.get_outfmt(self.outfmt),
+            '-num_threads', str(self.num_threads), '-evalue', str(self.evalue)])
         if self.kwargs:
             for k,v in self.kwargs:
                 if str(k) in valid_options:
                     args.append('-' + str(k))
                     args.append(str(v))
-        try:
-            # input is from stdin
-            blast = subprocess.Popen(args, stdin=subprocess.PIPE)
-            # description and sequence recapitulates the original FASTA format
-            blast_query = '>' + str(self.query.description) + '\n' + str(self.query.sequence)
-            blast.stdin.write(blast_query.encode('utf-8')) # note the encoding
-            blast.communicate() # actually runs the search
-            #print('BLASTing from stdin')
-        except(Exception):
+        # input is from stdin
+        return executor.Job(args, name=blast_type, stdin=self.get_stdin_input(),
+                cores=self.num_threads) # counted against the shared core budget
+
+    def run_from_stdin(self, blast_type, valid_options=valid_options, sep='_'):
+        """Runs BLAST using obj as stdin"""
+        job = executor.get_executor().run(self.get_stdin_job(blast_type,
+            valid_options, sep)) # actually runs the search
+        if not job.succeeded():
             print("Could not run BLAST for {} in {}".format(
-                self.query.identity, self.db))
+                self.get_query_ids(), self.db))
+        return job
 
 class BLASTn(BLAST):
     """Subclass for BLASTn searches"""
@@ -107,10 +142,19 @@ class BLASTp(BLAST):
     def run_from_file(self, valid_options=valid_options, sep='_'):
         BLAST.run_from_file(self, "blastp", valid_options, sep)
 
+    def make_db(self):
+        """Builds the BLAST database for the target, if it does not exist yet"""
+        with _db_lock: # only one concurrent search should build the database
+            if not os.path.exists((self.db + '.phr')):
+                MakeProtDB(self.blast_path, self.db).make_blast_db()
+
+    def get_stdin_job(self, valid_options=valid_options, sep='_'):
+        """Database must already exist when the job is run; see make_db()"""
+        return BLAST.get_stdin_job(self, "blastp", valid_options, sep)
+
     def run_from_stdin(self, valid_options=valid_options, sep='_'):
-        if not os.path.exists((self.db + '.phr')):
-            MakeProtDB(self.blast_path, self.db).make_blast_db()
-        BLAST.run_from_stdin(self, "blastp", valid_options, sep)
+        self.make_db()
+        return BLAST.run_from_stdin(self, "blastp", valid_options, sep)
 
 #####################################
 # Class to run blast database setup #
@@ -129,11 +173,10 @@ class MakeBlastDB():
         args.append(os.path.join(self.blast_path, 'makeblastdb'))
         if self.db_type == 'prot':
             args.extend(['-in', self.infile, '-dbtype', str(self.db_type)])
-        try:
-            print(args)
-            print('running make blast db')
-            subprocess.run(args)
-        except(Exception):
+        print(args)
+        print('running make blast db')
+        job = executor.get_executor().run(executor.Job(args, name='makeblastdb'))
+        if not job.succeeded():
             print("Could not make BLAST database for {}".format(
                 self.infile))
 
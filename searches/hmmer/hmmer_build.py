@@ -4,7 +4,9 @@ be able to work with either stdin or file input, but for now stick to file
 input.
 """
 
-import os, subprocess
+import os
+
+from util import executor
 
 # Should eventually go through settings
 tmp_dir = '/Users/cklinger/git/Goat/tmp'
@@ -22,35 +24,46 @@ class HMMBuild():
             'informat', 'seed', 'w_beta', 'w_length', 'mpi', 'stall',
             'maxinsertlen']
 
-    def __init__(self, hmmbuild_path, msa_filepath, hmm_out, **kwargs):
+    def __init__(self, hmmbuild_path, msa_filepath, hmm_out, cpu=None, **kwargs):
         self.build_path = hmmbuild_path
         self.msapath = msa_filepath
         self.hmm_out = hmm_out # outpath for target file
+        self.cpu = cpu # worker threads, passed as --cpu if given
         self.kwargs = kwargs
 
     def run_from_file(self, valid_options=valid_options):
         """Runs the program"""
+        return executor.get_executor().run(self.get_file_job(valid_options))
+
+    def submit(self, valid_options=valid_options):
+        """Same as run_from_file, but returns a Future for the executor job"""
+        return executor.get_executor().submit(self.get_file_job(valid_options))
+
+    def get_file_job(self, valid_options=valid_options):
+        """Returns an executor job to build the HMM from the MSA file"""
         args = []
         args.append(os.path.join(self.build_path, 'hmmbuild'))
         # add arguments
         if self.kwargs:
-            for k,v in self.kwargs:
+            for k,v in self.kwargs.items():
                 if str(k) in valid_options:
                     if len(k) == 1:
                         args.append('-' + str(k)) # single hyphen for single letter args
                     else:
                         args.append('--' + str(k))
                     args.append(str(v))
+        if self.cpu:
+            args.extend(['--cpu', str(self.cpu)])
         args.extend([self.hmm_out, self.msapath])
-        try:
-            e_file = open(self.get_tmp_output(),'wb')
-            # Redirect both stdout and stderr to a file
-            # Args send stdout to self.hmm_out but the process stdout still
-            # Prints to the terminal despite this
-            subprocess.run(args, stdout=e_file,
-                    stderr=e_file)
-        except(Exception): # all but sys exits
-            pass # freak out
+        # Redirect both stdout and stderr to a file
+        # Args send stdout to self.hmm_out but the process stdout still
+        # Prints to the terminal despite this
+        return self.get_job(args)
+
+    def get_job(self, args):
+        """Returns an executor job for the given arguments"""
+        return executor.Job(args, name='hmmbuild', stdout=self.get_tmp_output(),
+                stderr=executor.STDOUT, cores=(self.cpu if self.cpu else 1))
 
     def get_tmp_output(self):
         """File for stderr redirection"""
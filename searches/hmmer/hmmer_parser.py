@@ -32,6 +32,32 @@ class HMMerParser:
         """Must be overridden in subclass"""
         raise NotImplementedError
 
+    def split(self, outpaths):
+        """
+        Splits output from a multi-model search into one file per model, keyed
+        on the query_name column; outpaths maps query_name to a target file.
+        Comment lines are copied to every file, and models without any hits
+        still get a file with no entries. Returns the outpaths written.
+        """
+        header = []
+        footer = []
+        rows = {}
+        with open(self.filepath) as f:
+            for line in dirfiles.nonblank_lines(f):
+                if line.startswith('#'):
+                    if rows: # comments after the entries
+                        footer.append(line)
+                    else:
+                        header.append(line)
+                else:
+                    query_name = line.split(maxsplit=3)[2]
+                    rows.setdefault(query_name, []).append(line)
+        for query_name,outpath in outpaths.items():
+            with open(outpath,'w') as o:
+                for line in header + rows.get(query_name, []) + footer:
+                    o.write(line + '\n')
+        return list(outpaths.values())
+
 class HMMsearchParser(HMMerParser):
     """Subclass to parse the main protein search output of HMMer."""
     def parse(self):
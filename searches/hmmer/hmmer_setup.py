@@ -5,11 +5,38 @@ searches through a common superclass, even though these are technically separate
 programs within the HMMer package.
 """
 
-import os, subprocess
+import os, re
+
+from util import executor
 
 # Should eventually go through settings
 tmp_dir = '/Users/cklinger/git/Goat/tmp'
 
+def get_model_name(index):
+    """
+    Returns the NAME given to the model at index in a library written by
+    write_hmm_library; unlike query identities or the NAMEs in the original
+    files, these are unique and contain no whitespace
+    """
+    return 'goat_model_{}'.format(index)
+
+def write_hmm_library(hmm_queries, outpath):
+    """
+    Writes the HMM text of each query object to a single multi-model file that
+    HMMer searches model by model. Each model's NAME is set by its position
+    (see get_model_name), which is what HMMer then reports in the query_name
+    column, so that rows can be assigned back to each query.
+    """
+    with open(outpath,'w') as o:
+        for i,qobj in enumerate(hmm_queries):
+            hmm = str(qobj.sequence) # sequence here is the entire parsed file
+            hmm = re.sub(r'^NAME[ \t]+.*$', 'NAME  ' + get_model_name(i), hmm,
+                    count=1, flags=re.M)
+            if not hmm.endswith('\n'):
+                hmm = hmm + '\n'
+            o.write(hmm)
+    return outpath
+
 class HMMer():
     """
     Parental HMMer class from which all (HMM-based and non-iterative) HMMer
@@ -20,12 +47,14 @@ class HMMer():
             'notextw', 'textw', 'E', 'T', 'incE', 'incT', 'cut_ga', 'cut_nc',
             'cut_tc', 'max', 'F1', 'F2', 'F3', 'nobias', 'nonull2', 'Z', 'seed',
             'cpu', 'stall', 'mpi']
+    evalue = 0.05 # reporting threshold used for all searches
 
-    def __init__(self, hmmer_path, query, db, out, **kwargs):
+    def __init__(self, hmmer_path, query, db, out, cpu=None, **kwargs):
         self.hmmer_path = hmmer_path
         self.query = query
         self.db = db
         self.out = out
+        self.cpu = cpu # worker threads given to this search by the runner
         self.kwargs = kwargs
 
     def get_uniq_out(self, sep):
@@ -47,17 +76,16 @@ class HMMer():
                     else:
                         args.append('--' + str(k))
                     args.append(str(v))
-        args.extend(['-E', str(0.05)])
+        args.extend(['-E', str(self.evalue)])
         args.extend([self.query.location, self.db])
         try:
-            e_file = open(self.get_tmp_output(),'wb')
-            subprocess.run(args, stdout=e_file,
-                    stderr=e_file)
+            executor.get_executor().run(executor.Job(args, name=hmmer_type,
+                stdout=self.get_tmp_output(), stderr=executor.STDOUT))
         except(Exception): # all but sys exits
             pass # freak out
 
-    def run_from_stdin(self, hmmer_type, valid_options=valid_options, sep='_'):
-        """Runs HMMer using obj as stdin"""
+    def get_stdin_job(self, hmmer_type, valid_options=valid_options, sep='_'):
+        """Returns an executor job that runs HMMer using obj as stdin"""
         args = []
         args.append(os.path.join(self.hmmer_path, hmmer_type))
         # specify the tabular output file
@@ -72,20 +100,58 @@ class HMMer():
                     else:
                         args.append('--' + str(k))
                     args.append(str(v))
-        args.extend(['-E', str(0.05)])
+        if self.cpu:
+            args.extend(['--cpu', str(self.cpu)])
+        args.extend(['-E', str(self.evalue)])
         args.extend(['-', self.db]) # '-' signals hmmer to expect input from stdin
-        try:
-            #e_file = open(self.get_tmp_output(),'wb')
-            # Re-write stdout and stderr to PIPEs to prevent cluttering terminal
-            # Tried to use open file descriptor as for hmmbuild but caused no output instead?
-            # Could try to use os.devnull instead if don't want output at all?
-            hmmer = subprocess.Popen(args, stdin=subprocess.PIPE,
-                    stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-            # send file as stdin
-            hmmer.stdin.write(self.query.sequence.encode('utf-8')) # sequence here is the entire parsed file
-            hmmer.communicate() # actually run the search
-        except(Exception):
-            pass # freak out
+        # Only the tabular output is wanted; stdout and stderr are discarded to
+        # prevent cluttering terminal
+        return executor.Job(args, name=hmmer_type,
+                stdin=self.query.sequence, # sequence here is the entire parsed file
+                cores=(self.cpu if self.cpu else 1))
+
+    def run_from_stdin(self, hmmer_type, valid_options=valid_options, sep='_'):
+        """Runs HMMer using obj as stdin"""
+        job = executor.get_executor().run(self.get_stdin_job(hmmer_type,
+            valid_options, sep)) # actually run the search
+        if not job.succeeded():
+            print("Could not run HMMer for {} in {}".format(
+                self.query.identity, self.db))
+        return job
+
+    def get_library_job(self, hmmer_type, library, valid_options=valid_options, sep='_'):
+        """
+        Returns an executor job that runs HMMer once for every model in a
+        multi-model HMM file; the tabular output then holds hits for all models,
+        distinguished by query_name
+        """
+        args = []
+        args.append(os.path.join(self.hmmer_path, hmmer_type))
+        args.append('--tblout')
+        args.append(self.out)
+        if self.kwargs:
+            for k,v in self.kwargs:
+                if str(k) in valid_options:
+                    if len(k) == 1:
+                        args.append('-' + str(k)) # only single hyphen for flag
+                    else:
+                        args.append('--' + str(k))
+                    args.append(str(v))
+        if self.cpu:
+            args.extend(['--cpu', str(self.cpu)])
+        args.extend(['-E', str(self.evalue)])
+        args.extend([library, self.db])
+        # Only the tabular output is wanted; discard the main output
+        return executor.Job(args, name=hmmer_type,
+                cores=(self.cpu if self.cpu else 1))
+
+    def run_from_library(self, hmmer_type, library, valid_options=valid_options, sep='_'):
+        """Runs HMMer for every model in library; see get_library_job()"""
+        job = executor.get_executor().run(self.get_library_job(hmmer_type,
+            library, valid_options, sep))
+        if not job.succeeded():
+            print("Could not run HMMer for {} in {}".format(library, self.db))
+        return job
 
     #def get_tmp_output(self, sep):
     #    """File for both stdout and stderr redirection"""
@@ -101,8 +167,17 @@ class ProtHMMer(HMMer):
     def run_from_file(self, valid_options=valid_options, sep='_'):
         HMMer.run_from_file(self, 'hmmsearch', valid_options, sep)
 
+    def get_stdin_job(self, valid_options=valid_options, sep='_'):
+        return HMMer.get_stdin_job(self, 'hmmsearch', valid_options, sep)
+
     def run_from_stdin(self, valid_options=valid_options, sep='_'):
-        HMMer.run_from_stdin(self, 'hmmsearch', valid_options, sep)
+        return HMMer.run_from_stdin(self, 'hmmsearch', valid_options, sep)
+
+    def get_library_job(self, library, valid_options=valid_options, sep='_'):
+        return HMMer.get_library_job(self, 'hmmsearch', library, valid_options, sep)
+
+    def run_from_library(self, library, valid_options=valid_options, sep='_'):
+        return HMMer.run_from_library(self, 'hmmsearch', library, valid_options, sep)
 
 class NuclHMMer(HMMer):
     """Subclass for searching nucelotide queries with HMMer"""
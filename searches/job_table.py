@@ -0,0 +1,202 @@
+"""
+This module contains code for keeping track of the jobs that make up a search or
+analysis, so that it can be resumed if Goat stops partway through. Each analysis
+has a JobTable in the 'jobs' node of the database, keyed by the name of its
+starting search, that records how it was started (mode and parameters) and the
+state, inputs and outputs of every job: individual searches, stages such as
+getting reverse queries or summarizing, and MAFFT/hmmbuild runs.
+
+Jobs are run through a JobTracker, which skips jobs already done (optionally
+checking that their outputs still exist), records each job as it starts, and
+commits as soon as a job finishes or fails, so that the table on disk always
+reflects the work that is actually done. Resuming an analysis simply runs it
+again with the same table: only pending, failed or interrupted jobs are run.
+"""
+
+import time
+
+from persistent import Persistent
+from BTrees.OOBTree import OOBTree
+
+from bin.initialize_goat import configs
+
+from databases.containers import OrderedTreeSet
+
+class JobRecord(Persistent):
+    """State of a single job; inputs and outputs hold plain values only"""
+    def __init__(self, job_id, kind, inputs=None):
+        self.job_id = job_id
+        self.kind = kind # e.g. search, stage, mafft, hmmbuild
+        self.inputs = dict(inputs) if inputs else {}
+        self.outputs = {}
+        self.state = 'pending' # running, done, failed
+        self.attempts = 0
+        self.error = None
+        self.start_time = None
+        self.end_time = None
+
+    def is_done(self):
+        return self.state == 'done'
+
+class JobTable(Persistent):
+    """All jobs of one analysis, in the order they were first added"""
+    def __init__(self, name, mode, params=None):
+        self.name = name # name of the starting search
+        self.mode = mode # ProgressFrame mode, e.g. 'full_blast_hmmer'
+        self.params = dict(params) if params else {}
+        self.job_list = OrderedTreeSet()
+        self.jobs = OOBTree()
+        self.created = time.time()
+        self.finished = False
+
+    def get_job(self, job_id, kind, inputs=None):
+        """Returns the record for job_id, adding a pending record if needed"""
+        try:
+            return self.jobs[job_id]
+        except(KeyError):
+            job = JobRecord(job_id, kind, inputs)
+            self.jobs[job_id] = job
+            self.job_list.add(job_id)
+            return job
+
+    def list_jobs(self, state=None):
+        """Yields job records in order, optionally only those in one state"""
+        for job_id in self.job_list:
+            job = self.jobs[job_id]
+            if state is None or job.state == state:
+                yield job
+
+    def count_jobs(self):
+        """Returns a dict of the number of jobs in each state"""
+        counts = {}
+        for job in self.list_jobs():
+            counts[job.state] = counts.get(job.state, 0) + 1
+        return counts
+
+class JobTracker:
+    """
+    Runs and records jobs in a JobTable; changes are committed on the
+    calling thread's connection as each job finishes or fails
+    """
+    def __init__(self, table):
+        self.table = table
+        self.goat_db = configs['goat_db']
+
+    def is_done(self, job_id, check=None):
+        """
+        True if job_id finished before; check, if given, is called with the
+        job's outputs and must return True for the outputs to still be valid
+        """
+        try:
+            job = self.table.jobs[job_id]
+        except(KeyError):
+            return False
+        if not job.is_done():
+            return False
+        if check is not None:
+            try:
+                return bool(check(job.outputs))
+            except(Exception):
+                return False
+        return True
+
+    def get_outputs(self, job_id):
+        """Returns the recorded outputs of a job"""
+        return dict(self.table.jobs[job_id].outputs)
+
+    def start(self, job_id, kind, inputs=None):
+        """Records that a job is running; not committed on its own"""
+        job = self.table.get_job(job_id, kind, inputs)
+        job.state = 'running'
+        job.attempts += 1
+        job.error = None
+        job.start_time = time.time()
+        job.end_time = None
+        return job
+
+    def finish(self, job_id, outputs=None, kind=None, commit=True):
+        """
+        Records that a job is done, with its outputs, and commits; raises a
+        ConflictError if the commit, and with it the job, was lost
+        """
+        job = self.table.get_job(job_id, kind)
+        job.state = 'done'
+        job.outputs = dict(outputs) if outputs else {}
+        job.end_time = time.time()
+        if commit:
+            self.commit()
+
+    def fail(self, job_id, error, kind=None, commit=True):
+        """
+        Records that a job failed; if commit, this is committed on its own,
+        and recorded again if the commit conflicts with another thread
+        """
+        def record():
+            job = self.table.get_job(job_id, kind)
+            if job.state != 'running': # start() was aborted
+                job.attempts += 1
+            job.state = 'failed'
+            job.error = str(error)
+            job.end_time = time.time()
+        if commit:
+            self.goat_db.transact(record)
+        else:
+            record()
+
+    def commit(self):
+        """
+        Commits recorded changes, e.g. after finishing several jobs; raises
+        a ConflictError if they were lost
+        """
+        self.goat_db._commit()
+
+    def run(self, job_id, kind, func, inputs=None, check=None):
+        """
+        Calls func unless the job is already done, and returns the job's
+        outputs; func should return a dict of outputs (or None). If func
+        raises, or its changes cannot be committed, its uncommitted changes
+        are discarded, the job is recorded as failed and the error is raised
+        again.
+        """
+        if self.is_done(job_id, check):
+            return self.get_outputs(job_id)
+        self.start(job_id, kind, inputs)
+        try:
+            outputs = func()
+            self.finish(job_id, outputs)
+        except(Exception) as e:
+            self.goat_db.abort()
+            self.fail(job_id, e, kind)
+            raise
+        return self.get_outputs(job_id)
+
+    def set_finished(self):
+        """Marks the whole analysis as finished and commits"""
+        self.table.finished = True
+        self.commit()
+
+def get_tracker(name, mode, params=None):
+    """
+    Returns a tracker for the analysis started from the search 'name'; an
+    unfinished table with the same mode is resumed, otherwise a new table
+    replaces any old one
+    """
+    jdb = configs['job_db']
+    try:
+        table = jdb[name]
+        if table.finished or table.mode != mode:
+            table = None
+    except(KeyError):
+        table = None
+    if table is None:
+        table = JobTable(name, mode, params)
+        jdb.add_entry(name, table)
+        jdb.commit() # kept even if the first job fails
+    return JobTracker(table)
+
+def list_unfinished():
+    """Returns all job tables that have not finished, oldest first"""
+    jdb = configs['job_db']
+    tables = [jdb[name] for name in jdb.list_entries()]
+    return sorted([table for table in tables if not table.finished],
+            key=lambda table: table.created)
@@ -1,28 +1,65 @@
 """
 This module contains code to run searches from search objects in Goat. Idea is
-that this code should not care about whether or not the search is threaded, and
-simply run each search in sequential order.
+that this code should not care about whether or not the search is threaded; it
+runs a bounded number of searches at once on the shared executor (see
+util.executor) and adds each result as it finishes. Results are stored, parsed
+and committed in batches by a write-behind writer (see results.result_writer).
+If given a job tracker (see searches.job_table), each query/database search is
+recorded as a job, and searches finished by an earlier, interrupted run of the
+same search are not run again.
+
+Searches can also be run as part of a pipeline (see util.pipeline): iter_run()
+and iter_parse() yield futures to wait on rather than blocking, and several
+runners can share one writer.
 """
 
 import os
+from concurrent.futures import wait, FIRST_COMPLETED, CancelledError
+from threading import Lock
 
-from tkinter import *
 from Bio.Blast import NCBIXML
 
 from bin.initialize_goat import configs
 
-from searches.blast import blast_setup
+from searches import search_cache
+from searches.blast import blast_setup, blast_parser
 from searches.hmmer import hmmer_setup, hmmer_parser
-from results import result_obj
+from results import result_obj, hit_table, result_writer
+from util import executor
 
 # Placeholder - should be through settings eventually
 blast_path = '/usr/local/ncbi/blast/bin'
 hmmer_path = '/Users/cklinger/src/hmmer-3.1b1-macosx-intel/src'
 tmp_dir = '/Users/cklinger/git/Goat/tmp'
+num_cores = os.cpu_count() or 1 # total core budget shared by all concurrent searches
+num_jobs = 4 # number of searches to run at once
+batch_searches = True # send all queries for one database to a single search
+batch_size = 100 # maximum number of queries in each batched search
+use_cache = True # reuse output of identical searches; see searches.search_cache
+blast_outfmt = 5 # 5 for XML; 6 or 7 for faster tabular output, see blast_parser
+
+def get_result_id(search_name, query, db, sep='-'):
+    """Returns a unique name for each result object"""
+    return sep.join([search_name, query, db])
+
+class SearchJob:
+    """A single query/database search that is still to be run"""
+    def __init__(self, qid, db, qobj, dbf, db_type, outpath, result_id,
+            cache_key=None):
+        self.qid = qid
+        self.db = db # record name
+        self.qobj = qobj
+        self.dbf = dbf # file searched within the record
+        self.db_type = db_type
+        self.outpath = outpath
+        self.result_id = result_id
+        self.cache_key = cache_key
 
 class SearchRunner:
     """Actually runs searches"""
-    def __init__(self, sobj, mode='new', other_widget=None):
+    def __init__(self, sobj, mode='new', other_widget=None, num_jobs=num_jobs,
+            num_cores=num_cores, batch=batch_searches, batch_size=batch_size,
+            use_cache=use_cache, outfmt=blast_outfmt, tracker=None, writer=None):
         # dbs are global
         self.qdb = configs['query_db']
         self.mqdb = configs['misc_queries']
@@ -34,6 +71,22 @@ class SearchRunner:
         self.sobj = sobj
         self.mode = mode
         self.other = other_widget # signal back to other widget
+        self.keep_output = sobj.keep_output # read from the writer thread
+        self._to_delete = {} # output not kept, in order; handed to self.other once stored
+        # split the core budget between concurrent jobs and each job's threads
+        self.num_jobs = max(1, min(int(num_jobs), int(num_cores)))
+        self.threads_per_job = max(1, int(num_cores) // self.num_jobs)
+        self.batch = batch
+        self.batch_size = max(1, int(batch_size))
+        self._batch_num = 0
+        self._batch_lock = Lock()
+        self._libraries = {} # multi-model HMM files, keyed by tuple of qids
+        self.cache = search_cache.SearchCache() if use_cache else None
+        self.outfmt = outfmt # BLAST only
+        self.writer = writer # stores results as they finish; see get_jobs()
+        self._own_writer = writer is None # a shared writer is closed by its owner
+        self._cache_outputs = {} # result id -> (cache key, outpath) to store
+        self.tracker = tracker # records each search as a job, if given
 
     def get_unique_outpath(self, query, db, sep='-'):
         """Returns an outpath for a given query and database"""
@@ -46,13 +99,41 @@ class SearchRunner:
             #print('using default location')
             return os.path.join(tmp_dir, out_string)
 
+    def get_batch_outpath(self, db, batch_num, sep='-', ext='batch.txt'):
+        """Returns an outpath for the combined output of a batched search"""
+        out_string = sep.join([self.sobj.name, db, str(batch_num), ext])
+        if self.sobj.output_location:
+            return os.path.join(self.sobj.output_location, out_string)
+        else:
+            return os.path.join(tmp_dir, out_string)
+
     def get_result_id(self, search_name, query, db, sep='-'):
         """Returns a unique name for each result object"""
-        return sep.join([search_name, query, db])
+        return get_result_id(search_name, query, db, sep)
+
+    def run(self, queries=None):
+        """
+        Runs the search using information in the search object and databases;
+        queries, if given, limits the run to some of the search's queries
+        """
+        self.run_jobs(self.get_jobs(queries))
+
+    def iter_run(self, queries=None):
+        """
+        Same as run(), for pipeline tasks; yields the futures of running
+        searches whenever it has to wait for one of them to finish
+        """
+        yield from self.iter_jobs(self.get_jobs(queries))
 
-    def run(self):
-        """Runs the search using information in the search object and databases"""
-        for qid in self.sobj.queries: # list of qids
+    def get_jobs(self, queries=None):
+        """Adds cached or previously finished results; returns jobs to run"""
+        if self.writer is None:
+            self.writer = result_writer.ResultWriter(handler=self.process_result)
+        self.writer.start()
+        jobs = [] # searches that actually need to be run
+        if queries is None:
+            queries = self.sobj.queries
+        for qid in queries: # list of qids
             # First half of code determines how to get qobj
             if self.mode == 'new': # new search from user input
                 qobj = self.qdb[qid] # fetch associated object from db
@@ -67,108 +148,401 @@ class SearchRunner:
             if qobj.target_db: # i.e. is not None
                 if not qobj.target_db in self.sobj.databases: # don't add duplicates
                     self.sobj.databases.append(qobj.target_db) # keep track of databases
-                self.call_run(self.sobj.name, qid, qobj, qobj.target_db)
+                    self.sobj._p_changed = 1 # list changed in place
+                self.call_run(jobs, self.sobj.name, qid, qobj, qobj.target_db)
             elif self.mode == 'racc':
                 target_db = qobj.record # search against self
-                self.call_run(self.sobj.name, qid, qobj, target_db, db_type=qobj.alphabet)
+                self.call_run(jobs, self.sobj.name, qid, qobj, target_db,
+                        db_type=qobj.alphabet)
             else: # run for all dbs
                 for db in self.sobj.databases:
-                    self.call_run(self.sobj.name, qid, qobj, db)
-            if self.other:
-                self.other.increment_search_count()
+                    self.call_run(jobs, self.sobj.name, qid, qobj, db)
+        return jobs
 
-    def call_run(self, sid, qid, qobj, db, db_type=None):
-        """Calls the run_one for each query/db pair"""
+    def call_run(self, jobs, sid, qid, qobj, db, db_type=None):
+        """Adds cached output for each query/db pair, or queues a job to run"""
         uniq_out = self.get_unique_outpath(qid, db)
         result_id = self.get_result_id(sid, qid, db)
-        if os.path.exists(uniq_out):
-            self.add_result(result_id, qid, qobj, db, uniq_out)
+        db_obj = self.rdb[db]
+        for v in db_obj.files.values():
+            if db_type: # specified by query, not search_obj
+                if v.filetype == db_type:
+                    dbf = v.filepath
+            elif v.filetype == self.sobj.db_type:
+                dbf = v.filepath # worry about more than one possible file?
+                db_type = self.sobj.db_type
+        job = SearchJob(qid, db, qobj, dbf, db_type, uniq_out, result_id)
+        if self.resume_job(job):
+            self.increment_search_count()
+            return
+        job.cache_key = self.get_cache_key(job)
+        if job.cache_key and self.cache.fetch(job.cache_key, uniq_out):
+            self.add_result(job)
+            self.increment_search_count()
         else: # actually run the search
-            db_obj = self.rdb[db]
-            for v in db_obj.files.values():
-                if db_type: # specified by query, not search_obj
-                    if v.filetype == db_type:
-                        dbf = v.filepath
-                elif v.filetype == self.sobj.db_type:
-                    dbf = v.filepath # worry about more than one possible file?
-                    db_type = self.sobj.db_type
-            self.run_one(qid, db, qobj, dbf, db_type, uniq_out, self.udb, result_id)
-
-    def run_one(self, qid, db, qobj, dbf, db_type, outpath, result_db, result_id):
-        """Runs each individual search"""
-        # query type can be specified on individual queries or globally on sobj
-        q_type = qobj.alphabet if qobj.alphabet else self.sobj.q_type
+            jobs.append(job)
+
+    def get_job_id(self, job):
+        """Returns the id of a search in the job table"""
+        return 'result:' + job.result_id
+
+    def resume_job(self, job):
+        """
+        Returns True if the search was finished by an earlier run; its result
+        is added again from the output if it was not stored before stopping
+        """
+        if not (self.tracker and self.tracker.is_done(self.get_job_id(job))):
+            return False
+        try:
+            if self.udb[job.result_id].parsed:
+                self.sobj.add_result(job.result_id) # no change if present
+                return True
+        except(KeyError):
+            pass
+        if os.path.exists(job.outpath):
+            self.add_result(job)
+            return True
+        return False # output is gone; run again
+
+    def start_jobs(self, group):
+        """Records that the searches in a group are running"""
+        if self.tracker:
+            for job in group:
+                self.tracker.start(self.get_job_id(job), 'search',
+                        {'query':job.qid, 'database':job.db})
+
+    def finish_jobs(self, group, succeeded):
+        """Records the searches in a group as done or failed; commits"""
+        if self.tracker:
+            for job in group:
+                job_id = self.get_job_id(job)
+                if succeeded:
+                    self.tracker.finish(job_id, {'result':job.result_id,
+                        'outpath':job.outpath}, kind='search', commit=False)
+                else:
+                    self.tracker.fail(job_id, 'search did not run',
+                            kind='search', commit=False)
+            self.tracker.commit() # once for the whole group
+
+    def get_cache_key(self, job):
+        """Returns the content-based key for a job, or None if not cacheable"""
+        if not self.cache:
+            return None
+        try:
+            return self.cache.get_key(job.qobj, job.dbf, self.sobj.algorithm,
+                    self.get_q_type(job.qobj), job.db_type, self.get_params())
+        except(OSError): # e.g. database file is missing
+            return None
+
+    def get_params(self):
+        """Returns all search parameters that change the output of a search"""
+        params = {}
         if self.sobj.algorithm == 'blast':
-            if q_type == 'protein' and db_type == 'protein':
-                blast_search = blast_setup.BLASTp(blast_path, qobj,
-                        dbf, outpath)
+            params['outfmt'] = blast_parser.get_outfmt(self.outfmt)
+            params['evalue'] = blast_setup.BLAST.evalue
+        elif self.sobj.algorithm == 'hmmer':
+            params['E'] = hmmer_setup.HMMer.evalue
+        try:
+            params.update(self.sobj.params)
+        except(AttributeError, TypeError):
+            pass # no additional params
+        return params
+
+    def get_q_type(self, qobj):
+        """Query type can be specified on individual queries or globally on sobj"""
+        return qobj.alphabet if qobj.alphabet else self.sobj.q_type
+
+    def run_jobs(self, jobs):
+        """
+        Keeps up to self.num_jobs searches running at once on the shared executor;
+        each search is an external process, so no thread is needed per search.
+        Results are added back on the calling thread as each search finishes.
+        """
+        for running in self.iter_jobs(jobs):
+            wait(running, return_when=FIRST_COMPLETED)
+
+    def iter_jobs(self, jobs):
+        """
+        Runs jobs as in run_jobs(), but yields the futures of running searches
+        instead of waiting; resumed once any of them is done
+        """
+        pool = executor.get_executor()
+        groups = iter(self.group_jobs(jobs))
+        running = {}
+        try:
+            while True:
+                while len(running) < self.num_jobs:
+                    group = next(groups, None)
+                    if group is None:
+                        break
+                    try:
+                        search_job,batch_out = self.get_search_job(group)
+                    except(Exception):
+                        self.finish_group(group, None, None)
+                        continue
+                    self.start_jobs(group)
+                    running[pool.submit(search_job)] = (group, batch_out)
+                if not running:
+                    break
+                yield list(running)
+                done = [future for future in running if future.done()]
+                for future in done:
+                    group,batch_out = running.pop(future)
+                    try:
+                        search_job = future.result()
+                    except(CancelledError):
+                        search_job = None
+                    self.finish_group(group, batch_out, search_job)
+        finally:
+            for future in running: # e.g. interrupted; stop outstanding searches
+                pool.cancel(future)
+            for library in self._libraries.values():
+                if os.path.exists(library):
+                    os.remove(library)
+            self._libraries = {}
+
+    def group_jobs(self, jobs):
+        """
+        Yields lists of jobs to run together. Jobs against the same database file
+        are grouped in their original order, up to self.batch_size queries at a
+        time for BLAST; HMMer searches all models for a database at once.
+        """
+        if not (self.batch and self.sobj.algorithm in ('blast','hmmer')):
+            for job in jobs:
+                yield [job]
+        else:
+            groups = {}
+            for job in jobs:
+                # all jobs with the same key are run as the same search
+                key = (job.db, job.dbf, job.db_type, self.get_q_type(job.qobj))
+                groups.setdefault(key, []).append(job)
+            for group in groups.values():
+                if self.sobj.algorithm == 'hmmer':
+                    yield group
+                else:
+                    for i in range(0, len(group), self.batch_size):
+                        yield group[i:i + self.batch_size]
+
+    def increment_search_count(self):
+        """Signals back to the other widget, if any, after each search"""
+        if self.other:
+            self.other.increment_search_count()
+
+    def get_search_job(self, group):
+        """
+        Returns an executor job for the group and the path of its combined output;
+        a single job writes to its own outpath and has no combined output, while
+        a batched group searches all queries at once against the group's database
+        """
+        first = group[0]
+        q_type = self.get_q_type(first.qobj)
+        if len(group) == 1:
+            query = first.qobj
+            outpath = first.outpath
+            batch_out = None
+        else:
+            query = [job.qobj for job in group]
+            outpath = batch_out = self.get_batch_outpath(first.db,
+                    self.get_batch_num())
+        if self.sobj.algorithm == 'blast':
+            if q_type == 'protein' and first.db_type == 'protein':
+                blast_search = blast_setup.BLASTp(blast_path, query,
+                        first.dbf, outpath, outfmt=self.outfmt,
+                        num_threads=self.threads_per_job)
             else:
                 pass # sort out eventually
-            blast_search.run_from_stdin()
+            blast_search.make_db()
+            return (blast_search.get_stdin_job(), batch_out)
         elif self.sobj.algorithm == 'hmmer':
-            if q_type == 'protein' and db_type == 'protein':
-                hmmer_search = hmmer_setup.ProtHMMer(hmmer_path, qobj,
-                        dbf, outpath)
+            if q_type == 'protein' and first.db_type == 'protein':
+                hmmer_search = hmmer_setup.ProtHMMer(hmmer_path, query,
+                        first.dbf, outpath, cpu=self.threads_per_job)
             else:
                 pass # sort out eventually
-            hmmer_search.run_from_stdin()
-        self.add_result(result_id, qid, qobj, db, outpath)
-        #robj = result_obj.Result(result_id, self.sobj.algorithm,
-        #        self.sobj.q_type, self.sobj.db_type, qid, db, self.sobj.name,
-        #        outpath)
-        # Add specified query/record info, if available
-        #try:
-        #    if qobj.spec_qid:
-        #        robj.spec_qid = qobj.spec_qid
-        #    if qobj.spec_record:
-        #        robj.spec_record = qobj.spec_record
-        #except(AttributeError):
-        #    pass # not applicable
-        # Add result object to search object and result database
-        #self.sobj.add_result(result_id) # function ensures persistent object updated
-        #self.udb[result_id] = robj # add to result db
-
-    def add_result(self, result_id, qid, qobj, db, outpath):
-        """Separates running search from adding info"""
-        robj = result_obj.Result(result_id, self.sobj.algorithm,
-                self.sobj.q_type, self.sobj.db_type, qid, db,
-                self.sobj.name, outpath)
+            if batch_out:
+                return (hmmer_search.get_library_job(self.get_hmm_library(query)),
+                        batch_out)
+            return (hmmer_search.get_stdin_job(), batch_out)
+
+    def finish_group(self, group, batch_out, search_job):
+        """
+        Splits the combined output of a batched search back into the output file
+        for each query/db pair, then caches and adds each result
+        """
+        if search_job is None or not search_job.succeeded():
+            print("Could not run search for {} in {}".format(
+                ', '.join(job.qid for job in group), group[0].db))
+        if batch_out:
+            try:
+                if os.path.exists(batch_out):
+                    if self.sobj.algorithm == 'blast':
+                        self.get_blast_parser(batch_out).split(
+                                [job.outpath for job in group],
+                                [blast_parser.get_batch_id(i) for i in range(len(group))])
+                    elif self.sobj.algorithm == 'hmmer':
+                        # tabular rows are assigned back to each query by HMM
+                        # name, set by its position in the library
+                        hmmer_parser.HMMsearchParser(batch_out).split(
+                                {hmmer_setup.get_model_name(i):job.outpath for
+                                    i,job in enumerate(group)})
+            except(Exception):
+                print("Could not split output for {}".format(batch_out))
+            finally:
+                if os.path.exists(batch_out):
+                    os.remove(batch_out)
+        succeeded = search_job is not None and search_job.succeeded()
+        for job in group:
+            self.add_result(job, cache_output=(job.cache_key and succeeded))
+            self.increment_search_count()
+        self.finish_jobs(group, succeeded)
+
+    def get_blast_parser(self, filepath):
+        """Returns a parser for BLAST output in the runner's format"""
+        if blast_parser.is_tabular(self.outfmt):
+            return blast_parser.TabularParser(filepath)
+        return blast_parser.XMLParser(filepath)
+
+    def get_hmm_library(self, qobjs):
+        """
+        Returns a multi-model HMM file for the given queries, in the same
+        order; written only once for each set of queries, since usually all
+        databases share the same set
+        """
+        key = tuple(qobj.identity for qobj in qobjs)
+        with self._batch_lock:
+            if not key in self._libraries:
+                library = self.get_batch_outpath('library',
+                        len(self._libraries) + 1, ext='queries.hmm')
+                hmmer_setup.write_hmm_library(qobjs, library)
+                self._libraries[key] = library
+            return self._libraries[key]
+
+    def get_batch_num(self):
+        """Returns a new number for each batch; keeps batch outpaths unique"""
+        with self._batch_lock:
+            self._batch_num += 1
+            return self._batch_num
+
+    def add_result(self, job, cache_output=False):
+        """
+        Separates running search from adding info; the result object is handed
+        to the writer, which also stores the output in the cache if required
+        """
+        robj = result_obj.Result(job.result_id, self.sobj.algorithm,
+                self.sobj.q_type, self.sobj.db_type, job.qid, job.db,
+                self.sobj.name, job.outpath, cache_key=job.cache_key)
         # Add specified query/record info, if available
         try:
-            if qobj.spec_qid:
-                robj.spec_qid = qobj.spec_qid
-            if qobj.spec_record:
-                robj.spec_record = qobj.spec_record
+            if job.qobj.spec_qid:
+                robj.spec_qid = job.qobj.spec_qid
+            if job.qobj.spec_record:
+                robj.spec_record = job.qobj.spec_record
         except(AttributeError):
             pass # not applicable
         # Add result object to search object and result database
-        self.sobj.add_result(result_id) # function ensures persistent object updated
-        self.udb[result_id] = robj # add to result db
+        self.sobj.add_result(job.result_id) # function ensures persistent object updated
+        if cache_output:
+            self._cache_outputs[job.result_id] = (job.cache_key, job.outpath)
+        if self.writer:
+            # stored and parsed in the writer thread
+            self.writer.put(robj, self.process_result)
+        else:
+            self.store_output(robj)
+            self.udb[job.result_id] = robj # add to result db; parsed by parse()
+
+    def store_output(self, robj):
+        """
+        Stores the output of a new result in the cache, if required; cache
+        hits are applied here too, as the cache is only changed by the
+        thread storing results
+        """
+        if self.cache:
+            self.cache.apply_pending()
+        cache_output = self._cache_outputs.get(robj.name) # may be stored again
+        if cache_output:
+            self.cache.store(*cache_output)
+
+    def process_result(self, robj):
+        """Called by the writer for each result before it is stored"""
+        self.store_output(robj)
+        self.parse_one(robj)
 
     def parse(self):
-        """Parses output files from search"""
-        for result in self.sobj.results:
-            robj = self.udb[result]
-            self.parse_one(robj)
+        """
+        Waits until the writer has parsed and committed every result, then
+        commits the search itself; the calling thread then sees all results
+        """
+        for future in self.iter_parse():
+            future.result()
+
+    def iter_parse(self):
+        """
+        Same as parse(), for pipeline tasks; yields while results are written.
+        Raises an error if the writer could not store them.
+        """
+        if self.writer:
+            future = self.writer.flush() # a shared writer may also hold other results
+            yield future
+            try:
+                future.result()
+            finally:
+                self._cache_outputs = {} # all stored; kept until now for retries
+                if self._own_writer:
+                    self.writer.close() # nothing left to write
+                    self.writer = None
+        else: # results were added without a writer
+            for result in self.sobj.results:
+                robj = self.udb[result]
+                self.parse_one(robj)
+        self.delete_outputs()
+        configs['goat_db'].sync()
+
+    def delete_outputs(self):
+        """
+        Passes output files that are not kept to the other widget, if any, on
+        the calling thread; only called once their results are stored
+        """
+        to_delete, self._to_delete = self._to_delete, {}
+        if self.other:
+            for filepath in to_delete:
+                self.other.add_file_to_delete(filepath)
 
     def parse_one(self, robj):
         """Parse an individual result object result"""
-        # Parse result first
-        if robj.algorithm == 'blast':
+        cache_key = getattr(robj, 'cache_key', None) # older results have none
+        cached_result = None
+        if cache_key and self.cache:
+            cached_result = self.cache.get_parsed_result(cache_key)
+        # Parse result first; only a compact table of hits is stored, see
+        # results.hit_table, rather than the full parsed record
+        if cached_result is not None: # same search was parsed before
+            if not isinstance(cached_result, hit_table.HitTable): # older result
+                cached_result = hit_table.from_descriptions(
+                        cached_result.descriptions)
+            robj.parsed_result = cached_result
+        elif robj.algorithm == 'blast':
             #print("adding result object for BLAST")
             try:
-                blast_result = NCBIXML.read(open(robj.outpath))
-                robj.parsed_result = blast_result
+                if blast_parser.is_tabular(self.outfmt):
+                    blast_result = blast_parser.TabularParser(robj.outpath).parse()
+                else:
+                    with open(robj.outpath) as f:
+                        blast_result = NCBIXML.read(f)
+                robj.parsed_result = hit_table.from_descriptions(
+                        blast_result.descriptions)
             except:
                 print("Could not parse file {}".format(robj.outpath))
         elif robj.algorithm == 'hmmer':
             # need to sort out prot/nuc later
             hmmer_result = hmmer_parser.HMMsearchParser(robj.outpath).parse()
-            robj.parsed_result = hmmer_result
+            robj.parsed_result = hit_table.from_descriptions(
+                    hmmer_result.descriptions)
         # Set parsed flag and check for object removal
         robj.parsed = True
-        if not self.sobj.keep_output: #and robj.parsed:
+        if cache_key and self.cache and cached_result is None:
+            self.cache.set_parsed_result(cache_key, robj.name)
+        if not self.keep_output: #and robj.parsed:
             #print("removing output")
-            self.other.add_file_to_delete(robj.outpath)
+            self._to_delete[robj.outpath] = None # see delete_outputs()
             #os.remove(robj.outpath)
 
@@ -0,0 +1,210 @@
+"""
+This module contains code for caching search output in Goat. Searches are keyed
+on their content rather than their names: a hash of the query sequence (or HMM),
+a fingerprint of the target database file, the algorithm, and the parameters
+that affect the output. Identical searches can then reuse stored output (and the
+parsed result, if one exists) across differently named searches and analyses,
+while a changed database file or query never matches an old entry.
+
+Cached output files are copied to a cache directory, and entries in the
+'search_cache' node of the database point to them; once the total size of the
+cache exceeds its limit, the least recently used entries are evicted.
+"""
+
+import os, time, shutil, hashlib
+from threading import Lock, RLock
+
+from persistent import Persistent
+
+from bin.initialize_goat import configs
+
+# Placeholders - should be through settings eventually
+cache_dir = '/Users/cklinger/git/Goat/cache'
+max_cache_size = 2 * 1024 ** 3 # bytes of cached output to keep before evicting
+
+# Database file fingerprints, keyed by (path, size, mtime) so that each file is
+# only hashed again after it changes
+_fingerprints = {}
+_fingerprint_lock = Lock()
+
+def fingerprint_file(filepath, chunk_size=1024*1024):
+    """Returns a hash of the contents of a file"""
+    stat = os.stat(filepath)
+    fkey = (os.path.realpath(filepath), stat.st_size, stat.st_mtime_ns)
+    with _fingerprint_lock:
+        if fkey in _fingerprints:
+            return _fingerprints[fkey]
+    sha = hashlib.sha1()
+    with open(filepath,'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    with _fingerprint_lock:
+        _fingerprints[fkey] = sha.hexdigest()
+    return _fingerprints[fkey]
+
+def hash_query(qobj):
+    """Returns a hash of a query's sequence; for HMMs the sequence is the HMM"""
+    return hashlib.sha1(str(qobj.sequence).encode('utf-8')).hexdigest()
+
+class CacheEntry(Persistent):
+    """
+    Points to a cached output file; result_id is set once the output is parsed
+    and names a result whose parsed output can be reused
+    """
+    def __init__(self, key, filepath, size, result_id=None):
+        self.key = key
+        self.filepath = filepath # copy of the output in the cache directory
+        self.size = size
+        self.result_id = result_id
+        self.last_used = time.time()
+
+    def touch(self):
+        """Marks the entry as recently used"""
+        self.last_used = time.time()
+
+class SearchCache:
+    """
+    Interface to the cache node of the database and the cache directory.
+    Hits are looked up from the thread running the searches, while entries
+    are stored and evicted by the thread writing results; so that the two do
+    not change the same entries at once, fetch() makes no changes to the
+    database itself and the writer applies its touches with apply_pending().
+    """
+    def __init__(self, cache_dir=cache_dir, max_size=max_cache_size):
+        self.cdb = configs['search_cache']
+        self.udb = configs['result_db']
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._lock = RLock() # guards the sizes and pending changes below
+        self._sizes = None # key -> size; computed on first use, then kept up to date
+        self._total_size = 0
+        self._touched = {} # key -> time of hits not yet applied
+        self._missing = set() # keys whose output was removed outside of Goat
+
+    def get_key(self, qobj, dbf, algorithm, q_type, db_type, params):
+        """Returns the content-based key for a single query/database search"""
+        parts = [algorithm, str(q_type), str(db_type), hash_query(qobj),
+                fingerprint_file(dbf)]
+        for k,v in sorted(params.items()):
+            parts.append(str(k) + '=' + str(v))
+        return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def get_entry(self, key, remove=True):
+        """
+        Returns the entry for key if its output is still cached, else None;
+        an entry whose output is gone is removed, or left for the writer
+        thread to remove if not remove
+        """
+        try:
+            entry = self.cdb[key]
+        except(KeyError):
+            return None
+        if not os.path.exists(entry.filepath): # removed outside of Goat
+            if remove:
+                self.remove(key)
+            else:
+                with self._lock:
+                    self._missing.add(key)
+            return None
+        return entry
+
+    def fetch(self, key, outpath):
+        """
+        Copies cached output for key to outpath; returns True on a hit. Does
+        not change the database; the hit is applied by apply_pending().
+        """
+        entry = self.get_entry(key, remove=False)
+        if entry is None:
+            return False
+        if os.path.realpath(entry.filepath) != os.path.realpath(outpath):
+            shutil.copyfile(entry.filepath, outpath)
+        with self._lock:
+            self._touched[key] = time.time()
+        return True
+
+    def apply_pending(self):
+        """
+        Marks entries fetched since the last call as recently used, and
+        removes entries whose output is gone; call from the writing thread
+        """
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            missing, self._missing = self._missing, set()
+        for key,last_used in touched.items():
+            try:
+                entry = self.cdb[key]
+            except(KeyError):
+                continue # evicted since
+            if entry.last_used < last_used:
+                entry.last_used = last_used
+        for key in missing:
+            self.get_entry(key) # removed if still missing
+
+    def remove(self, key):
+        """Removes the entry for key from the database"""
+        self.cdb.remove_entry(key)
+        with self._lock:
+            if self._sizes is not None:
+                self._total_size -= self._sizes.pop(key, 0)
+
+    def store(self, key, outpath):
+        """
+        Adds a copy of outpath to the cache under key; storing the same key
+        again, e.g. after the first commit was lost, replaces the entry
+        """
+        if not os.path.exists(outpath):
+            return # search did not produce any output
+        self.apply_pending() # recent hits are not evicted below
+        os.makedirs(self.cache_dir, exist_ok=True)
+        filepath = os.path.join(self.cache_dir, key + '.out')
+        shutil.copyfile(outpath, filepath)
+        entry = CacheEntry(key, filepath, os.path.getsize(filepath))
+        self.cdb[key] = entry
+        with self._lock:
+            self.get_total_size()
+            self._total_size += entry.size - self._sizes.get(key, 0)
+            self._sizes[key] = entry.size
+        self.evict()
+
+    def get_parsed_result(self, key):
+        """Returns a previously parsed result for key, or None"""
+        entry = self.get_entry(key)
+        if entry is None or entry.result_id is None:
+            return None
+        try:
+            robj = self.udb[entry.result_id]
+        except(KeyError): # result was removed since
+            entry.result_id = None
+            return None
+        if robj.parsed:
+            return robj.parsed_result
+        return None
+
+    def set_parsed_result(self, key, result_id):
+        """Records which result holds the parsed output for key"""
+        entry = self.get_entry(key)
+        if entry is not None:
+            entry.result_id = result_id
+
+    def get_total_size(self):
+        """Returns the size of all cached output"""
+        with self._lock:
+            if self._sizes is None:
+                self._sizes = {key:self.cdb[key].size for key in
+                        self.cdb.list_entries()}
+                self._total_size = sum(self._sizes.values())
+            return self._total_size
+
+    def evict(self):
+        """Removes least recently used entries until under the size limit"""
+        if self.get_total_size() <= self.max_size:
+            return
+        entries = [self.cdb[key] for key in self.cdb.list_entries()]
+        for entry in sorted(entries, key=lambda x: x.last_used):
+            if self.get_total_size() <= self.max_size:
+                break
+            try:
+                os.remove(entry.filepath)
+            except(OSError):
+                pass # already gone
+            self.remove(entry.key)
@@ -5,8 +5,14 @@ node in the main ZODB database, rather than separate files.
 
 from persistent import Persistent
 
+from databases.containers import OrderedTreeSet
+
 class Search(Persistent):
     """Generic Search class"""
+    # Forward (evalue, max hits) used to make reverse queries from the results,
+    # see results.intermediate; None, or None values, if every hit was used
+    rev_query_cutoffs = None
+
     def __init__(self, name, algorithm, q_type, db_type, queries, databases,
             keep_output=False, output_location=None, rev_record=None, **params):
         self.name = name
@@ -19,13 +25,12 @@ class Search(Persistent):
         self.output_location = output_location # None if no location is specified
         self.params = params # possibly empty dictionary of additional program params
         self.rev_record = rev_record # for reverse searches using fwd HMM/MSA
-        self.results = [] # pointer to eventual results
+        self.results = OrderedTreeSet() # pointer to eventual results
 
     def list_results(self):
         """Convenience function"""
         return list(self.results)
 
     def add_result(self, rid):
-        """Adds rid to internal list; ensures object is marked for update"""
-        self.results.append(rid)
-        self._p_changed = 1
+        """Adds rid to internal set of results"""
+        self.results.add(rid)
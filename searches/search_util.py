@@ -167,6 +167,17 @@ def remove_blast_header(instring):
     """
     return re.sub(r'gnl\|BL_ORD_ID\|\d+ ','', instring)
 
+def add_self_blast(qobj, blast_result):
+    """Adds the hits of a search against the query's own record as raccs"""
+    lines = []
+    seen = set()
+    for hit in blast_result.descriptions:
+        new_title = remove_blast_header(hit.title)
+        if not new_title in seen:
+            lines.append([new_title, hit.e])
+            seen.add(new_title)
+    qobj.add_all_accs(lines)
+
 def get_cutoff_values(summary_type):
     """
     Prompts user for evalue cutoff criteria for summarizing searches. Varies depending
@@ -0,0 +1,220 @@
+"""
+This module contains code to classify search hits for summaries using NumPy.
+Rather than stepping through hits one at a time, the E-values of one or more
+results are put into flat arrays and the rules used by summarizer.SearchSummarizer
+are applied to all hits at once:
+
+    classify_forward() - which forward hits are positive in a one-search summary
+        (see SearchSummarizer.add_forward_hits)
+
+    classify_reverse() - the status of a forward hit from its reverse search,
+        together with the first positive and first negative reverse hits and
+        the E-value difference between them (see reverse_hit_status)
+
+Both have batch versions taking many results at once, so that re-classifying
+hits with new cutoffs is a handful of array operations however many results
+there are. Results are meant to be identical to the one-hit-at-a-time rules,
+including their quirks, which are noted below; where a difference in E-values
+is compared to a cutoff, values very close to the cutoff are recomputed with
+math.log so that rounding cannot change the outcome.
+"""
+
+import math
+
+import numpy as np
+
+zero_evalue = 1e-179 # value used for reverse hits reported with an E-value of 0
+tie_tolerance = 1e-9 # differences this close to a cutoff are recomputed exactly
+
+class ReverseStatus:
+    """
+    Outcome of classifying one reverse result; positive and negative are the
+    indices of the first positive and first negative hits (or None), and
+    scanned is the number of hits the sequential rules would have looked at
+    """
+    __slots__ = ['status', 'positive', 'negative', 'e_diff', 'scanned']
+
+    def __init__(self, status, positive=None, negative=None, e_diff=None,
+            scanned=0):
+        self.status = status
+        self.positive = positive
+        self.negative = negative
+        self.e_diff = e_diff
+        self.scanned = scanned
+
+def log_diff(e1, e2):
+    """Magnitude difference between two E-values, computed as in the summarizer"""
+    return math.fabs(math.log(e1,10) - math.log(e2,10))
+
+def _flatten(columns):
+    """
+    Returns flat E-values, the local index of each value within its result,
+    the start of each result and the length of each result
+    """
+    lengths = np.array([len(column) for column in columns], dtype=np.int64)
+    starts = np.zeros(len(columns), dtype=np.int64)
+    if len(columns) > 1:
+        starts[1:] = np.cumsum(lengths)[:-1]
+    if lengths.sum():
+        evalues = np.concatenate([np.asarray(column, dtype=np.float64)
+            for column in columns])
+    else:
+        evalues = np.zeros(0, dtype=np.float64)
+    local = np.arange(len(evalues), dtype=np.int64) - np.repeat(starts, lengths)
+    return (evalues, local, starts, lengths)
+
+def _first(mask, local, starts, lengths):
+    """
+    Returns, for each result, the local index of the first True value in mask,
+    or the length of the result if there is none
+    """
+    first = lengths.copy()
+    nonempty = lengths > 0
+    if nonempty.any():
+        candidates = np.where(mask, local, np.repeat(lengths, lengths))
+        first[nonempty] = np.minimum.reduceat(candidates, starts[nonempty])
+    return first
+
+def select_forward(evalues, fwd_evalue, fwd_max_hits=None):
+    """
+    Returns the indices of the forward hits whose reverse results are looked
+    at in a two-search summary: hits before fwd_max_hits and below fwd_evalue,
+    up to the first hit above fwd_evalue
+    """
+    if not fwd_max_hits:
+        fwd_max_hits = len(evalues)
+    indices = []
+    for fwd_hit_index,e in enumerate(evalues):
+        if (fwd_hit_index == fwd_max_hits) or (e > fwd_evalue):
+            break # don't need to look further
+        elif (fwd_evalue is None) or (e < fwd_evalue):
+            indices.append(fwd_hit_index)
+    return indices
+
+def classify_forward(evalues, fwd_evalue, fwd_max_hits=None, next_evalue=None):
+    """Returns a boolean array marking the positive hits of a single result"""
+    return classify_forward_batch([evalues], fwd_evalue, fwd_max_hits,
+            next_evalue)[0]
+
+def classify_forward_batch(columns, fwd_evalue, fwd_max_hits=None,
+        next_evalue=None):
+    """
+    Returns a boolean array of positive hits for each E-value column. As in
+    add_forward_hits, hits are taken in order until one is above fwd_evalue.
+    If next_evalue is given, hits stay positive only while their magnitude
+    difference from the second hit is above it. Note that the sequential
+    rules never advance their hit counter, so every hit is compared to the
+    second hit, and fwd_max_hits only has an effect when it is 0; a log of an
+    E-value of 0 raises ValueError there, and does so here as well.
+    """
+    evalues,local,starts,lengths = _flatten(columns)
+    if fwd_max_hits == 0: # counter is always 0, so only 0 stops the scan
+        stop = np.zeros(len(columns), dtype=np.int64)
+    else:
+        stop = _first(evalues > fwd_evalue, local, starts, lengths)
+    end = stop # hits from end onward are not positive
+    if next_evalue is not None:
+        has_next = lengths > 1
+        second = np.where(has_next, starts + 1, 0)
+        next_e = evalues[second] if len(evalues) else np.zeros(len(columns))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            diff = np.abs(np.log10(evalues) -
+                    np.repeat(np.log10(next_e), lengths))
+        passed = diff > next_evalue
+        near = np.abs(diff - next_evalue) <= tie_tolerance * max(1.0,
+                abs(next_evalue))
+        for i in np.nonzero(near & (evalues > 0))[0]:
+            result = np.searchsorted(starts, i, side='right') - 1
+            if next_e[result] > 0:
+                passed[i] = log_diff(evalues[i], next_e[result]) > next_evalue
+        failed = _first(~passed, local, starts, lengths)
+        # a single hit has no next hit, so is positive if scanned at all
+        failed = np.where(has_next, failed, lengths)
+        # a zero E-value (in the hit or the second hit) raises in math.log
+        zero = _first(evalues == 0, local, starts, lengths)
+        scanned = np.minimum(stop, failed + 1)
+        if np.any(has_next & (stop > 0) & ((next_e == 0) | (zero < scanned))):
+            raise ValueError("math domain error")
+        end = np.minimum(stop, failed)
+    positive = local < np.repeat(end, lengths)
+    return np.split(positive, starts[1:]) if len(columns) else []
+
+def classify_reverse(evalues, matches, rev_evalue, rev_max_hits=None,
+        next_evalue=None):
+    """Returns a ReverseStatus for the hits of a single reverse result"""
+    return classify_reverse_batch([evalues], [matches], rev_evalue,
+            rev_max_hits, next_evalue)[0]
+
+def classify_reverse_batch(columns, match_masks, rev_evalue, rev_max_hits=None,
+        next_evalue=None):
+    """
+    Returns a ReverseStatus for each reverse result, from its E-value column
+    and a mask of which of its hits match the original query. Follows
+    reverse_hit_status exactly: hits are scanned until rev_max_hits or the
+    first hit above rev_evalue; hits equal to rev_evalue are skipped; zero
+    E-values count as zero_evalue. The first hit can only become the first
+    positive hit if it matches and is not the only hit, and a scan that runs
+    off the end of the hits without deciding leaves the status negative.
+    """
+    evalues,local,starts,lengths = _flatten(columns)
+    if len(evalues):
+        matches = np.concatenate([np.asarray(mask, dtype=bool)
+            for mask in match_masks])
+    else:
+        matches = np.zeros(0, dtype=bool)
+    evalues = np.where(evalues == 0, zero_evalue, evalues)
+    rep = lambda values: np.repeat(values, lengths)
+    stop = _first(evalues > rev_evalue, local, starts, lengths)
+    if rev_max_hits:
+        stop = np.minimum(stop, rev_max_hits)
+    considered = (local < rep(stop)) & (evalues < rev_evalue)
+    # first considered hit that does not match, and first match after it
+    first_neg = _first(considered & ~matches, local, starts, lengths)
+    after_neg = _first(considered & matches & (local > rep(first_neg)), local,
+            starts, lengths)
+    nonempty = lengths > 0
+    first_hit = np.where(nonempty, starts, 0)
+    last_hit = np.where(nonempty, starts + lengths - 1, 0)
+    if len(evalues):
+        has_fp = (nonempty & (lengths > 1) & considered[first_hit] &
+                matches[first_hit])
+        last_match = nonempty & considered[last_hit] & matches[last_hit]
+    else:
+        has_fp = last_match = np.zeros(len(columns), dtype=bool)
+    statuses = []
+    for i in range(len(columns)):
+        length = int(lengths[i])
+        start = int(starts[i])
+        a = int(first_neg[i])
+        if last_match[i] and (length - 1) < a: # only matches before the last hit
+            statuses.append(ReverseStatus('positive',
+                (0 if has_fp[i] else None), None, None, length))
+        elif has_fp[i]:
+            if a < length: # first non-matching hit decides
+                e_diff = log_diff(evalues[start], evalues[start + a])
+                if (next_evalue is None) or e_diff > next_evalue:
+                    status = 'positive'
+                else:
+                    status = 'tentative'
+                statuses.append(ReverseStatus(status, 0, a, e_diff, a + 1))
+            elif stop[i] < length: # cutoff reached with only matches
+                statuses.append(ReverseStatus('positive', 0, None, None,
+                    int(stop[i])))
+            else:
+                statuses.append(ReverseStatus('negative', 0, None, None, length))
+        elif a < length:
+            b = int(after_neg[i])
+            if b < length: # first match after a non-matching hit decides
+                e_diff = log_diff(evalues[start + a], evalues[start + b])
+                if (next_evalue is None) or e_diff < next_evalue:
+                    statuses.append(ReverseStatus('unlikely', b, a, e_diff, b + 1))
+                else:
+                    statuses.append(ReverseStatus('negative', None, a, e_diff,
+                        b + 1))
+            else:
+                statuses.append(ReverseStatus('negative', None, a, None,
+                    int(stop[i])))
+        else:
+            statuses.append(ReverseStatus('negative', None, None, None,
+                int(stop[i])))
+    return statuses
@@ -6,13 +6,15 @@ in order to allow users to see how results for the same query/db pair can change
 depending on which search modes/cutoff criteria are used.
 """
 
-import math
-
 from bin.initialize_goat import configs
 
-from summaries import summary_obj
+from summaries import summary_obj, summary_table, summary_pool, hit_classifier
 from searches import search_util
 
+# Placeholder - should be through settings eventually
+use_summary_tables = True # derive two-search summaries from stored tables; see summaries.summary_table
+parallel_summaries = True # classify table entries in worker processes; see summaries.summary_pool
+
 class SearchSummarizer:
     def __init__(self, summary): #, fwd_search,
             #rev_search=None, fwd_max_hits=None, rev_max_hits=None,
@@ -30,6 +32,7 @@ class SearchSummarizer:
         self.fwd_evalue = summary.fwd_evalue #fwd_evalue_cutoff
         self.rev_evalue = summary.rev_evalue #rev_evalue_cutoff
         self.next_evalue = summary.next_evalue #next_hit_evalue_cutoff
+        self._racc_ids = {} # query identity -> IDs of raccs; see get_racc_ids
 
     def summarize_one_result(self):
         """Summarizes one (forward) search based on basic evalue criteria"""
@@ -58,25 +61,11 @@ class SearchSummarizer:
         query_sum.add_db_summary(db, result_sum)
 
     def add_forward_hits(self, fwd_hit_list, result_sum):
-        """Returns hits for forward search"""
-        hit_index = 0
-        for desc in fwd_hit_list: # BLAST only, change eventually!
-            hit_status = 'negative'
-            if (hit_index == self.fwd_max_hits) or (desc.e > self.fwd_evalue):
-                break # either condition signals end of looking for hits
-            if self.next_evalue is None: # any hits automatically true
-                hit_status = 'positive'
-            else: # we do care about the next hit evalue
-                try:
-                    next_e = math.log(fwd_hit_list[(hit_index + 1)].e, 10)
-                    # magnitude difference is greater than specified
-                    if math.fabs(math.log(desc.e,10) - next_e) > self.next_evalue:
-                        hit_status = 'positive'
-                    else: # still negative!
-                        break # stop at first negative hit
-                except(IndexError): # no more hits to look at
-                    hit_status = 'positive' # there's nothing after it, so must be positive
-            if hit_status == 'positive':
+        """Returns hits for forward search; see hit_classifier.classify_forward"""
+        positive = hit_classifier.classify_forward([desc.e for desc in fwd_hit_list],
+                self.fwd_evalue, self.fwd_max_hits, self.next_evalue)
+        for desc,is_positive in zip(fwd_hit_list, positive): # BLAST only, change eventually!
+            if is_positive:
                 fwd_id = search_util.remove_blast_header(desc.title)
                 hit = summary_obj.Hit(fwd_id, desc.e)
                 result_sum.add_hit(fwd_id, hit)
@@ -86,6 +75,46 @@ class SearchSummarizer:
     def summarize_two_results(self):
         """Summarize a forward and reverse search together to determine hits
         based on multiple evalue criteria."""
+        self.check_reverse_cutoffs()
+        if use_summary_tables:
+            self.summarize_from_table(self.get_pair_table())
+        else:
+            self.summarize_two_searches()
+
+    def summarize_queries(self, queries):
+        """
+        Summarizes the forward results of only some queries, e.g. as soon as
+        their reverse searches are done; the table used is not stored, since
+        it does not cover the whole search pair
+        """
+        self.check_reverse_cutoffs()
+        fwd_sobj = self.sdb[self.fwd_search]
+        rev_sobj = self.sdb[self.rev_search]
+        self.summarize_from_table(self.build_pair_table(fwd_sobj, rev_sobj,
+            None, queries))
+
+    def check_reverse_cutoffs(self):
+        """
+        Raises a ValueError if the forward cutoffs of the summary are looser
+        than those used to make the reverse queries of the forward search;
+        hits past those cutoffs were never searched in reverse
+        """
+        cutoffs = self.sdb[self.fwd_search].rev_query_cutoffs
+        if not cutoffs:
+            return
+        evalue,max_hits = cutoffs
+        looser = []
+        if evalue is not None and (self.fwd_evalue is None or
+                self.fwd_evalue > evalue):
+            looser.append('forward evalue {}'.format(evalue))
+        if max_hits and (not self.fwd_max_hits or self.fwd_max_hits > max_hits):
+            looser.append('max forward hits {}'.format(max_hits))
+        if looser:
+            raise ValueError("Reverse searches of {} only cover {}".format(
+                self.fwd_search, ' and '.join(looser)))
+
+    def summarize_two_searches(self):
+        """Summarizes two searches directly from their parsed results"""
         #print('SEARCH: ' + self.fwd_search)
         fwd_sobj = self.sdb[self.fwd_search]
         #qsobj = self.qdb.fetch_search(self.fwd_search) # Query search object for intermediate results
@@ -119,6 +148,13 @@ class SearchSummarizer:
             if len(fwd_uobj.int_queries) == 0: # in case of no fwd hits!
                 result_sum = summary_obj.ResultSummary(fwd_db)
                 query_sum.add_db_summary(fwd_db, result_sum)
+            # built once per forward result; reverse results are matched to
+            # forward hits by lookup rather than by scanning every hit
+            int_queries = set(fwd_uobj.int_queries)
+            fwd_hit_map = None
+            if self.check_parsed_output(fwd_uobj):
+                fwd_hit_map = self.get_forward_hit_map(
+                        fwd_uobj.parsed_result.descriptions)
             for acc in fwd_uobj.int_queries:
                 print("forward acc is " + str(acc))
                 for rev_db in rev_sobj.databases:
@@ -130,19 +166,19 @@ class SearchSummarizer:
                     #print(rev_qobj.original_query)
                     # confirms rev search object stems from original query
                     # second line covers profile-based queries
-                    if rev_uid.split('-',1)[1].rsplit('-',1)[0] in fwd_uobj.int_queries:
+                    if rev_uid.split('-',1)[1].rsplit('-',1)[0] in int_queries:
                         #((fwd_qobj.identity == rev_qobj.original_query) or\
                         #(fwd_uobj.spec_qid == rev_qobj.original_query)) and \
                         #(rev_uid.split('-')[1] in fwd_uobj.int_queries):
                         print('reverse result originates from original query')
                         self.add_reverse_result_summary(fwd_qobj, fwd_uobj, rev_uobj,
-                                fwd_db, query_sum, spec_qid)
+                                fwd_db, query_sum, spec_qid, fwd_hit_map)
                         #print()
             print()
             self.summary.add_query_summary(fwd_qid, query_sum)
 
     def add_reverse_result_summary(self, fwd_qobj, fwd_uobj, rev_uobj, fwd_db,
-            query_sum, spec_qid):
+            query_sum, spec_qid, fwd_hit_map=None):
         """Returns hits for reverse search"""
         if query_sum.check_db_summary(fwd_db):
             result_sum = query_sum.fetch_db_summary(fwd_db)
@@ -151,155 +187,247 @@ class SearchSummarizer:
         if not (self.check_parsed_output(fwd_uobj)) or (self.check_parsed_output(rev_uobj)):
             pass # freak out
         fwd_hits = fwd_uobj.parsed_result.descriptions
-        self.add_reverse_hits(fwd_qobj, fwd_hits, rev_uobj, result_sum, spec_qid)
+        self.add_reverse_hits(fwd_qobj, fwd_hits, rev_uobj, result_sum, spec_qid,
+                fwd_hit_map)
         if not result_sum.determined():
             print(result_sum.db)
             print(result_sum.positive_hit_list)
-            if len(result_sum.positive_hit_list) > 0:
-                result_sum.determined('positive')
-            elif len(result_sum.tentative_hit_list) > 0:
-                result_sum.determined('tentative')
-            elif len(result_sum.unlikely_hit_list) > 0:
-                result_sum.determined('unlikely')
+            self.determine_result_status(result_sum)
         query_sum.add_db_summary(fwd_db, result_sum)
 
-    def add_reverse_hits(self, fwd_qobj, fwd_hit_list, rev_uobj, result_sum, spec_qid):
+    def determine_result_status(self, result_sum):
+        """Sets the status of a result from the best hit found so far"""
+        if len(result_sum.positive_hit_list) > 0:
+            result_sum.determined('positive')
+        elif len(result_sum.tentative_hit_list) > 0:
+            result_sum.determined('tentative')
+        elif len(result_sum.unlikely_hit_list) > 0:
+            result_sum.determined('unlikely')
+
+    def get_forward_hit_map(self, fwd_hit_list):
+        """
+        Returns a dict of sequence ID to forward hits for all hits that pass
+        the forward cutoffs: hits before fwd_max_hits and below fwd_evalue, up
+        to the first hit above fwd_evalue. The ID is the first word of the
+        title, i.e. the identity of the reverse query made from the hit.
+        """
+        fwd_hit_map = {}
+        for i in self.get_forward_hit_indices([fwd_hit.e for fwd_hit in fwd_hit_list]):
+            fwd_hit = fwd_hit_list[i]
+            fwd_id = self.get_hit_id(fwd_hit.title)
+            fwd_hit_map.setdefault(fwd_id, []).append(fwd_hit)
+        return fwd_hit_map
+
+    def get_forward_hit_indices(self, evalues):
+        """Returns the indices of forward hits that pass the forward cutoffs"""
+        return hit_classifier.select_forward(evalues, self.fwd_evalue,
+                self.fwd_max_hits)
+
+    def get_hit_id(self, title):
+        """Returns the sequence ID from a hit title"""
+        title = search_util.remove_blast_header(title).split(None,1)
+        return title[0] if title else ''
+
+    def add_reverse_hits(self, fwd_qobj, fwd_hit_list, rev_uobj, result_sum, spec_qid,
+            fwd_hit_map=None):
         """Returns hits for reverse search"""
         print(fwd_qobj.identity)
-        if not self.fwd_max_hits:
-            fwd_max_hits = len(fwd_hit_list)
-        else:
-            fwd_max_hits = self.fwd_max_hits
-        fwd_hit_index = 0
-        for fwd_hit in fwd_hit_list:
-            #new_title = search_util.remove_blast_header(fwd_hit.title)
-            #print('forward hit is ' + new_title + ' ' + str(fwd_hit.e))
-            if (fwd_hit_index == fwd_max_hits) or (fwd_hit.e > self.fwd_evalue):
-                print("stopping at forward hit scans")
-                break # don't need to look further
-            elif (self.fwd_evalue is None) or (fwd_hit.e < self.fwd_evalue):
-                if rev_uobj.query in fwd_hit.title: # matching hit/reverse search pair
-                    print("matching reverse object for " + rev_uobj.name)
-                    print(fwd_hit.title)
-                    rev_hits = rev_uobj.parsed_result.descriptions
-                    status,pos_hit,neg_hit,e_diff = self.reverse_hit_status(
-                            fwd_qobj, rev_hits, spec_qid)
-                    print(status)
-                    #print(pos_hit)
-                    #print(neg_hit)
-                    fwd_id = search_util.remove_blast_header(fwd_hit.title)
-                    if status != 'negative': # there is a hit to add
-                        print('hit status ' + status)
-                        try:
-                            new_pos_hit = search_util.remove_blast_header(pos_hit.title)
-                        except(AttributeError): # NoneType
-                            new_pos_hit = None
-                        try:
-                            new_pos_hit_e = pos_hit.e
-                        except(AttributeError): # NoneType
-                            new_pos_hit_e = None
-                        try:
-                            new_neg_hit = search_util.remove_blast_header(neg_hit.title)
-                        except(AttributeError): # NoneType
-                            new_neg_hit = None
-                        try:
-                            new_neg_hit_e = neg_hit.e
-                        except(AttributeError): # NoneType
-                            new_neg_hit_e = None
-                        hit = summary_obj.Hit(fwd_id, fwd_hit.e,
-                            #search_util.remove_blast_header(pos_hit.title), pos_hit.e,
-                            #search_util.remove_blast_header(neg_hit.title), neg_hit.e,
-                            new_pos_hit, new_pos_hit_e,
-                            new_neg_hit, new_neg_hit_e,
-                            e_diff, status)
-                        #for k,v in hit.__dict__.items():
-                            #print(str(k) + ' ' + str(v))
-                        result_sum.add_hit(fwd_id, hit, status)
-            fwd_hit_index += 1
+        if fwd_hit_map is None:
+            fwd_hit_map = self.get_forward_hit_map(fwd_hit_list)
+        # matching hit/reverse search pair(s)
+        for fwd_hit in fwd_hit_map.get(rev_uobj.query, []):
+            print("matching reverse object for " + rev_uobj.name)
+            print(fwd_hit.title)
+            rev_hits = rev_uobj.parsed_result.descriptions
+            status,pos_hit,neg_hit,e_diff = self.reverse_hit_status(
+                    fwd_qobj, rev_hits, spec_qid)
+            print(status)
+            #print(pos_hit)
+            #print(neg_hit)
+            fwd_id = search_util.remove_blast_header(fwd_hit.title)
+            if status != 'negative': # there is a hit to add
+                print('hit status ' + status)
+                try:
+                    new_pos_hit = search_util.remove_blast_header(pos_hit.title)
+                except(AttributeError): # NoneType
+                    new_pos_hit = None
+                try:
+                    new_pos_hit_e = pos_hit.e
+                except(AttributeError): # NoneType
+                    new_pos_hit_e = None
+                try:
+                    new_neg_hit = search_util.remove_blast_header(neg_hit.title)
+                except(AttributeError): # NoneType
+                    new_neg_hit = None
+                try:
+                    new_neg_hit_e = neg_hit.e
+                except(AttributeError): # NoneType
+                    new_neg_hit_e = None
+                hit = summary_obj.Hit(fwd_id, fwd_hit.e,
+                    #search_util.remove_blast_header(pos_hit.title), pos_hit.e,
+                    #search_util.remove_blast_header(neg_hit.title), neg_hit.e,
+                    new_pos_hit, new_pos_hit_e,
+                    new_neg_hit, new_neg_hit_e,
+                    e_diff, status)
+                #for k,v in hit.__dict__.items():
+                    #print(str(k) + ' ' + str(v))
+                result_sum.add_hit(fwd_id, hit, status)
 
     def reverse_hit_status(self, fwd_qobj, rev_hit_list, spec_qid):
-        """Determines the status of a forward hit based on reverse search"""
-        status = 'negative'
+        """
+        Determines the status of a forward hit based on reverse search; see
+        hit_classifier.classify_reverse for the rules
+        """
+        result = hit_classifier.classify_reverse([rev_hit.e for rev_hit in rev_hit_list],
+                self.get_match_mask(fwd_qobj, rev_hit_list, spec_qid),
+                self.rev_evalue, self.rev_max_hits, self.next_evalue)
+        for rev_hit in rev_hit_list[:result.scanned]:
+            if rev_hit.e == 0:
+                rev_hit.e = hit_classifier.zero_evalue # this is purportedly the threshold at which E-values default to 0
         first_positive_hit = None
         first_negative_hit = None
-        e_diff = None
-        if not self.rev_max_hits:
-            rev_max_hits = len(rev_hit_list)
+        if result.positive is not None:
+            first_positive_hit = rev_hit_list[result.positive]
+        if result.negative is not None:
+            first_negative_hit = rev_hit_list[result.negative]
+        return (result.status, first_positive_hit, first_negative_hit, result.e_diff)
+
+    def get_match_mask(self, fwd_qobj, rev_hit_list, spec_qid):
+        """Returns a list of whether each reverse hit is the original query"""
+        if not rev_hit_list:
+            return []
+        if fwd_qobj.search_type == 'seq':
+            identity = fwd_qobj.identity
+            racc_ids = self.get_racc_ids(fwd_qobj)
+        elif fwd_qobj.search_type == 'hmm':
+            assoc_qobj = self.mqdb[spec_qid] # use spec_qid from result; not qobj
+            identity = spec_qid
+            racc_ids = self.get_racc_ids(assoc_qobj)
         else:
-            rev_max_hits = self.rev_max_hits
-        rev_hit_index = 0
+            return [False] * len(rev_hit_list)
+        matches = []
         for rev_hit in rev_hit_list:
-            print(rev_hit.title + ' ' + str(rev_hit.e))
-            if (rev_hit_index == rev_max_hits) or (rev_hit.e > self.rev_evalue):
-                print('stopping reverse scan')
-                if first_positive_hit:
-                    print('setting status to positive')
-                    status = 'positive' # we only found positive hits
-                break # both of these conditions means we don't need to look more
-            if rev_hit.e == 0:
-                #print("zero value evalue")
-                rev_hit.e = 1e-179 # this is purportedly the threshold at which E-values default to 0
-            if (self.rev_evalue is None) or (rev_hit.e < self.rev_evalue):
-                new_title = search_util.remove_blast_header(rev_hit.title).split(' ',1)[0]
-                match = False
-                if fwd_qobj.search_type == 'seq':
-                    if (new_title == fwd_qobj.identity) or\
-                        (self.check_raccs(new_title,fwd_qobj.raccs)):
-                        match = True
-                elif fwd_qobj.search_type == 'hmm':
-                    assoc_qobj = self.mqdb[spec_qid] # use spec_qid from result; not qobj
-                    if (new_title == spec_qid) or\
-                        (self.check_raccs(new_title,assoc_qobj.raccs)):
-                        match = True
-                if match:
-                    print("match")
-                    if first_negative_hit: # this is the first positive hit
-                        print('checking an unlikely hit')
-                        print(first_negative_hit.e)
-                        print(rev_hit.e)
-                        print(math.fabs(math.log(first_negative_hit.e,10) - math.log(rev_hit.e,10)))
-                        # Here we want the difference to be less, i.e. the separation is not convincing
-                        e_diff = math.fabs(math.log(first_negative_hit.e,10) - math.log(rev_hit.e,10))
-                        if (self.next_evalue is None) or e_diff < self.next_evalue:
-                            #print('hit is unlikely')
-                            status = 'unlikely'
-                            first_positive_hit = rev_hit
-                        else:
-                            #print('hit is negative')
-                            status = 'negative'
-                        #print()
-                        break
-                    if rev_hit_index == (len(rev_hit_list)-1):
-                        status = 'positive'
-                        break # we only found positive hits
-                    if rev_hit_index == 0:
-                        #print('first hit is positive')
-                        first_positive_hit = rev_hit # store a ref to the first positive hit
-                else: # not a match
-                    if not first_negative_hit:
-                        print('found first negative hit')
-                        first_negative_hit = rev_hit # store a ref to the first negative hit
-                    if first_positive_hit: # this is the first non-match hit
-                        print('checking a likely hit')
-                        print(first_positive_hit.e)
-                        print(rev_hit.e)
-                        print(math.fabs(math.log(first_positive_hit.e,10) - math.log(rev_hit.e,10)))
-                        # Here we want the difference to be greater, i.e. the separation is convincing
-                        e_diff = math.fabs(math.log(first_positive_hit.e,10) - math.log(rev_hit.e,10))
-                        if (self.next_evalue is None) or e_diff > self.next_evalue:
-                            #print('hit is positive')
-                            status = 'positive'
-                        else:
-                            #print('hit is tentative')
-                            status = 'tentative'
-                        #print()
-                        break # status determined
-            #print()
-            rev_hit_index += 1
-        #print()
-        #print(status)
-        #print(first_positive_hit)
-        return (status, first_positive_hit, first_negative_hit, e_diff)
+            new_title = search_util.remove_blast_header(rev_hit.title).split(' ',1)[0]
+            matches.append((new_title == identity) or (new_title in racc_ids))
+        return matches
+
+    def get_pair_table(self, rebuild=False):
+        """
+        Returns the stored table for the forward/reverse search pair; the table
+        is built and stored first if it is missing, out of date, or if rebuild
+        is True (e.g. after raccs of the queries have changed)
+        """
+        tdb = configs['summary_tables']
+        fwd_sobj = self.sdb[self.fwd_search]
+        rev_sobj = self.sdb[self.rev_search]
+        key = summary_table.get_table_key(self.fwd_search, self.rev_search)
+        signature = (tuple(fwd_sobj.list_results()), tuple(rev_sobj.list_results()))
+        if not rebuild:
+            try:
+                table = tdb[key]
+                if table.is_current(signature):
+                    return table
+            except(KeyError):
+                pass # not built yet
+        table = self.build_pair_table(fwd_sobj, rev_sobj, signature)
+        tdb.add_entry(key, table)
+        return table
+
+    def build_pair_table(self, fwd_sobj, rev_sobj, signature, queries=None):
+        """
+        Reads the forward and reverse results once, visiting them in the same
+        order as summarize_two_searches, and returns a new table; queries, if
+        given, limits the table to the forward results of those queries
+        """
+        table = summary_table.PairTable(self.fwd_search, self.rev_search, signature)
+        for fwd_uid in fwd_sobj.list_results():
+            fwd_uobj = self.udb[fwd_uid]
+            if queries is not None and not fwd_uobj.query in queries:
+                continue
+            spec_qid = None
+            if fwd_uobj.algorithm == 'hmmer' and fwd_uobj.spec_qid:
+                spec_qid = fwd_uobj.spec_qid
+            fwd_qobj = self.qdb[fwd_uobj.query]
+            fwd_hits = []
+            if self.check_parsed_output(fwd_uobj):
+                fwd_hits = fwd_uobj.parsed_result.descriptions
+            entry = summary_table.ForwardEntry(fwd_uid, fwd_uobj.query, spec_qid,
+                    fwd_uobj.database, (len(fwd_uobj.int_queries) > 0),
+                    [search_util.remove_blast_header(hit.title) for hit in fwd_hits],
+                    [self.get_hit_id(hit.title) for hit in fwd_hits],
+                    [hit.e for hit in fwd_hits])
+            int_queries = set(fwd_uobj.int_queries)
+            for acc in fwd_uobj.int_queries:
+                for rev_db in rev_sobj.databases:
+                    rev_uid = rev_sobj.name + '-' + acc + '-' + rev_db
+                    rev_uobj = self.udb[rev_uid]
+                    if rev_uid.split('-',1)[1].rsplit('-',1)[0] in int_queries:
+                        rev_hits = rev_uobj.parsed_result.descriptions
+                        entry.add_reverse(rev_uid, rev_uobj.query,
+                            [search_util.remove_blast_header(hit.title) for hit in rev_hits],
+                            [hit.e for hit in rev_hits],
+                            self.get_match_mask(fwd_qobj, rev_hits, spec_qid))
+            table.add_entry(entry)
+        return table
+
+    def summarize_from_table(self, table):
+        """
+        Derives the summary from a pair table with the cutoffs of the summary;
+        gives the same summary as summarize_two_searches without reading any
+        results. Entries are classified by summary_pool, in worker processes
+        if parallel_summaries is set, and merged here in their original order.
+        """
+        cutoffs = (self.fwd_evalue, self.fwd_max_hits, self.rev_evalue,
+                self.rev_max_hits, self.next_evalue)
+        workers = summary_pool.max_workers if parallel_summaries else 1
+        for entry,outcomes in summary_pool.classify_table(table, cutoffs, workers):
+            self.add_table_entry(entry, outcomes)
+
+    def add_table_entry(self, entry, outcomes):
+        """Adds the classified reverse results of one forward result"""
+        if self.summary.check_query_summary(entry.qid): # is present already
+            query_sum = self.summary.fetch_query_summary(entry.qid)
+        else:
+            query_sum = summary_obj.QuerySummary(entry.qid, entry.spec_qid)
+        if not entry.has_int_queries: # in case of no fwd hits!
+            result_sum = summary_obj.ResultSummary(entry.database)
+            query_sum.add_db_summary(entry.database, result_sum)
+        fwd_titles = entry.get_titles()
+        fwd_evalues = entry.get_evalues()
+        for rev,(result,fwd_indices) in zip(entry.reverse, outcomes):
+            if query_sum.check_db_summary(entry.database):
+                result_sum = query_sum.fetch_db_summary(entry.database)
+            else:
+                result_sum = summary_obj.ResultSummary(entry.database)
+            status = result[0]
+            if status != 'negative':
+                for i in fwd_indices:
+                    hit = self.get_table_hit(fwd_titles[i], fwd_evalues[i],
+                            rev, result)
+                    result_sum.add_hit(fwd_titles[i], hit, status)
+            if not result_sum.determined():
+                self.determine_result_status(result_sum)
+            query_sum.add_db_summary(entry.database, result_sum)
+        self.summary.add_query_summary(entry.qid, query_sum)
+
+    def get_table_hit(self, fwd_id, fwd_evalue, rev, result):
+        """
+        Returns a Hit from a forward hit and the outcome of its reverse result,
+        a tuple of (status, positive, negative, e_diff)
+        """
+        status,positive,negative,e_diff = result
+        rev_titles = rev.get_titles()
+        rev_evalues = summary_table.unpack(rev.evalues)
+        pos_id = pos_e = neg_id = neg_e = None
+        # reverse hits that were looked at report 0 as zero_evalue
+        if positive is not None:
+            pos_id = rev_titles[positive]
+            pos_e = rev_evalues[positive] or hit_classifier.zero_evalue
+        if negative is not None:
+            neg_id = rev_titles[negative]
+            neg_e = rev_evalues[negative] or hit_classifier.zero_evalue
+        return summary_obj.Hit(fwd_id, fwd_evalue, pos_id, pos_e, neg_id, neg_e,
+                e_diff, status)
 
     def check_parsed_output(self, uobj):
         """Returns True if parsed output exists"""
@@ -319,6 +447,16 @@ class SearchSummarizer:
                 return True
         return False
 
+    def get_racc_ids(self, qobj):
+        """
+        Returns the set of sequence IDs of a query's redundant accessions; built
+        once for each query, as raccs do not change during summarizing
+        """
+        if not qobj.identity in self._racc_ids:
+            self._racc_ids[qobj.identity] = frozenset(self.get_hit_id(racc) for
+                    racc,evalue in qobj.raccs)
+        return self._racc_ids[qobj.identity]
+
 ###########################################
 # Code for summarizing multiple summaries #
 ###########################################
@@ -13,20 +13,22 @@ these objects to generate either graphical or tabular output.
 from persistent import Persistent
 from BTrees.OOBTree import OOBTree
 
+from databases.containers import OrderedTreeSet
+
 class Summary(Persistent):
     """
     Root object in the summary scheme, mainly used as a container to hold all
     other information. For each query in the search, the identity of the query
-    is appended to the internal list, and the nested substructure is placed
-    in a OOBTree container; paired datastructure allows for maintaining order
-    and fast lookup by id in an unstructured container.
+    is added to an ordered set, and the nested substructure is placed in a
+    OOBTree container; paired datastructure allows for maintaining order and
+    fast lookup by id in an unstructured container.
     """
     def __init__(self, fwd_search, fwd_qtype, fwd_dbtype, fwd_algorithm,
             fwd_evalue_cutoff=None, fwd_max_hits=None,
             rev_search=None, rev_qtype=None, rev_dbtype=None, rev_algorithm=None,
             rev_evalue_cutoff=None, rev_max_hits=None,
             next_hit_evalue_cutoff=None, mode='result'):
-        self.query_list = [] # list maintains order
+        self.query_list = OrderedTreeSet() # maintains order
         self.queries = OOBTree()
         self.fwd = fwd_search
         self.fwd_qtype = fwd_qtype
@@ -54,10 +56,8 @@ class Summary(Persistent):
         return self.queries[qid]
 
     def add_query_summary(self, qid, qsummary):
-        """Adds a nested object; qid is appended to list"""
-        if not qid in self.query_list:
-            self.query_list.append(qid)
-            self._p_changed = 1 # signals list was updated
+        """Adds a nested object; qid is added to the ordered set"""
+        self.query_list.add(qid)
         self.queries[qid] = qsummary # add to internal structure
 
 class QuerySummary(Persistent):
@@ -67,7 +67,7 @@ class QuerySummary(Persistent):
     not homologues were found, and each individual hit.
     """
     def __init__(self, qid, spec_qid):
-        self.db_list = []
+        self.db_list = OrderedTreeSet()
         self.dbs = OOBTree()
         self.qid = qid
         self.spec_qid = spec_qid
@@ -84,15 +84,12 @@ class QuerySummary(Persistent):
 
     def add_db_summary(self, db, db_summary):
         """Adds a nested object"""
-        if not db in self.db_list:
-            self.db_list.append(db)
-            self._p_changed = 1
+        self.db_list.add(db)
         self.dbs[db] = db_summary
 
     def remove_db_summary(self, db):
         """Removes a db"""
         self.db_list.remove(db)
-        self._p_changed = 1
         del self.dbs[db]
 
 class ResultSummary(Persistent):
@@ -103,9 +100,9 @@ class ResultSummary(Persistent):
     def __init__(self, database):
         self.db = database
         self.status = 'negative'
-        self.positive_hit_list = []
-        self.tentative_hit_list = []
-        self.unlikely_hit_list = []
+        self.positive_hit_list = OrderedTreeSet()
+        self.tentative_hit_list = OrderedTreeSet()
+        self.unlikely_hit_list = OrderedTreeSet()
         self.lists = ['positive_hit_list','tentative_hit_list','unlikely_hit_list']
         self.hits = OOBTree()
         self._determined = False # whether or not the status has been determined
@@ -120,15 +117,14 @@ class ResultSummary(Persistent):
             self._determined = True
 
     def add_hit(self, hit_id, hit, status='positive'):
-        """Adds a hit (positive or tentative) to the appropriate internal list;
+        """Adds a hit (positive or tentative) to the appropriate internal set;
         all hit objects are also added to the tree"""
         if status == 'positive':
-            self.positive_hit_list.append(hit_id)
+            self.positive_hit_list.add(hit_id)
         elif status == 'tentative':
-            self.tentative_hit_list.append(hit_id)
+            self.tentative_hit_list.add(hit_id)
         else:
-            self.unlikely_hit_list.append(hit_id)
-        self._p_changed = 1
+            self.unlikely_hit_list.add(hit_id)
         self.hits[hit_id] = hit
 
 class Hit(Persistent):
@@ -0,0 +1,82 @@
+"""
+This module contains code for classifying the forward results of a summary table
+(see summaries.summary_table) in a pool of worker processes. Each forward result
+can be classified independently, so the entries of a table are split into
+chunks and each chunk is classified in a separate process; workers only see
+plain data (packed columns and cutoffs) and return plain outcomes.
+
+Summary objects are persistent and tied to a single database connection, so
+workers never create them; outcomes are instead yielded back in the original
+order to a single writer (SearchSummarizer.summarize_from_table), which merges
+them into the Summary as later chunks are still being classified.
+"""
+
+import os, itertools, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from summaries import summary_table, hit_classifier
+
+# Placeholders - should be through settings eventually
+max_workers = os.cpu_count() or 1 # worker processes for classifying
+chunk_size = 25 # forward results classified per task
+
+def get_entry_data(entry):
+    """Returns the plain data of a ForwardEntry that workers need"""
+    return (entry.evalues, entry.ids, [(rev.query, rev.evalues, rev.matches)
+        for rev in entry.reverse])
+
+def classify_entries(entries, cutoffs):
+    """
+    Classifies a chunk of entries from get_entry_data() with cutoffs of
+    (fwd_evalue, fwd_max_hits, rev_evalue, rev_max_hits, next_evalue). For
+    each entry, returns a list with one outcome per reverse result: a tuple
+    of (status, positive, negative, e_diff) and the indices of the forward
+    hits the reverse result applies to.
+    """
+    fwd_evalue,fwd_max_hits,rev_evalue,rev_max_hits,next_evalue = cutoffs
+    columns = []
+    masks = []
+    for fwd_evalues,fwd_ids,reverse in entries:
+        for query,rev_evalues,matches in reverse:
+            columns.append(summary_table.unpack(rev_evalues))
+            masks.append(summary_table.unpack(matches, 'B'))
+    # all reverse results in the chunk are classified together
+    statuses = iter(hit_classifier.classify_reverse_batch(columns, masks,
+        rev_evalue, rev_max_hits, next_evalue))
+    outcomes = []
+    for fwd_evalues,fwd_ids,reverse in entries:
+        ids = fwd_ids.split('\n') if fwd_evalues else []
+        fwd_hit_map = {} # ID -> indices of forward hits that pass cutoffs
+        for i in hit_classifier.select_forward(summary_table.unpack(fwd_evalues),
+                fwd_evalue, fwd_max_hits):
+            fwd_hit_map.setdefault(ids[i], []).append(i)
+        entry_outcomes = []
+        for query,rev_evalues,matches in reverse:
+            result = next(statuses)
+            entry_outcomes.append(((result.status, result.positive,
+                result.negative, result.e_diff), fwd_hit_map.get(query, [])))
+        outcomes.append(entry_outcomes)
+    return outcomes
+
+def classify_table(table, cutoffs, workers=max_workers):
+    """
+    Yields (entry, outcomes) for each entry of the table, in order. Chunks are
+    sent to a process pool if there is more than one chunk and more than one
+    worker, else they are classified in the calling thread.
+    """
+    entries = table.entries
+    chunks = [entries[i:(i + chunk_size)] for i in range(0, len(entries),
+        chunk_size)]
+    # persistent entries are only read here, on the writer thread
+    data = [[get_entry_data(entry) for entry in chunk] for chunk in chunks]
+    if workers > 1 and len(chunks) > 1:
+        # spawn, as forking a process with GUI and executor threads is unsafe
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(min(workers, len(chunks)),
+                mp_context=context) as pool:
+            results = pool.map(classify_entries, data, itertools.repeat(cutoffs))
+            for chunk,outcomes in zip(chunks, results):
+                yield from zip(chunk, outcomes)
+    else:
+        for chunk,chunk_data in zip(chunks, data):
+            yield from zip(chunk, classify_entries(chunk_data, cutoffs))
@@ -0,0 +1,122 @@
+"""
+This module contains code for cutoff-independent summary tables. Summarizing a
+forward and reverse search together means loading every forward result and
+every reverse result, yet none of what is read from them depends on the cutoffs
+of the summary: the E-values and titles of each forward hit, and for each
+reverse result, its E-values, titles and which of its hits match the original
+query.
+
+A PairTable holds exactly this for one forward/reverse search pair, with one
+ForwardEntry per forward result. Tables are stored in the 'summary_tables' node
+of the database, so that summaries with new cutoffs can be derived from the
+table alone (see SearchSummarizer.summarize_from_table) rather than from the
+parsed results. A table is rebuilt when the results of either search change;
+as query raccs are read when the table is built, it should also be rebuilt
+after those are edited.
+"""
+
+from array import array
+
+from persistent import Persistent
+
+def pack(values, typecode='d'):
+    """Packs a column of numbers into bytes"""
+    return array(typecode, values).tobytes()
+
+def unpack(data, typecode='d'):
+    """Unpacks a column of numbers packed with pack()"""
+    column = array(typecode)
+    column.frombytes(data)
+    return column
+
+def get_table_key(fwd_search, rev_search):
+    """Key of the table for a forward/reverse search pair"""
+    return (fwd_search, rev_search)
+
+class ReverseEntry:
+    """
+    Hits of a single reverse result: titles (without BLAST headers), E-values
+    and a mask of which hits match the original query
+    """
+    def __init__(self, uid, query, titles, evalues, matches):
+        self.uid = uid
+        self.query = query # qid of the reverse query, i.e. a forward hit ID
+        self.titles = '\n'.join(titles)
+        self.evalues = pack(evalues)
+        self.matches = pack(matches, 'B')
+
+    def get_titles(self):
+        """Returns a list of hit titles"""
+        return self.titles.split('\n') if self.evalues else []
+
+class ForwardEntry(Persistent):
+    """
+    Hits of a single forward result and the reverse results made from them,
+    in the order the summarizer visits them
+    """
+    def __init__(self, uid, qid, spec_qid, database, has_int_queries,
+            titles=(), ids=(), evalues=()):
+        self.uid = uid
+        self.qid = qid
+        self.spec_qid = spec_qid
+        self.database = database
+        self.has_int_queries = has_int_queries
+        self.titles = '\n'.join(titles) # without BLAST headers
+        self.ids = '\n'.join(ids) # first word of each title
+        self.evalues = pack(evalues)
+        self.reverse = []
+
+    def add_reverse(self, uid, query, titles, evalues, matches):
+        """Adds the hits of a reverse result"""
+        self.reverse.append(ReverseEntry(uid, query, titles, evalues, matches))
+        self._p_changed = 1
+
+    def get_titles(self):
+        """Returns a list of hit titles"""
+        return self.titles.split('\n') if self.evalues else []
+
+    def get_ids(self):
+        """Returns a list of hit IDs"""
+        return self.ids.split('\n') if self.evalues else []
+
+    def get_evalues(self):
+        """Returns the E-value column as an array"""
+        return unpack(self.evalues)
+
+class PairTable(Persistent):
+    """
+    All cutoff-independent information needed to summarize one forward and
+    reverse search pair; signature records the results of both searches at
+    the time the table was built
+    """
+    def __init__(self, fwd_search, rev_search, signature):
+        self.fwd = fwd_search
+        self.rev = rev_search
+        self.signature = signature
+        self.entries = []
+
+    def is_current(self, signature):
+        """True if neither search has changed since the table was built"""
+        return self.signature == signature
+
+    def add_entry(self, entry):
+        """Adds a forward result"""
+        self.entries.append(entry)
+        self._p_changed = 1
+
+    def get_reverse_columns(self):
+        """
+        Returns the E-values and match masks of all reverse results, in order,
+        as two lists; these are unpacked once while the table is in memory
+        """
+        try:
+            return self._v_reverse_columns
+        except(AttributeError):
+            columns = []
+            masks = []
+            for entry in self.entries:
+                for rev in entry.reverse:
+                    columns.append(unpack(rev.evalues))
+                    masks.append(unpack(rev.matches, 'B'))
+            self._v_reverse_columns = (columns, masks)
+            return self._v_reverse_columns
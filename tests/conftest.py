@@ -0,0 +1,28 @@
+"""Fixtures shared by the tests"""
+
+import threading
+
+import pytest
+
+from bin import initialize_goat
+from bin.initialize_goat import configs
+from databases import goat_db
+
+@pytest.fixture
+def goat(tmp_path):
+    """A new database, with the global dbs pointing to it"""
+    db = goat_db.GoatDB(str(tmp_path / 'goat.fs'))
+    configs['goat_db'] = db
+    initialize_goat.get_specific_dbs(db)
+    yield db
+    db.close()
+    configs.clear()
+
+def in_thread(func):
+    """Calls func in a new thread, which commits and closes its connection"""
+    def run():
+        func()
+        configs['goat_db'].close_connection()
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
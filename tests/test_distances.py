@@ -0,0 +1,50 @@
+"""Tests for the in-process distances in phylo.distances and phylo.sketch"""
+
+import numpy as np
+import pytest
+
+from phylo import distances, sketch
+
+seqs = ['ACDEFGHIKLMNPQRSTVWY',
+        'ACDEFGHIKLMNPQRSTVWW',
+        'ACDE-GHIKLANPQRSAVWY',
+        'WCDEFGHIKLMNPARSTVYY']
+
+def test_lg_transitions_at_zero_are_identity():
+    probs = distances.lg_transitions(np.array([0.0]))[0]
+    assert np.allclose(probs, np.eye(20), atol=1e-10)
+
+@pytest.mark.parametrize('alpha', [None, 0.5])
+def test_lg_transitions_rows_sum_to_one(alpha):
+    probs = distances.lg_transitions(np.array([0.01, 0.5, 2.0, 10.0]), alpha)
+    assert np.allclose(probs.sum(axis=2), 1.0)
+    assert (probs >= -1e-12).all()
+
+def test_poisson_is_corrected_p_distance():
+    codes = distances.encode(seqs)
+    p = distances.p_distance(codes)
+    poisson = distances.poisson_distance(codes)
+    assert np.allclose(poisson, -np.log(1 - p))
+
+def test_p_distance_ignores_gaps():
+    codes = distances.encode(seqs)
+    p = distances.p_distance(codes)
+    assert p[0,1] == pytest.approx(1 / 20)
+    assert p[0,2] == pytest.approx(2 / 19) # one site is a gap
+
+def test_lg_distance_is_symmetric_and_ordered():
+    dist = distances.get_distances((None, seqs), 'lg')
+    assert np.allclose(dist, dist.T)
+    assert np.allclose(np.diag(dist), 0.0)
+    assert 0 < dist[0,1] < dist[0,3] < distances.max_distance
+
+def test_sketch_of_identical_sequences_is_zero():
+    dist = sketch.get_distances((None, [seqs[0], seqs[0].lower(), seqs[1]]))
+    assert dist[0,1] == 0.0
+    assert dist[0,2] > 0.0
+    assert np.allclose(dist, dist.T)
+
+def test_sketch_without_shared_kmers_is_max_distance():
+    dist = sketch.get_distances((None, ['ACDEFGHIK', 'WWWWWWWWW', 'AC']))
+    assert dist[0,1] == distances.max_distance
+    assert dist[0,2] == distances.max_distance # shorter than k
@@ -0,0 +1,62 @@
+"""Tests for commits from several threads in databases.goat_db"""
+
+import threading
+
+import pytest
+from ZODB.POSException import ConflictError
+
+from tests.conftest import in_thread
+
+def set_entry(goat, value):
+    goat.root['jobs']['key'] = value
+
+def test_conflict_is_raised_and_aborted(goat):
+    goat.root['jobs'] # seen before the other thread commits
+    in_thread(lambda: set_entry(goat, 'other'))
+    set_entry(goat, 'mine')
+    with pytest.raises(ConflictError):
+        goat.sync()
+    goat.sync() # nothing left to commit
+    assert goat.root['jobs']['key'] == 'other'
+
+def test_transact_calls_func_again_after_conflict(goat):
+    goat.root['jobs']
+    in_thread(lambda: set_entry(goat, 'other'))
+    calls = []
+    def func():
+        calls.append(goat.root['jobs'].get('key'))
+        set_entry(goat, 'mine')
+        return len(calls)
+    assert goat.transact(func) == 2
+    assert calls == [None, 'other'] # sees the other commit when run again
+    assert goat.root['jobs']['key'] == 'mine'
+
+def test_transact_raises_after_retries(goat):
+    def func():
+        goat.root['jobs']
+        in_thread(lambda: set_entry(goat, len(calls)))
+        calls.append(None)
+        set_entry(goat, 'mine')
+    calls = []
+    with pytest.raises(ConflictError):
+        goat.transact(func, retries=2)
+    assert len(calls) == 3
+    goat.sync()
+    assert goat.root['jobs']['key'] == 2
+
+def test_close_connection_closes_after_conflict(goat):
+    errors = []
+    def worker():
+        goat.root['jobs']
+        in_thread(lambda: set_entry(goat, 'other'))
+        set_entry(goat, 'mine')
+        try:
+            goat.close_connection()
+        except(ConflictError) as e:
+            errors.append(e)
+        errors.append(getattr(goat._local, 'connection', None))
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert isinstance(errors[0], ConflictError)
+    assert errors[1] is None
@@ -0,0 +1,138 @@
+"""
+Tests that summaries.hit_classifier gives the same outcomes as the
+one-hit-at-a-time rules it replaced in summaries.summarizer; those rules are
+copied below, with hits reduced to E-values and a flag for whether a reverse
+hit matches the original query
+"""
+
+import math, random
+
+import pytest
+
+from summaries import hit_classifier
+
+evalues = [0.0, 1e-100, 1e-50, 1e-20, 1e-10, 1e-5, 1e-3, 0.01, 0.05, 0.1, 1.0]
+
+class Hit:
+    def __init__(self, e, match=False):
+        self.e = e
+        self.match = match
+
+def add_forward_hits(hits, fwd_evalue, fwd_max_hits, next_evalue):
+    """Returns indices of positive hits, as SearchSummarizer.add_forward_hits"""
+    positive = []
+    hit_index = 0
+    for i,desc in enumerate(hits):
+        hit_status = 'negative'
+        if (hit_index == fwd_max_hits) or (desc.e > fwd_evalue):
+            break
+        if next_evalue is None:
+            hit_status = 'positive'
+        else:
+            try:
+                next_e = math.log(hits[(hit_index + 1)].e, 10)
+                if math.fabs(math.log(desc.e,10) - next_e) > next_evalue:
+                    hit_status = 'positive'
+                else:
+                    break
+            except(IndexError):
+                hit_status = 'positive'
+        if hit_status == 'positive':
+            positive.append(i)
+    return positive
+
+def reverse_hit_status(hits, rev_evalue, rev_max_hits, next_evalue):
+    """Returns (status, positive, negative, e_diff) as reverse_hit_status"""
+    status = 'negative'
+    first_positive_hit = None
+    first_negative_hit = None
+    e_diff = None
+    if not rev_max_hits:
+        rev_max_hits = len(hits)
+    rev_hit_index = 0
+    for rev_hit in hits:
+        if (rev_hit_index == rev_max_hits) or (rev_hit.e > rev_evalue):
+            if first_positive_hit:
+                status = 'positive'
+            break
+        if rev_hit.e == 0:
+            rev_hit.e = 1e-179
+        if (rev_evalue is None) or (rev_hit.e < rev_evalue):
+            if rev_hit.match:
+                if first_negative_hit:
+                    e_diff = math.fabs(math.log(first_negative_hit.e,10) -
+                            math.log(rev_hit.e,10))
+                    if (next_evalue is None) or e_diff < next_evalue:
+                        status = 'unlikely'
+                        first_positive_hit = rev_hit
+                    else:
+                        status = 'negative'
+                    break
+                if rev_hit_index == (len(hits)-1):
+                    status = 'positive'
+                    break
+                if rev_hit_index == 0:
+                    first_positive_hit = rev_hit
+            else:
+                if not first_negative_hit:
+                    first_negative_hit = rev_hit
+                if first_positive_hit:
+                    e_diff = math.fabs(math.log(first_positive_hit.e,10) -
+                            math.log(rev_hit.e,10))
+                    if (next_evalue is None) or e_diff > next_evalue:
+                        status = 'positive'
+                    else:
+                        status = 'tentative'
+                    break
+        rev_hit_index += 1
+    index = lambda hit: None if hit is None else hits.index(hit)
+    return (status, index(first_positive_hit), index(first_negative_hit), e_diff)
+
+def random_hits(rnd, match=False):
+    es = sorted(rnd.choice(evalues) for _ in range(rnd.randint(0, 6)))
+    return [Hit(e, match and rnd.random() < 0.5) for e in es]
+
+@pytest.mark.parametrize('seed', range(20))
+def test_forward_matches_loop(seed):
+    rnd = random.Random(seed)
+    for _ in range(50):
+        hits = random_hits(rnd)
+        fwd_evalue = rnd.choice([1e-10, 1e-3, 0.05])
+        fwd_max_hits = rnd.choice([None, 0, 1, 3])
+        next_evalue = rnd.choice([None, 0, 2, 5])
+        try:
+            expected = add_forward_hits(hits, fwd_evalue, fwd_max_hits,
+                    next_evalue)
+        except(ValueError):
+            with pytest.raises(ValueError):
+                hit_classifier.classify_forward([hit.e for hit in hits],
+                        fwd_evalue, fwd_max_hits, next_evalue)
+            continue
+        positive = hit_classifier.classify_forward([hit.e for hit in hits],
+                fwd_evalue, fwd_max_hits, next_evalue)
+        assert list(positive.nonzero()[0]) == expected
+
+@pytest.mark.parametrize('seed', range(20))
+def test_reverse_matches_loop(seed):
+    rnd = random.Random(seed)
+    for _ in range(50):
+        hits = random_hits(rnd, match=True)
+        rev_evalue = rnd.choice([1e-10, 1e-3, 0.05])
+        rev_max_hits = rnd.choice([None, 1, 3])
+        next_evalue = rnd.choice([None, 2, 5])
+        result = hit_classifier.classify_reverse([hit.e for hit in hits],
+                [hit.match for hit in hits], rev_evalue, rev_max_hits,
+                next_evalue)
+        status,positive,negative,e_diff = reverse_hit_status(hits, rev_evalue,
+                rev_max_hits, next_evalue)
+        assert result.status == status
+        assert result.positive == positive
+        assert result.negative == negative
+        assert result.e_diff == pytest.approx(e_diff)
+
+def test_batch_matches_single():
+    rnd = random.Random(0)
+    columns = [[hit.e for hit in random_hits(rnd)] for _ in range(30)]
+    batch = hit_classifier.classify_forward_batch(columns, 0.05, None, None)
+    for column,positive in zip(columns, batch):
+        assert (positive == hit_classifier.classify_forward(column, 0.05)).all()
@@ -0,0 +1,51 @@
+"""Tests for recording and resuming jobs in searches.job_table"""
+
+import pytest
+from ZODB.POSException import ConflictError
+
+from bin.initialize_goat import configs
+from searches import job_table
+
+from tests.conftest import in_thread
+
+def test_done_jobs_are_not_run_again(goat):
+    calls = []
+    def func():
+        calls.append(None)
+        return {'out':len(calls)}
+    tracker = job_table.get_tracker('fwd', 'recip_blast')
+    assert tracker.run('a', 'stage', func) == {'out':1}
+    tracker = job_table.get_tracker('fwd', 'recip_blast') # resumed
+    assert tracker.run('a', 'stage', func) == {'out':1}
+    assert len(calls) == 1
+    assert [table.name for table in job_table.list_unfinished()] == ['fwd']
+    tracker.set_finished()
+    assert job_table.list_unfinished() == []
+
+def test_failed_job_is_run_on_resume(goat):
+    def fail():
+        configs['search_cache']['lost'] = 1 # discarded with the failure
+        raise RuntimeError('boom')
+    tracker = job_table.get_tracker('fwd', 'recip_blast')
+    with pytest.raises(RuntimeError):
+        tracker.run('a', 'stage', fail)
+    job = tracker.table.jobs['a']
+    assert (job.state, job.error, job.attempts) == ('failed', 'boom', 1)
+    assert not 'lost' in goat.root['search_cache']
+    tracker = job_table.get_tracker('fwd', 'recip_blast')
+    assert tracker.run('a', 'stage', lambda: {'out':2}) == {'out':2}
+    assert tracker.table.jobs['a'].attempts == 2
+
+def test_lost_commit_fails_job(goat):
+    def func():
+        goat.root['search_cache'] # seen before the other thread commits
+        in_thread(lambda: configs['search_cache'].add_entry('key', 'other'))
+        configs['search_cache'].add_entry('key', 'mine')
+        return {'out':1}
+    tracker = job_table.get_tracker('fwd', 'recip_blast')
+    with pytest.raises(ConflictError):
+        tracker.run('a', 'stage', func)
+    goat.sync()
+    job = tracker.table.jobs['a']
+    assert (job.state, job.attempts) == ('failed', 1)
+    assert goat.root['search_cache']['key'] == 'other'
@@ -0,0 +1,111 @@
+"""Tests for splitting the output of batched BLAST and HMMer searches"""
+
+import pytest
+
+from searches.blast import blast_parser, blast_setup
+from searches.hmmer import hmmer_parser, hmmer_setup
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+def test_tabular_split_outfmt6(tmp_path):
+    batch = tmp_path / 'batch.txt'
+    batch.write_text('q1\ts1\t1e-10\t50.0\ts1 desc\n'
+            'q2\ts2\t1e-5\t30.0\ts2 desc\n'
+            'q1\ts3\t1e-3\t20.0\ts3 desc\n')
+    outpaths = [str(tmp_path / name) for name in ('q1.txt','q2.txt','q3.txt')]
+    written = blast_parser.TabularParser(str(batch)).split(outpaths,
+            ['q1','q2','q3'])
+    assert written == outpaths
+    assert read(outpaths[0]).splitlines() == ['q1\ts1\t1e-10\t50.0\ts1 desc',
+            'q1\ts3\t1e-3\t20.0\ts3 desc']
+    assert read(outpaths[1]).splitlines() == ['q2\ts2\t1e-5\t30.0\ts2 desc']
+    assert read(outpaths[2]) == '' # no hits
+    hits = blast_parser.TabularParser(outpaths[0]).parse().descriptions
+    assert [(hit.title, hit.e) for hit in hits] == [('s1 desc', 1e-10),
+            ('s3 desc', 1e-3)]
+
+def test_tabular_split_outfmt7(tmp_path):
+    batch = tmp_path / 'batch.txt'
+    batch.write_text('# BLASTP 2.6.0+\n# Query: q1\nq1\ts1\t1e-10\t50.0\ts1\n'
+            '# BLASTP 2.6.0+\n# Query: q2\n# 0 hits found\n'
+            '# BLAST processed 2 queries\n')
+    outpaths = [str(tmp_path / 'q1.txt'), str(tmp_path / 'q2.txt')]
+    blast_parser.TabularParser(str(batch)).split(outpaths)
+    assert 'q1\ts1' in read(outpaths[0])
+    assert not 'q1\ts1' in read(outpaths[1])
+    assert '0 hits found' in read(outpaths[1])
+
+def test_tabular_split_needs_unique_ids(tmp_path):
+    batch = tmp_path / 'batch.txt'
+    batch.write_text('q1\ts1\t1e-10\t50.0\ts1\n')
+    outpaths = [str(tmp_path / 'a.txt'), str(tmp_path / 'b.txt')]
+    with pytest.raises(ValueError):
+        blast_parser.TabularParser(str(batch)).split(outpaths, ['q1','q1'])
+
+def test_tabular_split_outfmt7_counts_blocks(tmp_path):
+    batch = tmp_path / 'batch.txt'
+    batch.write_text('# BLASTP 2.6.0+\n# Query: q1\n# 0 hits found\n')
+    outpaths = [str(tmp_path / 'a.txt'), str(tmp_path / 'b.txt')]
+    with pytest.raises(ValueError):
+        blast_parser.TabularParser(str(batch)).split(outpaths)
+
+def test_xml_split_counts_iterations(tmp_path):
+    batch = tmp_path / 'batch.xml'
+    batch.write_text('<BlastOutput>\n<BlastOutput_iterations>\n'
+            '<Iteration>\n<Iteration_query-def>a</Iteration_query-def>\n</Iteration>\n'
+            '</BlastOutput_iterations>\n</BlastOutput>\n')
+    outpaths = [str(tmp_path / 'a.xml'), str(tmp_path / 'b.xml')]
+    with pytest.raises(ValueError):
+        blast_parser.XMLParser(str(batch)).split(outpaths)
+    assert blast_parser.XMLParser(str(batch)).split(outpaths[:1]) == outpaths[:1]
+    assert '<Iteration_query-def>a<' in read(outpaths[0])
+
+class BLASTQuery:
+    def __init__(self, description, sequence):
+        self.description = description
+        self.sequence = sequence
+
+def test_batched_outfmt6_queries_get_unique_ids():
+    queries = [BLASTQuery('sp|P1| same name', 'MKV'), BLASTQuery('sp|P1| same', 'MKW')]
+    lines = blast_setup.BLAST(None, queries, None, None,
+            outfmt=6).get_stdin_input().splitlines()
+    ids = [line[1:].split()[0] for line in lines if line.startswith('>')]
+    assert ids == [blast_parser.get_batch_id(0), blast_parser.get_batch_id(1)]
+    single = blast_setup.BLAST(None, queries[0], None, None, outfmt=6)
+    assert single.get_stdin_input() == '>sp|P1| same name\nMKV\n'
+
+def test_hmmsearch_split(tmp_path):
+    batch = tmp_path / 'batch.txt'
+    batch.write_text('# target name  accession  query name\n'
+            'seq1 - hmmA - 1e-20 70.0 0.1\n'
+            'seq2 - hmm-B - 1e-5 20.0 0.1\n'
+            'seq3 - hmmA - 1e-3 10.0 0.1\n'
+            '# Program: hmmsearch\n')
+    outpaths = {'hmmA':str(tmp_path / 'a.txt'), 'hmm-B':str(tmp_path / 'b.txt'),
+            'hmmC':str(tmp_path / 'c.txt')}
+    hmmer_parser.HMMsearchParser(str(batch)).split(outpaths)
+    a = read(outpaths['hmmA']).splitlines()
+    assert a == ['# target name  accession  query name',
+            'seq1 - hmmA - 1e-20 70.0 0.1', 'seq3 - hmmA - 1e-3 10.0 0.1',
+            '# Program: hmmsearch']
+    assert 'seq2' in read(outpaths['hmm-B'])
+    assert not any(line[0] != '#' for line in
+            read(outpaths['hmmC']).splitlines()) # header and footer only
+
+class HMMQuery:
+    def __init__(self, identity, sequence):
+        self.identity = identity
+        self.sequence = sequence
+
+def test_hmm_library_names_models_by_position(tmp_path):
+    library = str(tmp_path / 'library.hmm')
+    hmmer_setup.write_hmm_library([
+        HMMQuery('PF1 a', 'HMMER3/f [3.1b1]\nNAME  PF1-long.2\nLENG  10\n//'),
+        HMMQuery('PF1 a', 'HMMER3/f [3.1b1]\nNAME  PF1-long.2\nDESC  NAME\n//\n')],
+        library)
+    names = [line.split(None, 1)[1] for line in read(library).splitlines()
+            if line.startswith('NAME')]
+    assert names == [hmmer_setup.get_model_name(0), hmmer_setup.get_model_name(1)]
+    assert 'DESC  NAME' in read(library)
@@ -0,0 +1,38 @@
+"""Tests for the task graph in util.pipeline"""
+
+import threading
+from concurrent.futures import Future
+
+from util import pipeline
+
+def test_failure_skips_dependents_only():
+    p = pipeline.Pipeline()
+    def fail():
+        raise RuntimeError('boom')
+    p.add('a', fail)
+    p.add('b', lambda: 'b', ['a'])
+    p.add('c', lambda: 'c', ['b'])
+    p.add('d', lambda: 'd')
+    assert p.run() is False
+    states = {name:task.state for name,task in p.tasks.items()}
+    assert states == {'a':'failed', 'b':'skipped', 'c':'skipped', 'd':'done'}
+    assert isinstance(p.tasks['a'].error, RuntimeError)
+    assert p.tasks['d'].result == 'd'
+
+def test_generator_task_waits_for_future():
+    p = pipeline.Pipeline()
+    future = Future()
+    def wait():
+        yield future
+        return future.result() + 1
+    p.add('wait', wait)
+    p.add('after', lambda: p.tasks['wait'].result * 2, ['wait'])
+    threading.Timer(0.05, future.set_result, [1]).start()
+    assert p.run() is True
+    assert p.tasks['after'].result == 4
+
+def test_missing_dependency_is_skipped():
+    p = pipeline.Pipeline()
+    p.add('a', lambda: None, ['not_there'])
+    assert p.run() is False
+    assert p.tasks['a'].state == 'skipped'
@@ -0,0 +1,55 @@
+"""Tests for committing results from the writer thread in results.result_writer"""
+
+import pytest
+from persistent import Persistent
+
+from bin.initialize_goat import configs
+from results import result_writer
+
+from tests.conftest import in_thread
+
+class Result(Persistent):
+    def __init__(self, name):
+        self.name = name
+        self.parsed = False
+
+def conflicting_handler(calls, conflicts):
+    """Returns a handler whose first conflicts calls clash with another thread"""
+    def handler(robj):
+        calls.append(robj.name)
+        cdb = configs['search_cache']
+        if len(calls) <= conflicts:
+            list(cdb.list_entries()) # seen before the other thread commits
+            in_thread(lambda: cdb.add_entry(robj.name, len(calls)))
+        cdb.add_entry(robj.name, 'mine')
+        robj.parsed = True
+    return handler
+
+def test_conflicting_batch_is_written_again(goat):
+    calls = []
+    writer = result_writer.ResultWriter(conflicting_handler(calls, 1))
+    writer.start()
+    writer.put(Result('r1'))
+    writer.put(Result('r2'))
+    assert writer.flush().result(timeout=10) == 2
+    writer.close()
+    assert calls == ['r1', 'r2', 'r1', 'r2'] # handlers run again
+    goat.sync()
+    assert configs['result_db']['r2'].parsed
+    assert configs['search_cache']['r1'] == 'mine'
+
+def test_lost_batch_is_reported_by_flush(goat):
+    calls = []
+    attempts = result_writer.commit_retries + 1
+    writer = result_writer.ResultWriter(conflicting_handler(calls, attempts))
+    writer.start()
+    writer.put(Result('r1'))
+    with pytest.raises(result_writer.WriteError):
+        writer.flush().result(timeout=10)
+    assert calls == ['r1'] * attempts
+    writer.put(Result('r2')) # the writer keeps going
+    assert writer.flush().result(timeout=10) == 1
+    writer.close()
+    goat.sync()
+    assert not 'r1' in goat.root['results']
+    assert 'r2' in goat.root['results']
@@ -0,0 +1,43 @@
+"""Tests for the forward cutoffs of reverse queries in results.intermediate"""
+
+import pytest
+
+from bin.initialize_goat import configs
+from results import intermediate
+from searches import search_obj
+from summaries import summary_obj, summarizer
+
+def add_search(name, cutoffs):
+    sobj = search_obj.Search(name, 'blast', 'protein', 'protein', [], [])
+    intermediate.Search2Queries(sobj, evalue=cutoffs[0], max_hits=cutoffs[1],
+            results=[]).populate_search_queries()
+    configs['search_db'].add_entry(name, sobj)
+    return sobj
+
+def get_summarizer(fwd_evalue, fwd_max_hits):
+    summary = summary_obj.Summary('fwd', 'protein', 'protein', 'blast',
+            fwd_evalue_cutoff=fwd_evalue, fwd_max_hits=fwd_max_hits,
+            rev_search='rev')
+    return summarizer.SearchSummarizer(summary)
+
+def test_cutoffs_are_recorded(goat):
+    assert add_search('fwd', (1e-5, 10)).rev_query_cutoffs == (1e-5, 10)
+    assert search_obj.Search('old', 'blast', 'protein', 'protein', [],
+            []).rev_query_cutoffs is None
+
+@pytest.mark.parametrize('fwd_evalue,fwd_max_hits', [(1e-5, 10),
+    (1e-10, 5), (1e-5, 1)])
+def test_same_or_stricter_cutoffs_are_allowed(goat, fwd_evalue, fwd_max_hits):
+    add_search('fwd', (1e-5, 10))
+    get_summarizer(fwd_evalue, fwd_max_hits).check_reverse_cutoffs()
+
+@pytest.mark.parametrize('fwd_evalue,fwd_max_hits', [(1e-3, 10),
+    (None, 10), (1e-5, 20), (1e-5, None)])
+def test_looser_cutoffs_are_refused(goat, fwd_evalue, fwd_max_hits):
+    add_search('fwd', (1e-5, 10))
+    with pytest.raises(ValueError):
+        get_summarizer(fwd_evalue, fwd_max_hits).check_reverse_cutoffs()
+
+def test_any_cutoffs_without_limits(goat):
+    add_search('fwd', (None, None))
+    get_summarizer(None, None).check_reverse_cutoffs()
@@ -0,0 +1,56 @@
+"""Tests for hits and eviction in searches.search_cache"""
+
+import os
+
+from bin.initialize_goat import configs
+from searches import search_cache
+
+def make_output(tmp_path, name, size=10):
+    path = tmp_path / name
+    path.write_text('x' * size)
+    return str(path)
+
+def get_cache(tmp_path, max_size):
+    return search_cache.SearchCache(str(tmp_path / 'cache'), max_size)
+
+def test_fetch_does_not_change_entries(goat, tmp_path):
+    cache = get_cache(tmp_path, 100)
+    cache.store('a', make_output(tmp_path, 'a.out'))
+    goat.sync()
+    entry = configs['search_cache']['a']
+    last_used = entry.last_used
+    outpath = str(tmp_path / 'copy.out')
+    assert cache.fetch('a', outpath)
+    assert open(outpath).read() == 'x' * 10
+    assert not entry._p_changed
+    cache.apply_pending()
+    assert entry.last_used > last_used
+
+def test_missing_output_is_removed_by_apply_pending(goat, tmp_path):
+    cache = get_cache(tmp_path, 100)
+    cache.store('a', make_output(tmp_path, 'a.out'))
+    goat.sync()
+    os.remove(configs['search_cache']['a'].filepath)
+    assert not cache.fetch('a', str(tmp_path / 'copy.out'))
+    assert 'a' in goat.root['search_cache'] # not removed by fetch
+    cache.apply_pending()
+    assert not 'a' in goat.root['search_cache']
+    assert cache.get_total_size() == 0
+
+def test_least_recently_used_is_evicted(goat, tmp_path):
+    cache = get_cache(tmp_path, 25)
+    cache.store('a', make_output(tmp_path, 'a.out'))
+    cache.store('b', make_output(tmp_path, 'b.out'))
+    cache.fetch('a', str(tmp_path / 'copy.out')) # now used after b
+    cache.store('c', make_output(tmp_path, 'c.out'))
+    assert sorted(goat.root['search_cache'].keys()) == ['a', 'c']
+    assert not os.path.exists(str(tmp_path / 'cache' / 'b.out'))
+    assert cache.get_total_size() == 20
+
+def test_storing_again_is_counted_once(goat, tmp_path):
+    cache = get_cache(tmp_path, 100)
+    outpath = make_output(tmp_path, 'a.out')
+    cache.store('a', outpath)
+    goat.abort() # e.g. the writer's commit was lost
+    cache.store('a', outpath)
+    assert cache.get_total_size() == 10
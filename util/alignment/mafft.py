@@ -1,21 +1,35 @@
 """
 This module contains code for aligning sequences using MAFFT. Idea is to have a
-single class that handles both files and stdin.
+single class that handles both files and stdin. In stdin mode, sequences are
+read from a file or given directly as FASTA lines, and are cleaned up as they
+are streamed into MAFFT, so no filtered copy of the input is written.
 """
 
-import os,subprocess
+import os
+
+from util import executor
 
 # Should eventually go through settings
 tmp_dir = '/Users/cklinger/git/Goat/tmp'
 
 class MAFFT:
-    def __init__(self, seq_file, msa_file=None, *kwargs):
+    """
+    seq_file may be None if sequences, an iterable of FASTA lines, is given
+    instead; in that case, the alignment is written to msa_file if given, or
+    else kept in memory on the job (see run_from_stdin).
+    """
+    def __init__(self, seq_file, msa_file=None, *kwargs, threads=None,
+            sequences=None):
         self.seq_file = seq_file
         self.msa_file = msa_file
         self.kwargs = kwargs
+        self.threads = threads # passed as --thread, if given
+        self.sequences = sequences
 
     def get_msa_name(self):
         """Gets name if not specified by user"""
+        if not self.seq_file: # sequences from memory; msa_file is used as is
+            return
         if not self.msa_file:
             self.msa_file = self.seq_file.rsplit('.',1)[0] + '.mfa'
         target_dir = os.path.split(self.seq_file)[0]
@@ -24,38 +38,69 @@ class MAFFT:
     def run(self, mode):
         """Choose to run"""
         self.get_msa_name()
-        self.check_input_file()
         if mode == 'file':
+            self.check_input_file()
             self.run_from_file()
         elif mode == 'stdin':
             self.run_from_stdin()
 
+    def submit(self):
+        """
+        Same as run('stdin'), but returns a Future for the executor job rather
+        than waiting for MAFFT to finish
+        """
+        self.get_msa_name()
+        return executor.get_executor().submit(self.get_stdin_job())
+
     def run_from_file(self):
         """Calls mafft on a target file"""
+        job = executor.get_executor().run(self.get_file_job())
+        if not job.succeeded():
+            print("Could not run MAFFT for {}".format(
+                self.seq_file))
+        return job
+
+    def get_file_job(self):
+        """Returns an executor job to align the target file"""
+        # cannot use shell redirects, instead set stdout as target file
+        #print("Running mafft for {}".format(self.seq_file))
+        return self.get_job(self.seq_file, self.msa_file)
+
+    def get_job(self, infile, outfile, stdin=None):
+        """Returns an executor job for the given input and output"""
         args = []
-        args.extend(['mafft-linsi', self.seq_file])
+        args.append('mafft-linsi')
         if self.kwargs:
             for k,v in self.kwargs:
                 args.append('--' + str(k)) # need to check this
                 args.append(str(v))
-        try:
-            # cannot use shell redirects, instead set stdout as target file
-            o_file = open(self.msa_file,'wb')
-            #e_file = open(self.get_tmp_output(),'wb')
-            #print("Running mafft for {}".format(self.seq_file))
-            # Somehow a PIPE works better here than an output file?
-            subprocess.run(args, stdout=o_file,
-                    stderr=subprocess.PIPE) # prevents clogging terminal window
-            #mafft_line = 'mafft-linsi ' + str(self.seq_file) + ' > ' + str(self.msa_file)
-            #p = subprocess.Popen(mafft_line, shell=True)
-            #p.communicate()
-        except(Exception):
-            print("Could not run MAFFT for {}".format(
-                self.seq_file))
+        if self.threads:
+            args.extend(['--thread', str(self.threads)])
+        args.append(infile)
+        # Somehow a PIPE works better here than an output file?
+        return executor.Job(args, name='mafft', stdin=stdin, stdout=outfile,
+                stderr=executor.PIPE, # prevents clogging terminal window
+                cores=(self.threads if self.threads else 1))
 
     def run_from_stdin(self):
-        """Calls mafft using sequences from input stream"""
-        pass # to be implemented
+        """
+        Calls mafft using sequences from input stream; if there is no msa_file,
+        the alignment is on the returned job as stdout_data
+        """
+        job = executor.get_executor().run(self.get_stdin_job())
+        if not job.succeeded():
+            print("Could not run MAFFT for {}".format(
+                self.seq_file if self.seq_file else 'input sequences'))
+        return job
+
+    def get_stdin_job(self):
+        """Returns an executor job that streams the filtered input to MAFFT"""
+        if self.sequences is not None:
+            lines = filter_lines(self.sequences)
+        else:
+            lines = filter_lines(read_lines(self.seq_file))
+        return self.get_job('-', (self.msa_file if self.msa_file else
+            executor.PIPE), stdin=lines)
 
     def get_tmp_output(self):
         """
@@ -74,8 +119,19 @@ class MAFFT:
         """
         new_file = self.seq_file.rsplit('.',1)[0] + '_filtered.fa'
         with open(self.seq_file,'U') as i, open(new_file,'w') as o:
-            for line in i:
-                if not line.startswith('>'):
-                    line = line.replace('.','-')
+            for line in filter_lines(i):
                 o.write(line)
         self.seq_file = new_file
+
+def read_lines(filepath):
+    """Yields the lines of a file, which is only opened once they are read"""
+    with open(filepath) as i:
+        for line in i:
+            yield line
+
+def filter_lines(lines):
+    """Replaces illegal characters in sequence lines with gap characters"""
+    for line in lines:
+        if not line.startswith('>'):
+            line = line.replace('.','-')
+        yield line
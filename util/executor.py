@@ -0,0 +1,333 @@
+"""
+This module contains a single executor for running the external programs used by
+Goat (BLAST, HMMer, MAFFT, RAxML). Each program run is described by a Job, and
+all jobs are run as asyncio subprocesses on one event loop in a background
+thread, so that many concurrent runs do not each need a thread of their own.
+
+The executor bounds the number of cores in use by running jobs (each job uses
+one, unless it is multi-threaded), applies per-job
+timeouts, allows cancelling jobs, and streams stdout/stderr either to a file,
+into memory, or to a line callback as output arrives. Each change in job state
+is reported to any registered listeners as a JobEvent; listeners are called
+from the executor thread, so GUI code should hand events off to its own thread
+(e.g. with event_generate) rather than touch widgets directly.
+
+Wrappers call run() to block until a job is done, or submit() to get back a
+concurrent.futures.Future and keep going.
+"""
+
+import os, time, asyncio, threading, subprocess
+
+# Placeholder - should be through settings eventually
+max_jobs = os.cpu_count() or 1 # core budget shared by all running programs
+
+# Values for Job stdout/stderr besides a filepath or None (discard)
+PIPE = subprocess.PIPE # capture output in memory
+STDOUT = subprocess.STDOUT # stderr only; send to the same place as stdout
+
+class Job:
+    """
+    A single run of an external program. stdin may be a string or bytes to
+    write to the program, or an iterable of them (e.g. lines) that is written
+    piece by piece as the program reads it; stdout and stderr may each be None (discarded), a
+    filepath to stream output into, or PIPE to keep output in memory as bytes
+    on self.stdout_data/self.stderr_data. on_stdout/on_stderr are optionally
+    called with each line of output (as bytes) as it is produced. cores is the
+    number of threads the program is told to use (e.g. with --cpu).
+    """
+    def __init__(self, args, name=None, stdin=None, stdout=None, stderr=None,
+            timeout=None, cwd=None, on_stdout=None, on_stderr=None, cores=1):
+        self.args = [str(arg) for arg in args]
+        self.name = name if name else os.path.basename(self.args[0])
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timeout = timeout # seconds, or None to wait indefinitely
+        self.cwd = cwd
+        self.on_stdout = on_stdout
+        self.on_stderr = on_stderr
+        self.cores = max(1, int(cores))
+        self.state = 'pending' # running, finished, failed, timeout, cancelled
+        self.returncode = None
+        self.error = None # exception, if the program could not be run
+        self.stdout_data = b''
+        self.stderr_data = b''
+        self.start_time = None
+        self.end_time = None
+
+    def elapsed(self):
+        """Seconds spent running, so far or in total"""
+        if self.start_time is None:
+            return 0.0
+        end = self.end_time if self.end_time else time.time()
+        return end - self.start_time
+
+    def succeeded(self):
+        """True if the program ran to completion with a zero exit status"""
+        return self.state == 'finished' and self.returncode == 0
+
+class JobEvent:
+    """Reports a change in the state of a job to executor listeners"""
+    def __init__(self, job, state):
+        self.job = job
+        self.name = job.name
+        self.state = state
+        self.returncode = job.returncode
+        self.elapsed = job.elapsed()
+
+    def is_done(self):
+        """True for any event that ends a job"""
+        return self.state in ('finished','failed','timeout','cancelled')
+
+class Executor:
+    """
+    Runs jobs on an event loop in a daemon thread; the loop is started on first
+    use. Running programs use at most max_jobs cores between them; other jobs
+    wait their turn.
+    """
+    def __init__(self, max_jobs=max_jobs):
+        self.max_jobs = max(1, int(max_jobs))
+        self._loop = None
+        self._thread = None
+        self._free_cores = self.max_jobs
+        self._slots = None # notified whenever cores are freed
+        self._futures = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts the event loop thread, if not already running"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            def run_loop():
+                asyncio.set_event_loop(self._loop)
+                self._slots = asyncio.Condition()
+                ready.set()
+                self._loop.run_forever()
+            self._thread = threading.Thread(target=run_loop, daemon=True)
+            self._thread.start()
+            ready.wait()
+
+    def shutdown(self):
+        """Cancels all outstanding jobs and stops the event loop"""
+        self.cancel_all()
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join()
+                self._loop.close()
+            self._loop = None
+            self._thread = None
+
+    def submit(self, job):
+        """Schedules a job; returns a concurrent.futures.Future for the job"""
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self._run(job), self._loop)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def run(self, job):
+        """Runs a job and blocks until it is done; returns the job"""
+        return self.submit(job).result()
+
+    def get_cores(self, max_cores=None):
+        """
+        Returns the number of threads a new multi-threaded job should use: an
+        even share of the core budget among the jobs already submitted and
+        this one, so that a few jobs use all cores but many jobs use one each
+        """
+        with self._lock:
+            num_jobs = len(self._futures) + 1
+        cores = max(1, self.max_jobs // num_jobs)
+        if max_cores:
+            cores = min(cores, max_cores)
+        return cores
+
+    def cancel(self, future):
+        """Cancels a submitted job; a running program is killed"""
+        return future.cancel()
+
+    def cancel_all(self):
+        """Cancels every job that has not finished yet"""
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()
+
+    def add_listener(self, listener):
+        """Registers a callable to be called with each JobEvent"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Stops sending events to a listener"""
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def _discard(self, future):
+        """Stops tracking a future once it is done"""
+        with self._lock:
+            self._futures.discard(future)
+
+    def _emit(self, job, state):
+        """Sets the job state and notifies all listeners"""
+        job.state = state
+        event = JobEvent(job, state)
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(event)
+            except(Exception):
+                pass # a bad listener should not stop the job
+
+    async def _acquire(self, cores):
+        """Waits until enough cores are free for a job, and takes them"""
+        async with self._slots:
+            await self._slots.wait_for(lambda: self._free_cores >= cores)
+            self._free_cores -= cores
+
+    async def _release(self, cores):
+        async with self._slots:
+            self._free_cores += cores
+            self._slots.notify_all()
+
+    async def _run(self, job):
+        """Runs a single job once enough cores are free"""
+        cores = min(job.cores, self.max_jobs) # a larger job would never start
+        await self._acquire(cores)
+        try:
+            handles = []
+            proc = None
+            try:
+                stdout = self._open_target(job.stdout, handles)
+                stderr = self._open_target(job.stderr, handles)
+                proc = await asyncio.create_subprocess_exec(*job.args,
+                        stdin=(subprocess.PIPE if job.stdin is not None
+                            else subprocess.DEVNULL),
+                        stdout=(subprocess.PIPE if stdout is not None
+                            else subprocess.DEVNULL),
+                        stderr=(subprocess.STDOUT if job.stderr == STDOUT
+                            else subprocess.PIPE if stderr is not None
+                            else subprocess.DEVNULL),
+                        cwd=job.cwd)
+                job.start_time = time.time()
+                self._emit(job, 'running')
+                tasks = [self._feed(proc, job.stdin)]
+                if proc.stdout is not None:
+                    tasks.append(self._pump(proc.stdout, job, 'stdout', stdout,
+                        job.on_stdout))
+                if proc.stderr is not None:
+                    tasks.append(self._pump(proc.stderr, job, 'stderr', stderr,
+                        job.on_stderr))
+                tasks.append(proc.wait())
+                await asyncio.wait_for(asyncio.gather(*tasks), job.timeout)
+                job.returncode = proc.returncode
+                job.end_time = time.time()
+                self._emit(job, 'finished')
+            except(asyncio.TimeoutError):
+                self._kill(proc)
+                await proc.wait() # reap the killed program
+                job.returncode = proc.returncode
+                job.end_time = time.time()
+                self._emit(job, 'timeout')
+            except(asyncio.CancelledError):
+                self._kill(proc)
+                if proc is not None:
+                    try: # reap the killed program, even if cancelled again
+                        await asyncio.shield(proc.wait())
+                    except(asyncio.CancelledError):
+                        pass
+                    job.returncode = proc.returncode
+                job.end_time = time.time()
+                self._emit(job, 'cancelled')
+                raise
+            except(Exception) as e: # e.g. program not found
+                self._kill(proc)
+                job.error = e
+                job.end_time = time.time()
+                self._emit(job, 'failed')
+            finally:
+                for handle in handles:
+                    handle.close()
+        finally:
+            await self._release(cores)
+        return job
+
+    def _open_target(self, target, handles):
+        """Returns an open file for a filepath target, PIPE, or None"""
+        if target is None or target == STDOUT:
+            return None
+        if target == PIPE:
+            return PIPE
+        handle = open(target,'wb')
+        handles.append(handle)
+        return handle
+
+    async def _feed(self, proc, data):
+        """Writes stdin data to the program, then closes its stdin"""
+        if data is None:
+            return
+        if isinstance(data, (str, bytes)):
+            data = [data]
+        try:
+            for chunk in data:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8') # note the encoding
+                proc.stdin.write(chunk)
+                await proc.stdin.drain() # waits while the program catches up
+        except(BrokenPipeError, ConnectionResetError):
+            pass # program exited without reading all input
+        finally:
+            proc.stdin.close()
+
+    async def _pump(self, stream, job, name, target, on_line, chunk_size=65536):
+        """Streams output from the program to its target as it arrives"""
+        partial = b''
+        chunks = [] # PIPE output, joined once at the end
+        try:
+            while True:
+                chunk = await stream.read(chunk_size)
+                if not chunk:
+                    break
+                if target == PIPE:
+                    chunks.append(chunk)
+                elif target is not None:
+                    target.write(chunk)
+                if on_line:
+                    lines = (partial + chunk).split(b'\n')
+                    partial = lines.pop()
+                    for line in lines:
+                        on_line(line + b'\n')
+            if on_line and partial:
+                on_line(partial)
+        finally:
+            if chunks:
+                setattr(job, name + '_data', getattr(job, name + '_data') +
+                        b''.join(chunks))
+
+    def _kill(self, proc):
+        """Kills a program that is still running"""
+        if proc is not None and proc.returncode is None:
+            try:
+                proc.kill()
+            except(ProcessLookupError):
+                pass # already exited
+
+# Shared by all wrappers so that the limit on concurrent jobs is global
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Returns the executor shared by all of Goat"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = Executor()
+        return _executor
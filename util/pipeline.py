@@ -0,0 +1,175 @@
+"""
+This module contains a small engine for running multi-stage analyses as a graph
+of tasks rather than as a fixed sequence of phases. Each task names the tasks it
+depends on and is started as soon as all of them are done, so independent
+branches of an analysis (e.g. the stages for different queries) proceed at their
+own pace instead of waiting for the slowest branch at every phase.
+
+All tasks run on the thread that calls Pipeline.run(), and so share its database
+connection. A task that has to wait for an external program (or anything else
+that finishes elsewhere) is written as a generator that yields a Future, or a
+collection of Futures, from the shared executor (see util.executor); the task
+is put aside and resumed once at least one of them is done, while other tasks
+keep running. Completion is signalled by the futures themselves, so there is no
+polling or sleeping between stages.
+"""
+
+import queue, threading
+from concurrent.futures import Future
+
+class Task:
+    """
+    A single node in the graph. func is called with no arguments and either
+    returns a value, or is a generator function whose return value becomes the
+    task's result. self.future is resolved once the task is finished, so other
+    tasks can wait on it as well.
+    """
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.state = 'pending' # running, done, failed, skipped
+        self.result = None
+        self.error = None
+        self.future = Future()
+        self._gen = None # generator of a running task, if any
+
+    def is_finished(self):
+        return self.state in ('done','failed','skipped')
+
+class Pipeline:
+    """
+    Runs a graph of tasks; tasks can be added before or while running. A task
+    that fails is reported, and all tasks that depend on it are skipped, but
+    the rest of the graph is run to the end.
+    """
+    def __init__(self, listener=None):
+        self.tasks = {}
+        self.order = [] # task names, in the order they were added
+        self.listener = listener # called with each task as its state changes
+        self._events = queue.Queue() # tasks to resume
+        self._lock = threading.Lock()
+
+    def add(self, name, func, deps=()):
+        """Adds a task; its dependencies must be added before it is run"""
+        if name in self.tasks:
+            raise ValueError("Task {} already exists".format(name))
+        task = Task(name, func, deps)
+        self.tasks[name] = task
+        self.order.append(name)
+        return task
+
+    def run(self):
+        """
+        Runs tasks until every task is finished; returns True if none of them
+        failed or was skipped
+        """
+        while True:
+            self.start_ready()
+            if all(task.is_finished() for task in self.tasks.values()):
+                break
+            if not any(task.state == 'running' for task in self.tasks.values()):
+                for task in self.tasks.values(): # e.g. a missing dependency
+                    if not task.is_finished():
+                        self.skip(task, 'unmet dependencies')
+                break
+            self.step(self._events.get()) # waits for a future to finish
+        return all(task.state == 'done' for task in self.tasks.values())
+
+    def start_ready(self):
+        """Starts every pending task whose dependencies are all done"""
+        started = True
+        while started: # tasks that finish at once may make others ready
+            started = False
+            for name in list(self.order):
+                task = self.tasks[name]
+                if task.state != 'pending':
+                    continue
+                deps = [self.tasks.get(dep) for dep in task.deps]
+                if any(dep is not None and dep.state in ('failed','skipped')
+                        for dep in deps):
+                    self.skip(task, 'a dependency did not finish')
+                    started = True
+                elif all(dep is not None and dep.state == 'done' for dep in deps):
+                    self.start(task)
+                    started = True
+
+    def start(self, task):
+        """Calls the task; generator tasks run until their first wait"""
+        task.state = 'running'
+        self.notify(task)
+        try:
+            result = task.func()
+        except(Exception) as e:
+            self.fail(task, e)
+            return
+        if hasattr(result, 'send') and hasattr(result, 'throw'): # generator
+            task._gen = result
+            self.step(task)
+        else:
+            self.finish(task, result)
+
+    def step(self, task):
+        """Resumes a generator task until it waits again or returns"""
+        try:
+            waiting = task._gen.send(None)
+        except(StopIteration) as e:
+            self.finish(task, e.value)
+        except(Exception) as e:
+            self.fail(task, e)
+        else:
+            self.wait(task, waiting)
+
+    def wait(self, task, waiting):
+        """Resumes the task once any of the futures it yielded is done"""
+        if isinstance(waiting, Future):
+            waiting = [waiting]
+        else:
+            waiting = list(waiting)
+        if not waiting: # nothing to wait for; resume on the next event
+            self._events.put(task)
+            return
+        resumed = [False]
+        def on_done(future):
+            with self._lock:
+                if resumed[0]: # another future already resumed the task
+                    return
+                resumed[0] = True
+            self._events.put(task)
+        for future in waiting:
+            future.add_done_callback(on_done)
+
+    def finish(self, task, result):
+        task.state = 'done'
+        task.result = result
+        task._gen = None
+        task.future.set_result(result)
+        self.notify(task)
+
+    def fail(self, task, error):
+        print("Could not run {}: {}".format(task.name, error))
+        task.state = 'failed'
+        task.error = error
+        task._gen = None
+        task.future.set_result(None)
+        self.notify(task)
+
+    def skip(self, task, reason):
+        task.state = 'skipped'
+        task.error = reason
+        task.future.set_result(None)
+        self.notify(task)
+
+    def notify(self, task):
+        """Reports a change in task state to the listener, if any"""
+        if self.listener:
+            try:
+                self.listener(task)
+            except(Exception):
+                pass # a bad listener should not stop the pipeline
+
+    def count(self, state=None):
+        """Returns the number of tasks, optionally only those in one state"""
+        if state is None:
+            return len(self.tasks)
+        return sum(1 for task in self.tasks.values() if task.state == state)
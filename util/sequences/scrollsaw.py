@@ -11,29 +11,47 @@ object, which itself takes care of actually running the scrollsaw protocol
 (comparing all files for distance between sequences, gathering accessions up
 to the number required, and then writing these sequences out as their own
 specific scrollsaw file).
+
+Distances are either computed by RAxML for each pair of group files, aligned
+separately ('raxml'), or, much faster, from a single alignment of all of a
+query's sequences, computed in process (see phylo.distances) and then summed
+over the same pairs of groups ('p', 'poisson' or 'lg'). For many sequences,
+'sketch' distances compare k-mer sketches without aligning anything (see
+phylo.sketch); the closest candidates of each group can then be re-ranked by
+aligning only them and computing one of the models above. Either way, distances
+are cached by sequence content (see phylo.distance_cache), so running ScrollSaw
+again with other parameters does not align or compute them again.
 """
 
 import os
 from itertools import combinations
 
+import numpy as np
 from Bio import SeqIO
 
 from util import util
+from records import fasta_index
 from util.sequences import seqs_from_summary
 from util.alignment import mafft
-from phylo import raxml
+from phylo import raxml, distances, distance_cache, sketch
 
 # Eventually go through settings
 tmp_dir = '/Users/cklinger/git/Goat/tmp'
+use_cache = True # reuse distances of earlier runs; see phylo.distance_cache
+rerank_factor = 5 # candidates re-ranked per group, as a multiple of num_seqs
 
 class SummaryScrollSaw:
-    def __init__(self, basename, summary_obj, target_dir, sort_group, num_seqs):
+    def __init__(self, basename, summary_obj, target_dir, sort_group, num_seqs,
+            distance='raxml', rerank=None):
         self.bname = basename
         self.mobj = summary_obj
         self.target_dir = target_dir
         self.sgroup = sort_group
         self.num_seqs = num_seqs
+        self.distance = distance
+        self.rerank = rerank
         self.gdict = None # populated during run
+        self.cache = distance_cache.DistanceCache() if use_cache else None
 
     def run(self):
         """
@@ -46,8 +64,10 @@ class SummaryScrollSaw:
             for sg,sg_file in self.gdict[qid]:
                 qgroup_dict[sg_file] = sg
             q_scrollsaw = QueryScrollSaw(qid, qgroup_dict, self.target_dir,
-                    self.num_seqs)
+                    self.num_seqs, self.distance, self.cache, self.rerank)
             q_scrollsaw.run()
+        if self.cache:
+            self.cache.commit()
 
     def get_sequences(self):
         """Calls seqs_from_summary with appropriate params"""
@@ -57,17 +77,22 @@ class SummaryScrollSaw:
         self.gdict = writer.sg_dict
 
 class QueryScrollSaw:
-    def __init__(self, query, qgroup_dict, target_dir, num_seqs):
+    def __init__(self, query, qgroup_dict, target_dir, num_seqs,
+            distance='raxml', cache=None, rerank=None):
         self.qid = query
         self.gdict = qgroup_dict
         self.target_dir = target_dir
         self.num_seqs = int(num_seqs)
+        self.distance = distance # 'raxml', 'sketch', or a model in phylo.distances
+        self.rerank = rerank # model in phylo.distances to re-rank sketch candidates
+        self.cache = cache # a phylo.distance_cache.DistanceCache, if any
         self.num_start_files = self.calc_num_start_files()
         self.dist_dict = {} # dictionary to track distances for each sequence
         self.file_dict = {} # dictinary to compare seq_id to file_path
         self.id_dict = {} # dictionary to compare seq_id to simplified id
         self.rev_id_dict = {} # determines whether old headers already have unique headers
         self.counter = util.IDCounter() # for creating unique, short, IDs
+        self.seq_dict = {} # sequence lines for each simplified id
         self.files = [] # keep track of all files and delete them at the end
 
     def calc_num_start_files(self):
@@ -75,51 +100,186 @@ class QueryScrollSaw:
         return int(len(self.gdict.keys()))
 
     def run(self):
+        if self.distance == 'raxml':
+            self.run_pairs()
+        elif self.distance == 'sketch':
+            self.run_sketch()
+        else:
+            self.run_matrix()
+
+    def run_pairs(self):
+        """Aligns and runs RAxML for each pair of group files"""
         sg_files = list(self.gdict.keys())
         for f1,f2 in combinations(sg_files,2): # all files
             sg1 = self.gdict[f1]
             sg2 = self.gdict[f2]
-            # Combine files into new file
-            new_seq_file = self.cat_and_dist(f1,f2,sg1,sg2)
-            self.files.append(new_seq_file)
-            # Align file
-            msa_file = new_seq_file.rsplit('.',1)[0] + '.mfa'
-            self.files.append(msa_file)
-            mafft.MAFFT(new_seq_file,msa_file).run_from_file()
-            # Run RAxML to get distances
-            dist_base = (os.path.basename(msa_file)).rsplit('.',1)[0] # without extension
-            raxml.RAxML(msa_file, dist_base, tmp_dir).get_distances()
-            dist_file = os.path.join(tmp_dir,
-                    ('RAxML_distances.' + dist_base))
-            self.files.append(dist_file)
+            headers = self.get_headers(self.get_short_lines(f1) +
+                    self.get_short_lines(f2))
+            dist = self.fetch_distances(headers)
+            if dist is None:
+                # Combine files into new file
+                new_seq_file = self.cat_and_dist(f1,f2,sg1,sg2)
+                self.files.append(new_seq_file)
+                # Align file
+                msa_file = new_seq_file.rsplit('.',1)[0] + '.mfa'
+                self.files.append(msa_file)
+                mafft.MAFFT(new_seq_file,msa_file).run_from_file()
+                # Run RAxML to get distances
+                dist_base = (os.path.basename(msa_file)).rsplit('.',1)[0] # without extension
+                raxml.RAxML(msa_file, dist_base, tmp_dir).get_distances()
+                dist_file = os.path.join(tmp_dir,
+                        ('RAxML_distances.' + dist_base))
+                self.files.append(dist_file)
+                dist = self.read_distance_file(dist_file, headers)
+                self.store_distances(headers, dist)
             # Add distances to dict
-            self.add_distances_to_dict(dist_file)
+            self.add_distances_to_dict(headers, dist)
         self.write_outfiles()
         for tmp_file in self.files:
             os.remove(tmp_file)
 
+    def run_matrix(self):
+        """
+        Aligns all group files at once, streamed into MAFFT, and computes all
+        distances from that alignment. Each sequence gets the same total as
+        run_pairs would give it: distances to the sequences of other groups
+        once, and to those of its own group once for every other group.
+        """
+        sg_files = list(self.gdict.keys())
+        if len(sg_files) > 1: # otherwise there are no pairs to compare
+            lines = []
+            for infile in sg_files:
+                lines.extend(self.get_short_lines(infile))
+            headers, dist = self.get_aligned_distances(lines, self.distance)
+            if dist is not None:
+                self.add_matrix_to_dict(headers, dist)
+        self.write_outfiles()
+
+    def run_sketch(self):
+        """
+        Computes k-mer sketch distances between all sequences, without aligning
+        them, and sums them like run_matrix. If rerank is set, only the closest
+        candidates of each group are kept and their distances are computed
+        again from an alignment of just those sequences.
+        """
+        sg_files = list(self.gdict.keys())
+        if len(sg_files) > 1:
+            headers = []
+            for infile in sg_files:
+                headers.extend(self.get_headers(self.get_short_lines(infile)))
+            model = sketch.get_model_name()
+            dist = self.fetch_distances(headers, model)
+            if dist is None:
+                seqs = [''.join(''.join(self.seq_dict[header]).split()) for
+                        header in headers]
+                dist = sketch.get_distances((headers, seqs))
+                self.store_distances(headers, dist, model)
+            self.add_matrix_to_dict(headers, dist)
+            if self.rerank:
+                self.rerank_candidates()
+        self.write_outfiles()
+
+    def rerank_candidates(self):
+        """
+        Replaces the sketch totals with totals from an alignment of the best
+        candidates of each group; the other sequences are no longer considered
+        """
+        candidates = self.get_candidates(self.num_seqs * rerank_factor)
+        lines = []
+        for header in candidates:
+            lines.append('>' + header + '\n')
+            lines.extend(self.seq_dict[header])
+        headers, dist = self.get_aligned_distances(lines, self.rerank)
+        if dist is not None: # otherwise keep the sketch totals
+            self.dist_dict = {}
+            self.add_matrix_to_dict(headers, dist)
+
+    def get_candidates(self, num_per_group):
+        """Returns up to num_per_group ids with the lowest totals in each group"""
+        candidates = []
+        added = {}
+        for k,v in sorted(self.dist_dict.items(), key=lambda x: sum(x[1])):
+            sg = self.get_info_from_new_header(k)[2]
+            if added.get(sg, 0) < num_per_group:
+                candidates.append(k)
+                added[sg] = added.get(sg, 0) + 1
+        return candidates
+
+    def get_aligned_distances(self, lines, model):
+        """
+        Returns the ids and distance matrix of sequences in FASTA lines, aligned
+        by streaming them into MAFFT; the matrix is None if MAFFT failed
+        """
+        headers = self.get_headers(lines)
+        dist = self.fetch_distances(headers, model)
+        if dist is None:
+            job = mafft.MAFFT(None, sequences=lines).run_from_stdin()
+            if job.succeeded():
+                headers, seqs = distances.read_fasta(
+                        job.stdout_data.decode('utf-8').splitlines())
+                dist = distances.get_distances((headers, seqs), model)
+                self.store_distances(headers, dist, model)
+        return headers, dist
+
+    def get_headers(self, lines):
+        """Returns the simplified ids in FASTA lines"""
+        return [line[1:].strip() for line in lines if line.startswith('>')]
+
+    def get_hashes(self, headers):
+        """Returns the content hash of the sequence of each simplified id"""
+        return [distance_cache.hash_sequence(''.join(self.seq_dict[header]))
+            for header in headers]
+
+    def fetch_distances(self, headers, model=None):
+        """Returns cached distances between the sequences, or None"""
+        if self.cache is None:
+            return None
+        return self.cache.fetch(model or self.distance, self.get_hashes(headers))
+
+    def store_distances(self, headers, dist, model=None):
+        """Caches the distances between the sequences, if there is a cache"""
+        if self.cache is not None:
+            self.cache.store(model or self.distance, self.get_hashes(headers),
+                    dist)
+
+    def add_matrix_to_dict(self, headers, dist):
+        """Adds the total distance of each sequence to the internal dict"""
+        groups = np.array([self.get_info_from_new_header(header)[2] for
+            header in headers], dtype=object)
+        same_group = groups[:,None] == groups[None,:]
+        num_others = self.num_start_files - 1
+        totals = (np.where(same_group, dist * num_others, dist)).sum(axis=1)
+        for header,total in zip(headers, totals):
+            self.dist_dict[header] = [float(total)]
+
+    def get_short_lines(self, infile):
+        """Returns the lines of a group file, with simplified headers"""
+        lines = []
+        with open(infile) as i:
+            for line in i:
+                if line.startswith('>'):
+                    header = line.strip('\n').lstrip('>')
+                    if header in self.rev_id_dict.keys():
+                        new_header = self.rev_id_dict[header]
+                    else:
+                        new_header = self.get_new_id(header)
+                        self.rev_id_dict[header] = new_header
+                    self.id_dict[new_header] = header # compare to old header
+                    self.file_dict[header] = infile # keep track of where the header came from
+                    self.seq_dict[new_header] = []
+                    lines.append('>' + new_header + '\n')
+                else:
+                    self.seq_dict[new_header].append(line)
+                    lines.append(line) # cleaned up by MAFFT.get_stdin_job
+        return lines
+
     def cat_and_dist(self, f1, f2, sg1, sg2):
         """Cats two files and populates dist_dict with simplified headers"""
         basename = str(self.qid) + sg1 + sg2 + '.fa'
         outpath = os.path.join(tmp_dir, basename) # gets a unique filename
         with open(outpath,'w') as o:
             for infile in (f1,f2):
-                with open(infile,'U') as i:
-                    for line in i:
-                        if line.startswith('>'):
-                            header = line.strip('\n').lstrip('>')
-                            if header in self.rev_id_dict.keys():
-                                new_header = self.rev_id_dict[header]
-                            else:
-                                new_header = self.get_new_id(header)
-                                self.rev_id_dict[header] = new_header
-                            self.id_dict[new_header] = header # compare to old header
-                            self.file_dict[header] = infile # keep track of where the header came from
-                            # write shorter header to new file
-                            o.write('>' + new_header + '\n')
-                        else:
-                            line = line.replace('.','-')
-                            o.write(line) # re-write to outfile
+                o.writelines(mafft.filter_lines(self.get_short_lines(infile)))
         return outpath
 
     def get_new_id(self, old_id):
@@ -127,22 +287,36 @@ class QueryScrollSaw:
         id_num = self.counter.get_new_id()
         return ('seq' + str(id_num))
 
-    def add_distances_to_dict(self, dfile):
-        """Adds values from file to internal dictionary"""
-        with open(dfile,'U') as d:
+    def read_distance_file(self, dfile, headers):
+        """
+        Returns the distances in a RAxML file as a matrix in the order of
+        headers; pairs missing from the file are NaN
+        """
+        index = {header:i for i,header in enumerate(headers)}
+        dist = np.full((len(headers), len(headers)), np.nan)
+        np.fill_diagonal(dist, 0.0)
+        with open(dfile) as d:
             for line in d:
-                l = line.strip('\n')
-                llist = l.split()
-                acc1 = llist[0]
-                acc2 = llist[1]
-                dist = float(llist[2]) # need float to sum properly
-
-                for acc in (acc1,acc2):
-                    try:
-                        self.dist_dict[acc].append(dist)
-                    except(KeyError):
-                        self.dist_dict[acc] = []
-                        self.dist_dict[acc].append(dist)
+                llist = line.split()
+                if len(llist) < 3:
+                    continue
+                i = index[llist[0]]
+                j = index[llist[1]]
+                dist[i,j] = dist[j,i] = float(llist[2])
+        return dist
+
+    def add_distances_to_dict(self, headers, dist):
+        """Adds the distance of each pair of sequences to internal dictionary"""
+        for i,j in combinations(range(len(headers)), 2):
+            value = float(dist[i,j]) # need float to sum properly
+            if np.isnan(value):
+                continue
+            for acc in (headers[i],headers[j]):
+                try:
+                    self.dist_dict[acc].append(value)
+                except(KeyError):
+                    self.dist_dict[acc] = []
+                    self.dist_dict[acc].append(value)
 
     def write_outfiles(self):
         """Writes reduced files to target_dir"""
@@ -178,10 +352,10 @@ class QueryScrollSaw:
                     num_added += 1
         with open(outpath,'w') as o:
             for acc_file in to_write.keys():
-                seq_records = SeqIO.parse(acc_file,'fasta')
+                seq_records = fasta_index.get_file_index(acc_file).get_records(
+                        descriptions=to_write[acc_file])
                 for record in seq_records:
-                    if str(record.description) in to_write[acc_file]:
-                        SeqIO.write(record, o, 'fasta')
+                    SeqIO.write(record, o, 'fasta')
 
     def get_info_from_new_header(self, acc):
         """Traverses myriad of dicts to return sg associated with a new acc"""
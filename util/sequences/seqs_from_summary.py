@@ -15,7 +15,7 @@ and then, based on the specified mode(s), write the sequences to relevant
 file(s).
 """
 
-import os,re
+import os
 
 from Bio import SeqIO
 
@@ -25,7 +25,7 @@ from util import util
 
 class SummarySeqWriter:
     def __init__(self, basename, summary_obj, target_dir, hit_type,
-            mode, extra_groups=None, add_query_to_file=False):
+            mode, extra_groups=None, add_query_to_file=False, queries=None):
         self.bname = str(basename)
         self.mobj = summary_obj
         self.target_dir = target_dir
@@ -33,6 +33,7 @@ class SummarySeqWriter:
         self.mode = mode
         self.extras = extra_groups
         self.add_query = add_query_to_file
+        self.queries = queries # only these queries, if given
         # dbs are global objects
         self.rdb = configs['record_db']
         # internal data structure to track record objects
@@ -69,6 +70,8 @@ class SummarySeqWriter:
         """Run for each query in summary"""
         #print('calling collect_ids')
         for query in self.mobj.query_list:
+            if self.queries is not None and not query in self.queries:
+                continue
             #print(query)
             self.collect_dbs(query)
             #print()
@@ -140,8 +143,7 @@ class SummarySeqWriter:
             robj = self.rdb[rid]
             for k,v in robj.files.items():
                 if v.filetype == ftype:
-                    target_file = v.filepath
-            seq_records = self.parse(target_file)
+                    target_index = v.get_index() # see records.fasta_index
             for hit_list in self.hdict[rid]:
                 query = hit_list[0]
                 hit_type = hit_list[1]
@@ -166,15 +168,9 @@ class SummarySeqWriter:
                             target_files.append(sg_file)
                     # could continue for arbitrary number of sets...
                     # get all the records to write just once
-                    to_write = []
-                    written = []
-                    #seq_records = self.parse(target_file)
-                    for record in seq_records:
-                        if (record.description in hits or\
-                            re.sub('\t','   ',record.description) in hits):
-                            if not record.description in written:
-                                to_write.append(record)
-                                written.append(record.description) # ensures not written more than once
+                    # index lookup by description; each record is found at
+                    # most once, so none is written more than once
+                    to_write = target_index.get_records(descriptions=hits)
                     #print(to_write)
                     # finally, write all records to all desired files
                     for tfile in target_files:
@@ -195,24 +191,60 @@ class SummarySeqWriter:
                             o.close() # always close file
             #print()
 
+    def get_fasta_lines(self, query):
+        """
+        Returns the FASTA lines that write_to_output would write to the 'all'
+        file for a query, without writing anything; an empty list if there
+        are no hits of the wanted types. Call collect_ids() first.
+        """
+        lines = []
+        ftype = self.mobj.fwd_dbtype # type of file to look through
+        for rid in self.hdict.keys():
+            hit_lists = [hit_list for hit_list in self.hdict[rid] if
+                    hit_list[0] == query and hit_list[1] in self.htype]
+            if not hit_lists:
+                continue
+            robj = self.rdb[rid]
+            for k,v in robj.files.items():
+                if v.filetype == ftype:
+                    target_index = v.get_index() # see records.fasta_index
+            for hit_list in hit_lists:
+                to_write = target_index.get_records(descriptions=hit_list[2:])
+                if not lines and self.add_query: # query goes first
+                    lines.extend(self.get_query_lines(query))
+                for record in to_write:
+                    lines.extend(self.get_record_lines(record))
+        return lines
+
     def write_query_seq(self, qid, outfile):
         """
         Write the query sequence associated with a given query ID to the output
         file as the first entry. Does not discriminate by hit_type (but could
         in the future?). Useful for intermediate alignments.
         """
+        outfile.writelines(self.get_query_lines(qid))
+
+    def get_query_lines(self, qid):
+        """Returns the FASTA lines for a query; see write_query_seq"""
+        lines = []
         qdb = configs['query_db']
         qobj = qdb[qid]
         if qobj.search_type == 'seq':
-            outfile.write('>' + str(qobj.description) + '\n')
+            lines.append('>' + str(qobj.description) + '\n')
             for chunk in util.split_input(str(qobj.sequence)):
                 #print(chunk)
-                outfile.write(chunk + '\n')
+                lines.append(chunk + '\n')
         elif qobj.search_type == 'hmm':
             pass # do we want to write for other query types?
+        return lines
 
     def write_result_seq(self, record, outfile):
         """Stand-in for now"""
-        outfile.write('>' + str(record.description) + '\n')
+        outfile.writelines(self.get_record_lines(record))
+
+    def get_record_lines(self, record):
+        """Returns the FASTA lines for a record"""
+        lines = ['>' + str(record.description) + '\n']
         for chunk in util.split_input(str(record.seq)):
-            outfile.write(chunk + '\n')
+            lines.append(chunk + '\n')
+        return lines